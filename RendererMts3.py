@@ -1,5 +1,5 @@
 from distutils.log import debug
-import os, logging, sys
+import os, logging, sys, hashlib
 import dateutil
 import dateutil.parser
 import datetime
@@ -8,59 +8,308 @@ import drjit as dr
 import mitsuba as mi
 from pysolar.solar import *
 import binary_loader
+import culling
+import instancing
+import multi_irradiancemeter
+import tessellation
+import shape_cache
+import snapshot
+import spatial_order
+import tracing
 from cumulative_sky import CumulativeSky
 
 #mi.set_variant("cuda_ad_rgb")
 #mi.set_variant("llvm_ad_rgb")
 mi.set_variant("scalar_rgb")
 
+MULTI_SENSOR_VARIANT = "llvm_ad_rgb" # or "cuda_ad_rgb"
+
 from mitsuba import ScalarTransform4f as T
 
 ADD_GROUND = True
 
 default_ground_size = 1e6 #100 km
 
+BASE_SCENE_CACHE_SIZE = 8 # camera setups kept loaded (requests with a custom camera add one each)
+
 class RendererMts3():
 
-    def __init__(self, _verbose=False, _use_batch_render=False) -> None:
+    def __init__(self, _verbose=False, _use_batch_render=False, _use_multi_sensor=False, _merge_obstacles=False, _instance_obstacles=False, _load_threads=0, _persistent_scene=False, _shape_cache_bytes=0, _camera_image=False, _cull_distance=None, _cull_elevation=None, _tile_count=0, _tile_period=None, _spatial_order=False, _snapshot_dir=None, _defer_stream_shapes=False) -> None:
         self.mi_scene = None
+        self.mi_params = None # parameters of the camera, sun and sky of the loaded scene (persistent scene)
+        self.shape_properties = None # to_world and mesh vertex_positions of the loaded scene, written directly
+        self.environment_layout = None
+        self.columns_layout = None
+        self.columns_values = None # primitive parameters of the loaded scene, only changed shapes are updated
         self.sensor_count = None
         self.verbose = _verbose
         self.use_batch = _use_batch_render
+        self.use_multi = _use_multi_sensor
+        self.merge_obstacles = _merge_obstacles
+        self.instance_obstacles = _instance_obstacles
+        self.load_threads = _load_threads # worker threads of mi.load_dict (0 = all cores, 1 = serial loading)
+        self.parallel_load = _load_threads != 1
+        # primitive scenes with the layout of the loaded one are written into it (see load_sim_dict), instanced obstacles are always rebuilt
+        self.persistent_scene = _persistent_scene and not _instance_obstacles
+        self.defer_shapes = self.parallel_load # primitive shapes stay dicts until the scene is loaded
+        # the streaming builder creates the shapes while the body arrives, deferred they are created in parallel after it (see load_stream)
+        self.defer_stream_shapes = _defer_stream_shapes and self.parallel_load
+        # obstacle shapes of unchanged entities are reused by the next columnar scene (analytic obstacles only)
+        # obstacle entities farther than _cull_distance (m) from the sensors or below _cull_elevation (deg) are dropped (see culling.py)
+        self.cull_distance = _cull_distance
+        self.cull_elevation = _cull_elevation
+        # the scene is a plot surrounded by _tile_count rings of instanced copies (obstacles only), _tile_period (x, z) in m is the
+        # planting pitch of the plot (its bounding box is smaller); the multi sensor samples every shape and can not measure next to instances
+        if _tile_count > 0 and (_tile_period is None or min(_tile_period) <= 0):
+            raise ValueError(f'Tiling needs a positive tile period (x, z) in m, got: {_tile_period}')
+        self.tile_count = _tile_count if not _use_multi_sensor else 0
+        self.tile_period = _tile_period
+        if _tile_count > 0 and _use_multi_sensor:
+            logging.warn('Tiling is not supported with the multi sensor, the plot is measured alone.')
+        # batch and multi sensor films of columnar scenes in Morton order of the sensors (opt-in), the measurements are returned in file order
+        self.spatial_order = _spatial_order
+        self.sensor_order = None # film position -> file order rank of the sensors of the loaded scene (see spatial_order.py)
+        # processed scenes of load_path are cached in _snapshot_dir (see snapshot.py), tiles are built from the whole plot instead
+        self.snapshot_dir = _snapshot_dir if self.tile_count == 0 else None
+        if _snapshot_dir is not None and self.tile_count > 0:
+            logging.warn('Scene snapshots are not supported with tiling, the scene is loaded from the file.')
+        self.camera_image = _camera_image # the default camera renders an image (get_render_image), otherwise its film is 1x1
+        self.base_scenes = {} # loaded integrator, camera and ground by camera parameters (see get_base_scene)
+        self.mi_base_scene = None
+        self.base_scene_key = None # get_base_scene key of mi_base_scene
+        self.static_shapes = {} # loaded shapes of the static obstacle scene, added to every scene (see load_static_binary)
+        self.shape_cache = shape_cache.ShapeCache(_shape_cache_bytes) if _shape_cache_bytes > 0 and not (_merge_obstacles or _instance_obstacles) else None
 
         logging.info('Mitsuba3 - available variants: %s', mi.variants())
 
-        mi.set_variant("scalar_rgb")
-        origin, target = RendererMts3.get_camera(2.0, 4.0)
-        self.mi_base_scene = RendererMts3.create_base_scene(default_ground_size, _spp=16, _cam_origin=origin, _cam_target=target)
+        # the multi sensor (see multi_irradiancemeter.py) is a Python plugin and needs a JIT variant
+        if self.use_multi:
+            mi.set_variant(MULTI_SENSOR_VARIANT)
+            multi_irradiancemeter.register()
+        else:
+            mi.set_variant("scalar_rgb")
 
     def load_binary(self, _binary_array, _latitude, _longitude, _datetime_str, _spp, _epw_path=None, _end_datetime_str=None, cam = None):
-        scene_dict = binary_loader.load_binary(_binary_array, self.verbose)
+        scene_dict = binary_loader.load_binary(_binary_array, self.verbose, _columnar=True)
         return self.load_sim_dict(scene_dict,_latitude, _longitude, _datetime_str, _spp, _epw_path, _end_datetime_str, cam)
 
+    def load_stream(self, _stream, _length, _latitude, _longitude, _datetime_str, _spp, _epw_path=None, _end_datetime_str=None, cam = None, _chunk_size=1<<16):
+        '''
+        Reads and decodes the scene from a file-like object (e.g. the request body) chunk by chunk,
+        primitive entities (format 2/3) are converted to Mitsuba objects as soon as they are complete.
+        '''
+        decoder = binary_loader.StreamDecoder(self.verbose)
+        builder = PrimitiveSceneBuilder(_spp, self.use_batch, self.use_multi, self.merge_obstacles, self.instance_obstacles, self.defer_stream_shapes)
+
+        remaining = _length
+        while remaining > 0:
+            with tracing.span('receive'):
+                chunk = _stream.read(min(_chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            with tracing.span('decode', bytes=len(chunk)):
+                entities = decoder.feed(chunk)
+            with tracing.span('scene_construction', entities=len(entities)):
+                for group, objk, surfaces in entities:
+                    if decoder.format == 1:
+                        continue # meshes need the points data at the end of the payload
+                    elif group == 'sensors':
+                        builder.add_sensors(objk, surfaces)
+                    else:
+                        builder.add_obstacles(objk, surfaces)
+
+        scene_dict = decoder.finish()
+        with tracing.span('scene_construction'):
+            if scene_dict['format'] == 1:
+                sim_objects, (minv, avgv, maxv), sensor_count = RendererMts3.load_sim_scene(scene_dict, _spp, self.use_batch, self.use_multi, self.merge_obstacles, self.instance_obstacles, self.defer_shapes, self.shape_cache)
+            else:
+                sim_objects, (minv, avgv, maxv), sensor_count = builder.finish()
+        logging.debug(f"Scene statistics: {minv}, {avgv}, {maxv}")
+        logging.debug(f"Sensor count: {sensor_count}")
+
+        return self.load_dict(sim_objects, sensor_count, _latitude, _longitude, _datetime_str, _spp, _epw_path, _end_datetime_str, cam)
+
     def load_path(self, _path, _latitude, _longitude, _datetime_str, _spp, _epw_path=None, _end_datetime_str=None):
-        scene_dict = binary_loader.load_path(_path, self.verbose)
+        if self.snapshot_dir is not None:
+            return self.load_snapshot_path(_path, _latitude, _longitude, _datetime_str, _spp, _epw_path, _end_datetime_str)
+        scene_dict = binary_loader.load_path(_path, self.verbose, _columnar=True)
         return self.load_sim_dict(scene_dict,_latitude, _longitude, _datetime_str, _spp, _epw_path, _end_datetime_str)
 
+    def load_snapshot_path(self, _path, _latitude, _longitude, _datetime_str, _spp, _epw_path=None, _end_datetime_str=None):
+        '''
+        load_path through a snapshot of the scene file: the first load writes the culled scene data and the merged obstacle meshes
+        to the snapshot directory (see snapshot.py), the following loads of the same file read them instead of decoding and processing it.
+        '''
+        key = snapshot.scene_key(_path, {'merge_obstacles': self.merge_obstacles, 'cull_distance': self.cull_distance, 'cull_elevation': self.cull_elevation})
+        with tracing.span('snapshot'):
+            cached = snapshot.load(self.snapshot_dir, key)
+        if cached is None:
+            scene_dict = binary_loader.load_path(_path, self.verbose, _columnar=True)
+            if self.cull_distance is not None or self.cull_elevation is not None:
+                scene_dict, _ = culling.cull_obstacles(scene_dict, self.cull_distance, self.cull_elevation)
+            with tracing.span('snapshot'):
+                # the scene is built from the written snapshot as well, the first and the following runs load the same geometry
+                cached = snapshot.save(self.snapshot_dir, key, _path, *RendererMts3.snapshot_meshes(scene_dict, self.merge_obstacles))
+        scene_dict, meshes = cached
+
+        sim_objects, (minv, avgv, maxv), sensor_count, sensor_order = self.build_sim_scene(scene_dict, _spp)
+        logging.debug(f"Scene statistics: {minv}, {avgv}, {maxv}")
+        logging.debug(f"Sensor count: {sensor_count}")
+        for name, path, twosided in meshes:
+            sim_objects[name] = {'type': 'ply', 'filename': path, 'bsdf': RendererMts3.get_bsdf(twosided)}
+
+        return self.load_dict(sim_objects, sensor_count, _latitude, _longitude, _datetime_str, _spp, _epw_path, _end_datetime_str, _sensor_order=sensor_order)
+
+    @staticmethod
+    def snapshot_meshes(_scene_data, _merge_obstacles=False):
+        '''
+        Splits scene data into the part kept as scene data in a snapshot and the obstacle meshes {name: (mi.Mesh, twosided)}:
+        the obstacle triangles of a mesh scene are merged into one mesh, the obstacles of a primitive scene only with _merge_obstacles.
+        '''
+        if _scene_data.get('columnar', False):
+            if not _merge_obstacles:
+                return _scene_data, {}
+            columns = {}; meshes = {}
+            for type_id, name in binary_loader.primitive_names.items():
+                if name not in _scene_data['primitives']:
+                    continue
+                column = _scene_data['primitives'][name]
+                is_sensor = np.asarray(column['is_sensor'], dtype=bool)
+                obstacles = {key: np.asarray(values)[~is_sensor] for key, values in column.items()}
+                if len(obstacles['index']) > 0:
+                    mesh_name, mesh = RendererMts3.create_merged_mesh(type_id, obstacles, _vertex_normals=False)
+                    meshes[mesh_name] = (mesh, type_id in [1, 8])
+                columns[name] = {key: np.asarray(values)[is_sensor] for key, values in column.items()}
+            return {**_scene_data, 'primitives': columns}, meshes
+
+        _, surfaces = RendererMts3.flatten_surfaces(_scene_data['obstacles'])
+        meshes = {}
+        if sum(len(s) for s in surfaces) > 0:
+            # every surface keeps its own vertices (as the separate surface meshes of load_sim_scene_meshes), so the computed vertex normals are the same
+            surfaces = RendererMts3.extract_surfaces_triangle_data(np.asarray(_scene_data['pointArray']), surfaces)
+            offsets = np.cumsum([0] + [len(vertices) for vertices, _ in surfaces[:-1]])
+            vertices = np.concatenate([vertices for vertices, _ in surfaces])
+            triangles = np.concatenate([triangles + np.uint32(offset) for (_, triangles), offset in zip(surfaces, offsets)])
+            meshes['obstacles-mesh'] = (RendererMts3.create_triangle_mesh('obstacles-mesh', vertices, triangles, _vertex_normals=False), True)
+        return {**_scene_data, 'obstacles': {}}, meshes
+
+    def load_static_binary(self, _binary_array):
+        '''
+        Registers a static obstacle scene (e.g. greenhouse structures, hedgerows) in any scene format, its shapes are built once
+        and added to every following scene, the requests then only carry the dynamic plants. An empty array removes it.
+        '''
+        scene_dict = binary_loader.load_binary(_binary_array, self.verbose, _columnar=True) if len(_binary_array) > 0 else None
+        self.load_static_dict(scene_dict)
+
+    def load_static_path(self, _path):
+        self.load_static_dict(binary_loader.load_path(_path, self.verbose, _columnar=True))
+
+    def load_static_dict(self, _scene_dict):
+        self.static_shapes = {}
+        self.columns_layout = None # the next scene is built with the new static shapes (see load_sim_dict)
+        if _scene_dict is None:
+            return
+
+        with tracing.span('static_scene'):
+            obstacles, sensor_count = RendererMts3.as_obstacles(_scene_dict)
+            if sensor_count > 0:
+                logging.warn(f'The static scene has {sensor_count} sensors, they are added as obstacles.')
+            sim_objects, _, _ = RendererMts3.load_sim_scene(obstacles, 1, _merge_obstacles=self.merge_obstacles, _instance_obstacles=self.instance_obstacles, _defer_shapes=self.defer_shapes)
+            if self.instance_obstacles or self.use_multi:
+                # shape groups can not be nested and the multi sensor samples every shape of the scene (instances can not),
+                # the shapes are instantiated by a scene of their own and taken from it, their ids are prefixed by load_dict
+                static_scene = self.load_mitsuba_dict({'type': 'scene', **sim_objects})
+                self.static_shapes = {f'static-{shape.id()}': shape for shape in static_scene.shapes()}
+            else:
+                # one instance of a shape group, its acceleration structure is built once and not with every scene
+                group = self.load_mitsuba_dict({'type': 'shapegroup', **sim_objects})
+                self.static_shapes = {'static': mi.load_dict({'type': 'instance', 'shapegroup': group})}
+        logging.info(f'Static scene: {len(self.static_shapes)} shapes')
+
+    def create_tiles(self, _scene_dict):
+        '''
+        Instances of the plot geometry (sensors as obstacles) on a grid of (2 tile_count + 1)^2 plots around the plot,
+        which is added by the caller. The copies form a pseudo-infinite canopy without edge effects at the plot.
+        '''
+        with tracing.span('tiles', count=(2*self.tile_count + 1)**2 - 1):
+            obstacles, _ = RendererMts3.as_obstacles(_scene_dict)
+            # shape groups can not be nested, the copies are not instanced per entity
+            sim_objects, _, _ = RendererMts3.load_sim_scene(obstacles, 1, _merge_obstacles=self.merge_obstacles, _defer_shapes=self.defer_shapes)
+            group = self.load_mitsuba_dict({'type': 'shapegroup', **sim_objects})
+
+        period_x, period_z = self.tile_period
+        logging.debug(f'Tile period: {period_x}, {period_z}')
+
+        tiles = {}
+        for i in range(-self.tile_count, self.tile_count + 1):
+            for j in range(-self.tile_count, self.tile_count + 1):
+                if i != 0 or j != 0:
+                    tiles[f'tile_{i}_{j}'] = {'type': 'instance', 'shapegroup': group, 'to_world': T.translate([i * period_x, 0.0, j * period_z])}
+        return tiles
+
+    @staticmethod
+    def as_obstacles(_scene_data):
+        '''
+        Scene data with all sensor surfaces turned into obstacles, returns (scene data, number of sensors).
+        '''
+        if _scene_data.get('columnar', False):
+            columns = {name: {**column, 'is_sensor': np.zeros(len(column['is_sensor']), dtype=bool)} for name, column in _scene_data['primitives'].items()}
+            sensor_count = sum(int(np.count_nonzero(column['is_sensor'])) for column in _scene_data['primitives'].values())
+            out = {**_scene_data, 'primitives': columns}
+        else:
+            sensor_count = len(_scene_data['sensors'])
+            out = {**_scene_data, 'sensors': {}, 'obstacles': {**_scene_data['obstacles'], **{f'sensor-{objk}': surfaces for objk, surfaces in _scene_data['sensors'].items()}}}
+        return out, sensor_count
+
     def load_sim_dict(self, _scene_dict, _latitude, _longitude, _datetime_str, _spp, _epw_path=None, _end_datetime_str=None, _cam = None):
-        sim_objects, (minv, avgv, maxv), sensor_count = RendererMts3.load_sim_scene(_scene_dict, _spp, self.use_batch)
+        if self.cull_distance is not None or self.cull_elevation is not None:
+            _scene_dict, _ = culling.cull_obstacles(_scene_dict, self.cull_distance, self.cull_elevation)
+
+        # primitives with the layout of the loaded scene are written into it (see load_dict), the shapes are not built
+        columns = _scene_dict if self.persistent_scene and _scene_dict.get('columnar', False) and self.tile_count == 0 else None
+        if columns is not None and self.mi_scene is not None and RendererMts3.get_columns_layout(columns) == self.columns_layout:
+            return self.load_dict(None, self.sensor_count, _latitude, _longitude, _datetime_str, _spp, _epw_path, _end_datetime_str, _cam, _columns=columns)
+
+        sim_objects, (minv, avgv, maxv), sensor_count, sensor_order = self.build_sim_scene(_scene_dict, _spp)
         logging.debug(f"Scene statistics: {minv}, {avgv}, {maxv}")
         logging.debug(f"Sensor count: {sensor_count}")
 
-        return self.load_dict(sim_objects, sensor_count, _latitude, _longitude, _datetime_str, _spp, _epw_path, _end_datetime_str, _cam)
+        if self.tile_count > 0:
+            sim_objects.update(self.create_tiles(_scene_dict))
+
+        return self.load_dict(sim_objects, sensor_count, _latitude, _longitude, _datetime_str, _spp, _epw_path, _end_datetime_str, _cam, _columns=columns, _sensor_order=sensor_order)
+
+    def build_sim_scene(self, _scene_dict, _spp):
+        '''
+        load_sim_scene with the options of the renderer, the sensors of columnar batch and multi sensor scenes are
+        in spatial order, returns the scene objects, statistics, sensor count and the permutation of the sensors (or None).
+        '''
+        sensor_order = None
+        if self.spatial_order and (self.use_batch or self.use_multi) and _scene_dict.get('columnar', False):
+            _scene_dict, sensor_order = spatial_order.reorder_sensors(_scene_dict)
+        with tracing.span('scene_construction'):
+            sim_objects, stats, sensor_count = RendererMts3.load_sim_scene(_scene_dict, _spp, self.use_batch, self.use_multi, self.merge_obstacles, self.instance_obstacles, self.defer_shapes, self.shape_cache)
+        return sim_objects, stats, sensor_count, sensor_order
 
 
     @staticmethod
     def encodeName(objk, surfk):
         return '%s-%s' % (str(objk).zfill(5), str(surfk).zfill(5))
 
-    def load_dict(self, _scene_dict, _sensor_count, _latitude, _longitude, _datetime_str, _spp, _epw_path=None, _end_datetime_str=None, _cam = None) -> None:
+    def load_dict(self, _scene_dict, _sensor_count, _latitude, _longitude, _datetime_str, _spp, _epw_path=None, _end_datetime_str=None, _cam = None, _columns=None, _sensor_order=None) -> None:
+        '''
+        Loads the scene objects with camera, sun and sky. With _scene_dict None the primitives of _columns (same layout as the
+        loaded scene) are written into the loaded scene, as long as the camera and sky have the same layout as well.
+        _sensor_order is the film position -> file order permutation of the sensors (see spatial_order.py).
+        '''
 
         scene_center = [2.5,0.0,0.0]; height = 5.0; distance = 7.0
 
         if _cam is None:
             origin, target = RendererMts3.get_camera(height, distance, scene_center)
-            width = 512
+            # irradiance requests never render the camera, its film is a placeholder
+            width = 512 if self.camera_image else 1
             height = width
             fov = 70
         else:
@@ -72,38 +321,251 @@ class RendererMts3():
 
         logging.debug(f'camera origin: {origin}, target: {target}')
 
-        self.mi_base_scene  = RendererMts3.create_base_scene(default_ground_size, _width=width, _height=height, _fov=fov, _spp=_spp, _cam_origin=origin, _cam_target=target)
+        self.mi_base_scene = self.get_base_scene(width, height, fov, _spp, origin, target)
 
         start_date = dateutil.parser.parse(_datetime_str)
         start_date.replace(tzinfo=datetime.timezone.utc)
 
-        if  _epw_path is not None and _end_datetime_str is not None:
-            logging.info(f'Computing cumulative sky form \'{_datetime_str}\' to \'{_end_datetime_str}\' (EPW file: \'{os.path.split(_epw_path)[-1]}\')')
-            end_date = dateutil.parser.parse(_end_datetime_str)
-            end_date.replace(tzinfo=datetime.timezone.utc)
-
-            cum_sky = CumulativeSky()
-            envmap, hoy_count = cum_sky.compute(_epw_path, start_date, end_date, _only_sun=False)
-            sun_sky = { 'sun_sky': RendererMts3.get_envmap(envmap*0.01, 1.0) }
-        else:
-            sun_direction = RendererMts3.get_sun_direction(_latitude, _longitude, start_date)
-            sun_sky, _, _ = RendererMts3.get_sun_sky(sun_direction, 1000.0)
-            envmap = None; hoy_count = 1
+        with tracing.span('sky'):
+            if  _epw_path is not None and _end_datetime_str is not None:
+                logging.info(f'Computing cumulative sky form \'{_datetime_str}\' to \'{_end_datetime_str}\' (EPW file: \'{os.path.split(_epw_path)[-1]}\')')
+                end_date = dateutil.parser.parse(_end_datetime_str)
+                end_date.replace(tzinfo=datetime.timezone.utc)
 
-        merged_scene = {**self.mi_base_scene, **sun_sky, **_scene_dict}
+                cum_sky = CumulativeSky()
+                envmap, hoy_count = cum_sky.compute(_epw_path, start_date, end_date, _only_sun=False)
+                sun_sky = { 'sun_sky': RendererMts3.get_envmap(envmap*0.01, 1.0) }
+            else:
+                sun_direction = RendererMts3.get_sun_direction(_latitude, _longitude, start_date)
+                sun_sky, _, _ = RendererMts3.get_sun_sky(sun_direction, 1000.0)
+                envmap = None; hoy_count = 1
+
+        environment = {**self.mi_base_scene, **sun_sky}
+        # the cache key identifies the loaded base scene objects, ids of their Python wrappers are reused after an eviction
+        environment_layout = (self.base_scene_key, RendererMts3.get_scene_layout(environment)) if self.persistent_scene else None
+
+        if _scene_dict is None and environment_layout == self.environment_layout:
+            with tracing.span('scene_update'):
+                if self.mi_params is None:
+                    self.traverse_scene(environment)
+                shapes_changed = self.update_primitives(_columns)
+                RendererMts3.update_values(self.mi_params, environment)
+                with tracing.span('params.update'):
+                    updated = self.mi_params.update()
+                    # the acceleration structure is rebuilt by the scene, once for the shapes and the environment
+                    if shapes_changed and not any(isinstance(node, mi.Scene) for node, _ in updated):
+                        self.mi_scene.parameters_changed([])
+            if self.use_multi and _sensor_count > 0:
+                self.mi_scene.sensors()[1].resolve_shapes(self.mi_scene)
+            return envmap, hoy_count
+
+        if _scene_dict is None:
+            _scene_dict, _, _sensor_count, _sensor_order = self.build_sim_scene(_columns, _spp)
+        # here and not in load_sim_scene, which also builds the sensor-free static scene and tiles
+        if _sensor_count < 1:
+            logging.warn('No sensors defined.')
 
-        self.mi_scene = mi.load_dict(merged_scene)
+        merged_scene = {**environment, **self.static_shapes, **_scene_dict}
+        self.mi_params = None
+        self.shape_properties = None
+        self.environment_layout = environment_layout
+        self.columns_layout = RendererMts3.get_columns_layout(_columns) if _columns is not None else None
+        self.columns_values = RendererMts3.get_columns_values(_columns) if _columns is not None else None
+        self.mi_scene = self.load_mitsuba_dict(merged_scene)
+        if self.use_multi and _sensor_count > 0:
+            self.mi_scene.sensors()[1].resolve_shapes(self.mi_scene)
+        if self.shape_cache is not None:
+            self.shape_cache.add_loaded(self.mi_scene)
         self.sensor_count = _sensor_count
+        self.sensor_order = _sensor_order
         return envmap, hoy_count
 
-    def render(self, _ray_count) -> None:
+    def get_base_scene(self, _width, _height, _fov, _spp, _origin, _target):
+        '''
+        Base scene of create_base_scene with its objects (integrator, camera with film and sampler, ground) loaded once
+        per camera parameters, the scenes of consecutive requests share them.
+        '''
+        key = (mi.variant(), _width, _height, _fov, _spp, tuple(_origin), tuple(_target))
+        if key not in self.base_scenes:
+            with tracing.span('base_scene'):
+                base_scene = RendererMts3.create_base_scene(default_ground_size, _width=_width, _height=_height, _fov=_fov, _spp=_spp, _cam_origin=_origin, _cam_target=_target)
+                if len(self.base_scenes) >= BASE_SCENE_CACHE_SIZE:
+                    del self.base_scenes[next(iter(self.base_scenes))]
+                self.base_scenes[key] = {k: mi.load_dict(v) if isinstance(v, dict) else v for k, v in base_scene.items()}
+        self.base_scene_key = key
+        return self.base_scenes[key]
+
+    def load_mitsuba_dict(self, _scene_dict):
+        with tracing.span('mi.load_dict', objects=len(_scene_dict), threads=self.load_threads):
+            # the objects are instantiated by the Dr.Jit thread pool, its size is changed for the load only
+            if self.load_threads > 1:
+                # Dr.Jit 0.4 has no getter, its pool has one thread per core unless set otherwise
+                previous = dr.thread_count() if hasattr(dr, 'thread_count') else mi.util.core_count()
+                dr.set_thread_count(self.load_threads)
+            try:
+                return mi.load_dict(_scene_dict, parallel=self.parallel_load)
+            finally:
+                if self.load_threads > 1:
+                    dr.set_thread_count(previous)
+
+    @staticmethod
+    def get_scene_layout(_value):
+        '''
+        Structure of a scene dict without its updatable values (floats, lists, transforms), two scenes with the same layout
+        have the same objects, plugin types and film sizes.
+        '''
+        if isinstance(_value, dict):
+            return tuple((key, RendererMts3.get_scene_layout(value)) for key, value in _value.items())
+        if isinstance(_value, (str, bool, int)):
+            return _value
+        if isinstance(_value, (float, list, np.ndarray, T)):
+            return None
+        if isinstance(_value, mi.Bitmap):
+            return ('bitmap', _value.width(), _value.height(), _value.channel_count())
+        if isinstance(_value, mi.Object):
+            return 'object' # loaded objects (see get_base_scene) are not updated, load_dict adds the base scene key to the layout
+        return type(_value).__name__
+
+    @staticmethod
+    def get_columns_layout(_scene_data):
+        '''
+        Hash of the primitive structure of a columnar scene (types, entities, surfaces, sensor flags and order).
+        '''
+        h = hashlib.sha1(bytes([_scene_data['format']]))
+        for name in binary_loader.primitive_names.values():
+            column = _scene_data['primitives'].get(name, {})
+            for key in ['entity', 'surface', 'is_sensor', 'index']:
+                h.update(np.ascontiguousarray(column.get(key, [])).tobytes())
+            h.update(b'|')
+        return h.hexdigest()
+
+    @staticmethod
+    def get_columns_values(_scene_data):
+        '''
+        Copies of the primitive parameters of a columnar scene (the columns can be views of the request buffer).
+        '''
+        return {name: {key: np.array(column[key]) for key in ['matrix', 'center', 'radius', 'length'] if key in column}
+                for name, column in _scene_data['primitives'].items()}
+
+    def traverse_scene(self, _environment):
+        '''
+        Splits the parameters of the loaded scene: the shape transforms are written directly and their shapes notified one by one,
+        SceneParameters.update would schedule every parameter of the scene. The camera, sun and sky stay in self.mi_params.
+        '''
+        with tracing.span('mi.traverse'):
+            params = mi.traverse(self.mi_scene)
+        if not RendererMts3.direct_parameters(params):
+            # the shapes are updated through params as well
+            self.shape_properties = {key: None for key in params.keys() if key.endswith('.to_world') or key.endswith('.vertex_positions')}
+            self.mi_params = params
+            return
+        self.shape_properties = {key: (ptr, value_type, node) for key, (ptr, value_type, node, _) in params.properties.items()
+                                 if key.endswith('.to_world') or key.endswith('.vertex_positions')}
+        params.keep([f'{prefix}\\.' for prefix in _environment.keys()])
+        self.mi_params = params
+
+    def update_primitives(self, _columns):
+        '''
+        Writes the transforms of the changed primitives (and merged obstacle meshes) of _columns into the loaded scene
+        and notifies their shapes. Returns whether a shape changed.
+        '''
+        values = RendererMts3.get_columns_values(_columns)
+        format = _columns['format']
+        changed_any = False
+        for type_id, name in binary_loader.primitive_names.items():
+            if name not in _columns['primitives'] or len(_columns['primitives'][name]['index']) == 0:
+                continue
+            column = _columns['primitives'][name]
+            previous = self.columns_values[name]
+            changed = np.zeros(len(column['index']), dtype=bool)
+            for key, current in values[name].items():
+                changed |= np.any((current != previous[key]).reshape((len(changed), -1)), axis=1)
+            if not np.any(changed):
+                continue
+            changed_any = True
+
+            is_sensor = np.asarray(column['is_sensor'], dtype=bool)
+            rows = np.flatnonzero(changed & (is_sensor | (not self.merge_obstacles)))
+            with tracing.span('to_world', type=name, primitives=len(rows)):
+                names = RendererMts3.primitive_surface_names(format, column, rows)
+                to_world = RendererMts3.primitive_to_world(type_id, column, rows).tolist()
+                for shape_name, matrix in zip(names, to_world):
+                    self.set_shape_property(f'{shape_name}.to_world', mi.Transform4f(matrix))
+            if self.shape_cache is not None:
+                # the cached shapes of the moved entities are the loaded ones
+                self.shape_cache.discard(names)
+
+            if self.merge_obstacles and np.any(changed & ~is_sensor):
+                rows = np.flatnonzero(~is_sensor)
+                mesh_name, mesh = RendererMts3.create_merged_mesh(type_id, {key: np.asarray(data)[rows] for key, data in column.items()})
+                self.set_shape_property(f'{mesh_name}.vertex_positions', mi.traverse(mesh)['vertex_positions'])
+
+        self.columns_values = values
+        return changed_any
+
+    def set_shape_property(self, _key, _value):
+        if self.shape_properties[_key] is None:
+            self.mi_params[_key] = _value # notified by mi_params.update (see load_dict)
+            return
+        ptr, value_type, node = self.shape_properties[_key]
+        self.mi_params.set_property(ptr, value_type, _value)
+        node.parameters_changed([_key.rsplit('.', 1)[1]])
+
+    @staticmethod
+    def direct_parameters(_params):
+        '''
+        Whether the parameters can be written directly: SceneParameters.properties, get_property and set_property are internals
+        of Mitsuba's Python wrapper (3.4.1, see README), without them the public item assignment is used.
+        '''
+        return all(hasattr(_params, name) for name in ['properties', 'get_property', 'set_property'])
+
+    @staticmethod
+    def set_parameter(_params, _key, _value):
+        if not RendererMts3.direct_parameters(_params):
+            _params[_key] = _value
+            return
+        # directly, SceneParameters.__setitem__ first compares the old and new value
+        ptr, value_type, _, _ = _params.properties[_key]
+        _params.set_property(ptr, value_type, _value)
+        _params.set_dirty(_key)
+
+    @staticmethod
+    def update_values(_params, _scene_dict):
+        '''
+        Writes the values (floats, lists, transforms, envmap bitmaps) of a scene dict into the parameters of the loaded scene.
+        '''
+        def convert(key, value):
+            if not RendererMts3.direct_parameters(_params):
+                return type(_params[key])(value)
+            ptr, value_type, node, _ = _params.properties[key]
+            return type(_params.get_property(ptr, value_type, node))(value)
+
+        for prefix, value in _scene_dict.items():
+            if not isinstance(value, dict):
+                continue
+            if value['type'] == 'envmap':
+                # the envmap repeats the first column at the end (interpolation across u = 1)
+                data = np.array(value['bitmap'], dtype=np.float32)
+                RendererMts3.set_parameter(_params, f'{prefix}.data', mi.TensorXf(np.concatenate([data, data[:, :1]], axis=1)))
+                RendererMts3.set_parameter(_params, f'{prefix}.scale', convert(f'{prefix}.scale', value['scale']))
+                continue
+            for key, item in value.items():
+                name = f'{prefix}.{key}'
+                if isinstance(item, dict):
+                    RendererMts3.update_values(_params, {name: item})
+                elif name in _params.keys() and isinstance(item, (float, int, list, T)) and not isinstance(item, bool):
+                    RendererMts3.set_parameter(_params, name, convert(name, item))
+
+    def render(self, _ray_count, _seed=0) -> None:
         measurements = []
-        if self.use_batch:
-            measurements = mi.render(self.mi_scene, sensor=1, spp=_ray_count)
+        if (self.use_batch or self.use_multi) and self.sensor_count > 0:
+            with tracing.span('mi.render', sensors=self.sensor_count, spp=_ray_count):
+                measurements = mi.render(self.mi_scene, sensor=1, spp=_ray_count, seed=_seed)
             measurements = np.squeeze(measurements, axis=0)
         else:
             for i in range(self.sensor_count):
-                img = mi.render(self.mi_scene, sensor=i+1, spp=_ray_count)
+                with tracing.span('mi.render', sensor=i+1, spp=_ray_count):
+                    img = mi.render(self.mi_scene, sensor=i+1, spp=_ray_count, seed=_seed)
                 measurements.append(img.array)
             measurements = np.array(measurements)
         if len(measurements) > 0:
@@ -113,16 +575,33 @@ class RendererMts3():
             mean = np.mean(sum)
             maxv = np.max(sum)
             logging.info(f'{minv}, {mean}, {maxv}')
-            measurements = sum
+            measurements = sum if self.sensor_order is None else spatial_order.unpermute(sum, self.sensor_order)
         else:
             logging.warn('No measurements computed.')
             return None
         
         return measurements
 
+    # rays per pass of render_with_error, the passes trace _passes times as many rays per sensor in total
+    @staticmethod
+    def error_pass_spp(_ray_count, _passes):
+        return max(1, _ray_count // _passes)
+
+    # splits the rays into independent passes, the spread of the passes gives the standard error per sensor
+    def render_with_error(self, _ray_count, _passes=4):
+        spp = RendererMts3.error_pass_spp(_ray_count, _passes)
+        passes = [self.render(spp, _seed=p) for p in range(_passes)]
+        if passes[0] is None:
+            return None, None
+        passes = np.array(passes)
+        measurements = np.mean(passes, axis=0).astype(np.float32)
+        errors = (np.std(passes, axis=0, ddof=1) / np.sqrt(_passes)).astype(np.float32)
+        return measurements, errors
+
     # used for debug overlay, renders the scene from a custom camera (camera parameters are incl. in the request)
     def render_for_cam(self, _ray_count, _write_debug_img=False):
-        img = mi.render(self.mi_scene, spp=_ray_count)
+        with tracing.span('mi.render', spp=_ray_count):
+            img = mi.render(self.mi_scene, spp=_ray_count)
         
         if _write_debug_img:
             bm = mi.util.convert_to_bitmap((img / (img+1.0)) ** (1.0/2.2))        
@@ -195,7 +674,153 @@ class RendererMts3():
         return base_scene
 
     @staticmethod
-    def create_triangle_mesh(_name, _vertex_positions, _triangle_indices, _spp=0):
+    def create_triangle_mesh(_name, _vertex_positions, _triangle_indices, _spp=0, _bsdf=None, _vertex_normals=True):
+        '''
+        Builds the mesh in memory, the BSDF (loaded object, default: the shared get_bsdf()) is attached through the mesh properties.
+        With _spp > 0 an irradiancemeter is attached as well and (mesh, sensor) is returned, the sensor has to be added to the scene next to the mesh.
+        Meshes written to PLY files are built without _vertex_normals, the ply plugin computes the same normals when loading them.
+        '''
+        props = mi.Properties()
+        props['bsdf'] = _bsdf if _bsdf is not None else RendererMts3.get_bsdf()
+
+        mesh = mi.Mesh(
+            _name,
+            vertex_count=_vertex_positions.shape[0],
+            face_count=_triangle_indices.shape[0],
+            has_vertex_normals=_vertex_normals,
+            has_vertex_texcoords=False,
+            props=props
+        )
+        # the buffers are assigned directly, SceneParameters.__setitem__ first compares old and new values element by element
+        # (in Python for the scalar variants, seconds for meshes with 100k+ vertices)
+        mesh_params = mi.traverse(mesh)
+        buffers = [('vertex_positions', dr.ravel(mi.TensorXf(_vertex_positions))), ('faces', dr.ravel(mi.TensorXu(_triangle_indices)))]
+        if _vertex_normals:
+            buffers.append(('vertex_normals', dr.ravel(mi.TensorXf(RendererMts3.vertex_normals(_vertex_positions, _triangle_indices)))))
+        for key, value in buffers:
+            RendererMts3.set_parameter(mesh_params, key, value)
+        mesh_params.update()
+
+        if _spp <= 0:
+            return mesh
+
+        # a sensor passed in the mesh properties is attached before the geometry is set (Mitsuba fails on the empty area distribution),
+        # so the sensor is bound to the finished mesh instead
+        sensor = mi.load_dict(RendererMts3.get_mesh_sensor(_spp))
+        sensor.set_shape(mesh)
+        return mesh, sensor
+
+    @staticmethod
+    def vertex_normals(_vertex_positions, _triangle_indices):
+        '''
+        Smooth vertex normals as computed by Mitsuba for meshes without normals (Mesh::recompute_vertex_normals, used by the ply plugin):
+        the face normals weighted by the angle at the vertex, degenerate faces are skipped and vertices without normal get (1, 0, 0).
+        '''
+        vertices = np.asarray(_vertex_positions, dtype=np.float32)
+        faces = np.asarray(_triangle_indices, dtype=np.int64).reshape((-1, 3))
+        points = vertices[faces]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            face_normals = np.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+            face_normals /= np.linalg.norm(face_normals, axis=1, keepdims=True)
+            valid = np.all(np.isfinite(face_normals), axis=1)
+
+            normals = np.zeros((len(vertices), 3), dtype=np.float64)
+            for j in range(3):
+                d0 = points[:, (j + 1) % 3] - points[:, j]
+                d1 = points[:, (j + 2) % 3] - points[:, j]
+                d0 /= np.linalg.norm(d0, axis=1, keepdims=True)
+                d1 /= np.linalg.norm(d1, axis=1, keepdims=True)
+                angles = np.arccos(np.clip(np.sum(d0 * d1, axis=1), -1.0, 1.0))
+                weighted = face_normals[valid] * angles[valid, None]
+                for axis in range(3):
+                    normals[:, axis] += np.bincount(faces[valid, j], weights=weighted[:, axis], minlength=len(vertices))
+
+            lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+            normals = np.where(lengths > 0, normals / lengths, [1.0, 0.0, 0.0])
+        return normals.astype(np.float32)
+
+    @staticmethod
+    def get_mesh_bsdf():
+        return {
+            'type': 'twosided',
+            'material': {
+                'type': 'diffuse',
+                'reflectance': {
+                    'type': 'rgb',
+                    'value': [0.5, 0.5, 0.5]
+                }
+            }
+        }
+
+    @staticmethod
+    def get_diffuse_bsdf():
+        return {
+            'type': 'diffuse',
+            'reflectance': {
+                'type': 'rgb',
+                'value': [0.5, 0.5, 0.5]
+            }
+        }
+
+    # loaded BSDFs by (variant, twosided), see get_bsdf
+    shared_bsdfs = {}
+
+    @staticmethod
+    def get_bsdf(_twosided=True):
+        '''
+        Shared BSDF instance of the scene material (twosided: get_mesh_bsdf, else: get_diffuse_bsdf).
+        All shapes reference the same plugin object instead of loading an own copy of the material.
+        '''
+        key = (mi.variant(), _twosided)
+        if key not in RendererMts3.shared_bsdfs:
+            RendererMts3.shared_bsdfs[key] = mi.load_dict(RendererMts3.get_mesh_bsdf() if _twosided else RendererMts3.get_diffuse_bsdf())
+        return RendererMts3.shared_bsdfs[key]
+
+    @staticmethod
+    def get_mesh_sensor(_spp):
+        return {
+            'type': 'irradiancemeter',
+            'sampler': {
+                'type': 'independent',
+                'sample_count': _spp
+            },
+            'film': {
+                'type': 'hdrfilm',
+                'width': 1,
+                'height': 1,
+                'rfilter': {
+                    'type': 'box',
+                },
+                'pixel_format': 'rgb',
+            },
+        }
+
+    # 'dbatchsensor' sorts after 'camera_base' and before the surface sensors, so it is rendered as sensor 1 (see render)
+    # _sensors maps the child names to the sensors (dicts, refs or loaded objects), the film pixels follow the sorted child names
+    @staticmethod
+    def get_batch_sensor(_spp, _sensors):
+        batch_sensor = {
+            'type': 'batch',
+            'sampler': {
+                'type': 'independent',
+                'sample_count': _spp,
+            },
+            'film': {
+                'type': 'hdrfilm',
+                'width': len(_sensors),
+                'height': 1,
+                'rfilter': {
+                    'type': 'box',
+                },
+                'pixel_format': 'rgb',
+            },
+        }
+        batch_sensor.update(_sensors)
+        return batch_sensor
+
+    # previous mesh construction, writes the mesh to tmp/ and reloads it as ply shape (kept for comparison, see benchmark-scene.py)
+    @staticmethod
+    def create_triangle_mesh_ply(_name, _vertex_positions, _triangle_indices, _spp=0):
 
         vertex_pos = mi.TensorXf(_vertex_positions)
         face_indices = mi.TensorXu(_triangle_indices)
@@ -227,35 +852,11 @@ class RendererMts3():
         ply = {
             "type": "ply",
             "filename": tmp_file_name,
-            "bsdf": {
-                'type': 'twosided',
-                'material': {
-                    'type': 'diffuse',
-                    'reflectance': {
-                        'type': 'rgb',
-                        'value': [0.5, 0.5, 0.5]
-                    }
-                }
-            }
+            "bsdf": RendererMts3.get_bsdf()
         }
 
         if _spp > 0:
-            ply['sensor'] = {
-                'type': 'irradiancemeter',
-                'sampler': {
-                    'type': 'independent',
-                    'sample_count': _spp
-                },
-                'film': {
-                    'type': 'hdrfilm',
-                    'width': 1,
-                    'height': 1,
-                    'rfilter': {
-                        'type': 'box',
-                    },
-                    'pixel_format': 'rgb',
-                },
-            }
+            ply['sensor'] = RendererMts3.get_mesh_sensor(_spp)
 
         mesh = mi.load_dict(ply)
         os.remove(tmp_file_name)
@@ -283,18 +884,61 @@ class RendererMts3():
         return triangle_vertex_positions, triangle_indices
 
     @staticmethod
-    def load_sim_scene(_scene_data, _spp=128, _use_batch=False):
+    def flatten_surfaces(_objects):
+        names = []
+        surfaces = []
+        for objk, object_surfaces in _objects.items():
+            for surfk, tindices in object_surfaces.items():
+                names.append(RendererMts3.encodeName(objk, surfk))
+                surfaces.append(np.asarray(tindices).reshape((-1, 3)))
+        return names, surfaces
+
+    @staticmethod
+    def extract_surfaces_triangle_data(_vertex_positions, _surfaces):
+        '''
+        Bulk variant of extract_triangle_data for a list of (trianglesCount, 3) index arrays.
+        All indices are concatenated and remapped with one np.unique over (surface, vertex) keys,
+        returns a list of (vertex positions, triangle indices) per surface (vertices sorted by their global index).
+        '''
+        if len(_surfaces) == 0:
+            return []
+
+        counts = np.array([np.size(s) for s in _surfaces], dtype=np.int64)
+        indices = np.concatenate([np.ravel(s) for s in _surfaces]).astype(np.int64)
+        segments = np.repeat(np.arange(len(_surfaces), dtype=np.int64), counts)
+        # an index out of range would fall into the key range of the next surface
+        if len(indices) > 0 and (indices.min() < 0 or indices.max() >= len(_vertex_positions)):
+            raise IndexError(f'Triangle index out of range [{indices.min()}, {indices.max()}], point count: {len(_vertex_positions)}')
+
+        point_count = max(len(_vertex_positions), 1)
+        keys, inverse = np.unique(segments * point_count + indices, return_inverse=True)
+        key_segments = keys // point_count
+
+        # first unique key of every surface, local indices are relative to it
+        vertex_offsets = np.searchsorted(key_segments, np.arange(len(_surfaces) + 1))
+        local_indices = (inverse - vertex_offsets[segments]).astype(np.uint32)
+
+        vertices = _vertex_positions[keys % point_count]
+        index_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        return [(vertices[vertex_offsets[j]:vertex_offsets[j+1]], local_indices[index_offsets[j]:index_offsets[j+1]].reshape((-1, 3)))
+                for j in range(len(_surfaces))]
+
+    @staticmethod
+    def load_sim_scene(_scene_data, _spp=128, _use_batch=False, _use_multi=False, _merge_obstacles=False, _instance_obstacles=False, _defer_shapes=False, _shape_cache=None):
         if _scene_data['format'] == 1:
-            return RendererMts3.load_sim_scene_meshes(_scene_data, _spp)
+            return RendererMts3.load_sim_scene_meshes(_scene_data, _spp, _use_batch=_use_batch, _use_multi=_use_multi)
+        elif _scene_data.get('columnar', False):
+            return RendererMts3.load_sim_scene_columns(_scene_data, _spp, _use_batch=_use_batch, _use_multi=_use_multi, _merge_obstacles=_merge_obstacles, _instance_obstacles=_instance_obstacles, _defer_shapes=_defer_shapes, _shape_cache=_shape_cache)
         elif _scene_data['format'] >= 2:
-            return RendererMts3.load_sim_scene_primitives(_scene_data, _spp, _use_batch=_use_batch)
+            return RendererMts3.load_sim_scene_primitives(_scene_data, _spp, _use_batch=_use_batch, _use_multi=_use_multi, _merge_obstacles=_merge_obstacles, _instance_obstacles=_instance_obstacles, _defer_shapes=_defer_shapes)
 
     @staticmethod
-    def load_sim_scene_meshes(_scene_data, _spp=128):
+    def load_sim_scene_meshes(_scene_data, _spp=128, _in_memory=True, _use_batch=False, _use_multi=False):
 
         mi_scene = {}
 
-        vertex_positions = np.array(_scene_data['pointArray'])
+        vertex_positions = np.asarray(_scene_data['pointArray'])
         avgv = np.average(vertex_positions, axis=0)
         minv = np.min(vertex_positions, axis=0)
         maxv = np.max(vertex_positions, axis=0)
@@ -302,28 +946,43 @@ class RendererMts3():
 
         # add sensors
         sensor_count = 0
-        objects = _scene_data['sensors']
-        for objk, surfaces in objects.items():
-            for surfk, tindices in surfaces.items():
-                surface_name = RendererMts3.encodeName(objk, surfk)
-                triangle_indices = np.array(tindices)
-                surface_vertices, surface_triangle_indices = RendererMts3.extract_triangle_data(vertex_positions, triangle_indices)
-                mesh = RendererMts3.create_triangle_mesh(surface_name, surface_vertices, surface_triangle_indices, _spp)
-                mi_scene[surface_name] = mesh
-                sensor_count += 1
+        batch_sensors = {}
+        names, surfaces = RendererMts3.flatten_surfaces(_scene_data['sensors'])
+        with tracing.span('mesh_extraction', surfaces=len(surfaces)):
+            surfaces = RendererMts3.extract_surfaces_triangle_data(vertex_positions, surfaces)
+        for surface_name, (surface_vertices, surface_triangle_indices) in zip(names, surfaces):
+            if _use_multi:
+                mesh = RendererMts3.create_triangle_mesh(surface_name, surface_vertices, surface_triangle_indices)
+            elif _use_batch:
+                # loaded objects can not be referenced by id, the sensors are passed to the batch sensor directly
+                mesh, sensor = RendererMts3.create_triangle_mesh(surface_name, surface_vertices, surface_triangle_indices, _spp)
+                batch_sensors[f'{surface_name}-sensor'] = sensor
+            elif _in_memory:
+                mesh, sensor = RendererMts3.create_triangle_mesh(surface_name, surface_vertices, surface_triangle_indices, _spp)
+                mi_scene[f'{surface_name}-sensor'] = sensor
+            else:
+                mesh = RendererMts3.create_triangle_mesh_ply(surface_name, surface_vertices, surface_triangle_indices, _spp)
+            mi_scene[surface_name] = mesh
+            sensor_count += 1
+
+        # one batch sensor containing the irradiancemeters of all surfaces, RendererMts3.render then calls mi.render once
+        if len(batch_sensors) > 0:
+            mi_scene['dbatchsensor'] = RendererMts3.get_batch_sensor(_spp, batch_sensors)
+
+        # or a single sensor measuring all sensor meshes
+        if _use_multi and sensor_count > 0:
+            mi_scene['dmultisensor'] = multi_irradiancemeter.get_sensor(_spp, names)
 
         # add obstacles
-        objects = _scene_data['obstacles']
-        for objk, surfaces in objects.items():
-            for surfk, tindices in surfaces.items():
-                surface_name = RendererMts3.encodeName(objk, surfk)
-                triangle_indices = np.array(tindices)
-                surface_vertices, surface_triangle_indices = RendererMts3.extract_triangle_data(vertex_positions, triangle_indices)
+        names, surfaces = RendererMts3.flatten_surfaces(_scene_data['obstacles'])
+        with tracing.span('mesh_extraction', surfaces=len(surfaces)):
+            surfaces = RendererMts3.extract_surfaces_triangle_data(vertex_positions, surfaces)
+        for surface_name, (surface_vertices, surface_triangle_indices) in zip(names, surfaces):
+            if _in_memory:
                 mesh = RendererMts3.create_triangle_mesh(surface_name, surface_vertices, surface_triangle_indices)
-                mi_scene[surface_name] = mesh
-
-        if sensor_count < 1:
-            logging.warn('No sensors defined.')
+            else:
+                mesh = RendererMts3.create_triangle_mesh_ply(surface_name, surface_vertices, surface_triangle_indices)
+            mi_scene[surface_name] = mesh
 
         return mi_scene, (minv, avgv, maxv), sensor_count
 
@@ -336,16 +995,7 @@ class RendererMts3():
         out = {
             'type': 'disk',
             'to_world': T(mat)@T.rotate([1,0,0], 90),
-            'bsdf': {
-                'type': 'twosided',
-                'material': {
-                    'type': 'diffuse',
-                    'reflectance': {
-                        'type': 'rgb',
-                        'value': [0.5, 0.5, 0.5]
-                    }
-                }
-            }
+            'bsdf': RendererMts3.get_bsdf(),
         }
         return out
     @staticmethod
@@ -362,13 +1012,7 @@ class RendererMts3():
             'p1': [0, data['length'], 0],
             'radius': data['radius'],
             'to_world': T(mat),
-            'bsdf': {
-                'type': 'diffuse',
-                'reflectance': {
-                    'type': 'rgb',
-                    'value': [0.5, 0.5, 0.5]
-                }
-            }
+            'bsdf': RendererMts3.get_bsdf(_twosided=False),
         }
         return out
 
@@ -382,13 +1026,7 @@ class RendererMts3():
             'type': 'sphere',
             'center': data['center'],
             'radius': data['radius'],
-            'bsdf': {
-                'type': 'diffuse',
-                'reflectance': {
-                    'type': 'rgb',
-                    'value': [0.5, 0.5, 0.5]
-                }
-            }
+            'bsdf': RendererMts3.get_bsdf(_twosided=False),
         }
         return out
 
@@ -401,135 +1039,224 @@ class RendererMts3():
         out = {
             'type': 'rectangle',
             'to_world': T(mat),
-            'bsdf': {
-                'type': 'twosided',
-                'material': {
-                    'type': 'diffuse',
-                    'reflectance': {
-                        'type': 'rgb',
-                        'value': [0.5, 0.5, 0.5]
-                    }
-                }
-            }
+            'bsdf': RendererMts3.get_bsdf(),
         }
         return out
 
     @staticmethod
-    def load_sim_scene_primitives(_scene_data, _spp=128, _use_batch=False):
+    def load_sim_scene_primitives(_scene_data, _spp=128, _use_batch=False, _use_multi=False, _merge_obstacles=False, _instance_obstacles=False, _defer_shapes=False):
+        builder = PrimitiveSceneBuilder(_spp, _use_batch, _use_multi, _merge_obstacles, _instance_obstacles, _defer_shapes)
+        for objk, surfaces in _scene_data['sensors'].items():
+            builder.add_sensors(objk, surfaces)
+        for objk, surfaces in _scene_data['obstacles'].items():
+            builder.add_obstacles(objk, surfaces)
+        return builder.finish()
 
-        #(1 = disk, 2 = cylinder/stem, 4 = sphere/shoot, 8 = rectangle/leaf)
-        primitive_map = {
-            1: RendererMts3.disk,
-            2: RendererMts3.cylinder,
-            4: RendererMts3.sphere,
-            8: RendererMts3.rectangle,
-        }
-
-        primitive_map_name = {
-            1: 'disk',
-            2: 'cylinder',
-            4: 'sphere',
-            8: 'rectangle',
-        }
+    # disk: Mitsuba disk (XY) rotated into XZ, see disk
+    disk_rotation = np.array(T.rotate([1,0,0], 90).matrix, dtype=np.float64)
 
-        mi_scene = {}
+    @staticmethod
+    def primitive_shapes(_type_id, _column, _rows):
+        '''
+        Shape dicts (same as disk/cylinder/sphere/rectangle) of the selected rows of a primitive column,
+        the transforms of all rows are computed with one matrix product and passed to Mitsuba as lists.
+        '''
+        if _type_id == 4:
+            centers = _column['center'][_rows].tolist()
+            radii = _column['radius'][_rows].tolist()
+            bsdf = RendererMts3.get_bsdf(_twosided=False)
+            return [{'type': 'sphere', 'center': c, 'radius': r, 'bsdf': bsdf} for c, r in zip(centers, radii)]
+
+        matrices = np.zeros((len(_rows), 4, 4))
+        matrices[:, :3, :] = np.asarray(_column['matrix'][_rows], dtype=np.float64).reshape((-1, 3, 4))
+        matrices[:, 3, 3] = 1.0
+        if _type_id == 1:
+            matrices = matrices @ RendererMts3.disk_rotation
+        to_world = [T(m) for m in matrices.tolist()] # ~3x faster than T(ndarray)
+
+        if _type_id == 2:
+            lengths = _column['length'][_rows].tolist()
+            radii = _column['radius'][_rows].tolist()
+            bsdf = RendererMts3.get_bsdf(_twosided=False)
+            return [{'type': 'cylinder', 'p0': [0, 0, 0], 'p1': [0, l, 0], 'radius': r, 'to_world': t, 'bsdf': bsdf} for l, r, t in zip(lengths, radii, to_world)]
+
+        bsdf = RendererMts3.get_bsdf()
+        name = 'disk' if _type_id == 1 else 'rectangle'
+        return [{'type': name, 'to_world': t, 'bsdf': bsdf} for t in to_world]
+
+    # cylinder: frame of the +Y axis (Mitsuba's coordinate_system), columns s, t, n
+    cylinder_frame = np.array([[1,0,0,0], [0,0,1,0], [0,-1,0,0], [0,0,0,1]], dtype=np.float64)
 
-        batch_shapes = []
+    @staticmethod
+    def primitive_to_world(_type_id, _column, _rows):
+        '''
+        (N,4,4) to_world of the loaded shapes of the selected rows, Mitsuba folds the sphere center and radius
+        and the cylinder p0, p1 and radius into it (see sphere.cpp, cylinder.cpp).
+        '''
+        matrices = np.zeros((len(_rows), 4, 4))
+        matrices[:, 3, 3] = 1.0
+        if _type_id == 4:
+            radii = np.asarray(_column['radius'][_rows], dtype=np.float64)
+            matrices[:, [0, 1, 2], [0, 1, 2]] = radii[:, None]
+            matrices[:, :3, 3] = _column['center'][_rows]
+            return matrices
+
+        matrices[:, :3, :] = np.asarray(_column['matrix'][_rows], dtype=np.float64).reshape((-1, 3, 4))
+        if _type_id == 1:
+            matrices = matrices @ RendererMts3.disk_rotation
+        elif _type_id == 2:
+            scale = np.zeros((len(_rows), 4, 4))
+            scale[:, 0, 0] = scale[:, 1, 1] = _column['radius'][_rows]
+            scale[:, 2, 2] = _column['length'][_rows]
+            scale[:, 3, 3] = 1.0
+            matrices = matrices @ RendererMts3.cylinder_frame @ scale
+        return matrices
 
-        minv = np.array([sys.float_info.max]*3)
-        avgv = np.array([0.0,0.0,0.0])
-        maxv = np.array([sys.float_info.min]*3)
+    @staticmethod
+    def primitive_surface_names(_format, _column, _rows):
+        '''
+        Names of the selected rows of a primitive column, the same as encodeName of the entity and surface keys of binary_loader.
+        '''
+        entities = _column['entity'][_rows].tolist()
+        surfaces = _column['surface'][_rows].tolist()
+        if _format == 2:
+            groups = ['sensor' if is_sensor else 'obstacle' for is_sensor in _column['is_sensor'][_rows].tolist()]
+            return [f'{g}-entity{str(e).zfill(5)}-surface{str(s).zfill(5)}' for g, e, s in zip(groups, entities, surfaces)]
+        return [f'entity{str(e).zfill(5)}-surface{str(s).zfill(5)}' for e, s in zip(entities, surfaces)]
 
-        sensor = {
-            'type': 'irradiancemeter',
-            'sampler': {
-                'type': 'independent',
-                'sample_count': _spp
-            },
-            'film': {
-                'type': 'hdrfilm',
-                'width': 1,
-                'height': 1,
-                'rfilter': {
-                    'type': 'box',
-                },
-                'pixel_format': 'rgb',
-            },
-        }
+    @staticmethod
+    def create_merged_mesh(_type_id, _column, _vertex_normals=True):
+        '''
+        Tessellates all primitives of a column (dict of arrays, see tessellation.tessellate) into one triangle mesh.
+        '''
+        name = binary_loader.primitive_names[_type_id]
+        with tracing.span('tessellation', type=name, primitives=len(_column['radius'] if _type_id == 4 else _column['matrix'])):
+            points, triangles = tessellation.tessellate(_type_id, _column)
+            vertices, faces = tessellation.merge(points, triangles, tessellation.mirrored(_column))
+        # same material as the analytic shape
+        bsdf = RendererMts3.get_bsdf(_twosided=_type_id in [1, 8])
+        return f'obstacles-{name}', RendererMts3.create_triangle_mesh(f'obstacles-{name}', vertices, faces, _bsdf=bsdf, _vertex_normals=_vertex_normals)
 
-        # add sensors
-        sensor_count = 0
-        objects = _scene_data['sensors']
-        for objk, surfaces in objects.items():
-            for surfk, data in surfaces.items():
-                surface_name = RendererMts3.encodeName(objk, surfk)
-                
-                # process AABB
-                pos = None
-                
-                if 'center' in data:
-                    pos = data['center']
-
-                if pos is not None:
-                    avgv += pos
-                    minv = np.minimum(minv, pos)
-                    maxv = np.maximum(maxv, pos)
-
-                primitive = primitive_map[data['type']](data)
-
-                if _use_batch:
-                    mi_scene[f'{surface_name}-sensor'] = sensor
-                    primitive[f'{surface_name}-shape-sensor-ref'] = {
-                            'type': 'ref',
-                            'id': f'{surface_name}-sensor',
-                        }
-                    batch_shapes.append((surface_name, primitive))
+    @staticmethod
+    def cached_obstacle_shapes(_format, _columns, _shape_cache):
+        '''
+        Obstacle shapes of the columns (type id -> dict of arrays): the cached shapes of unchanged entities and dicts
+        for the others, which are cached once the scene is loaded (see shape_cache.py).
+        '''
+        shapes = {}
+        missed = {}
+        _shape_cache.pending = {}
+        with tracing.span('shape_cache'):
+            for objk, key in shape_cache.entity_keys(_format, _columns).items():
+                cached = _shape_cache.get(key)
+                if cached is None:
+                    missed[objk] = key
                 else:
-                    primitive['sensor'] = sensor
-                    mi_scene[surface_name] = mi.load_dict(primitive)
-                sensor_count += 1
-
-        if _use_batch:
-            batch_sensor = {
-                'type': 'batch',
-                'sampler': {
-                    'type': 'independent',
-                    'sample_count': _spp,
-                },
-                'film': {
-                    'type': 'hdrfilm',
-                    'width': sensor_count,
-                    'height': 1,
-                    'rfilter': {
-                        'type': 'box',
-                    },
-                    'pixel_format': 'rgb',
-                },
-            }
-
-            for (surface_name, primitive) in batch_shapes:
-                batch_sensor[f'{surface_name}-batch-sensor-ref'] = {
-                        'type': 'ref',
-                        'id': f'{surface_name}-sensor',
-                    }
-                mi_scene[surface_name] = primitive
+                    shapes.update(cached)
+
+        names = {objk: [] for objk in missed}
+        missed_entities = np.array(list(missed.keys()), dtype=np.uint32)
+        for type_id, column in _columns.items():
+            rows = np.flatnonzero(np.isin(column['entity'], missed_entities))
+            entities = np.asarray(column['entity'])[rows].tolist()
+            for objk, name, shape in zip(entities, RendererMts3.primitive_surface_names(_format, column, rows), RendererMts3.primitive_shapes(type_id, column, rows)):
+                shapes[name] = shape
+                names[objk].append(name)
+        for objk, key in missed.items():
+            _shape_cache.expect(key, names[objk])
+        return shapes
 
-            mi_scene['dbatchsensor'] = batch_sensor
+    @staticmethod
+    def load_sim_scene_columns(_scene_data, _spp=128, _use_batch=False, _use_multi=False, _merge_obstacles=False, _instance_obstacles=False, _defer_shapes=False, _shape_cache=None):
+        '''
+        Array-native counterpart of load_sim_scene_primitives for the columnar scenes of binary_loader.load_binary_primitives_columnar:
+        one dict of arrays per primitive type (matrix (N,12), length (N), radius (N), center (N,3))
+        with entity (N), surface (N), is_sensor (N) and index (N, defines the sensor order).
+        The shapes are returned as dicts and created by the single mi.load_dict of the scene (see load_dict),
+        with a _shape_cache the obstacles of unchanged entities are the shapes loaded for a previous scene.
+        '''
+        columns = _scene_data['primitives']
+        format = _scene_data['format']
+        use_batch = _use_batch and not _use_multi
 
-        # add obstacles
-        objects = _scene_data['obstacles']
+        mi_scene = {}
+        sensor_names = []; sensor_shapes = []; sensor_index = []
+        obstacle_columns = {}
+        for type_id, name in binary_loader.primitive_names.items():
+            if name not in columns:
+                continue
+            column = columns[name]
+            is_sensor = np.asarray(column['is_sensor'], dtype=bool)
+
+            rows = np.flatnonzero(is_sensor)
+            sensor_names += RendererMts3.primitive_surface_names(format, column, rows)
+            sensor_shapes += RendererMts3.primitive_shapes(type_id, column, rows)
+            sensor_index.append(np.asarray(column['index'])[rows])
+
+            rows = np.flatnonzero(~is_sensor)
+            if _merge_obstacles or _instance_obstacles or _shape_cache is not None:
+                obstacle_columns[type_id] = {key: np.asarray(values)[rows] for key, values in column.items()}
+                continue
+            for obstacle_name, shape in zip(RendererMts3.primitive_surface_names(format, column, rows), RendererMts3.primitive_shapes(type_id, column, rows)):
+                mi_scene[obstacle_name] = shape
+
+        if _merge_obstacles:
+            for type_id, column in obstacle_columns.items():
+                if len(column['index']) == 0:
+                    continue
+                name, mesh = RendererMts3.create_merged_mesh(type_id, column)
+                mi_scene[name] = mesh
+        elif _instance_obstacles:
+            # the grouping works on the surfaces of an entity
+            obstacles = binary_loader.expand_primitive_columns({'format': format, 'primitives': {binary_loader.primitive_names[t]: c for t, c in obstacle_columns.items()}})
+            builder = PrimitiveSceneBuilder(_spp, _instance_obstacles=True, _defer_shapes=_defer_shapes)
+            for objk, surfaces in obstacles['obstacles'].items():
+                builder.add_obstacles(objk, surfaces)
+            builder.add_obstacle_instances()
+            mi_scene.update(builder.mi_scene)
+        elif _shape_cache is not None:
+            mi_scene.update(RendererMts3.cached_obstacle_shapes(format, obstacle_columns, _shape_cache))
+
+        # sensors in file order
+        order = np.argsort(np.concatenate(sensor_index), kind='stable') if len(sensor_index) > 0 else np.zeros(0, dtype=np.int64)
+        sensor_names = [sensor_names[i] for i in order]
+        sensor_shapes = [sensor_shapes[i] for i in order]
+        sensor_count = len(sensor_names)
+
+        sensor = RendererMts3.get_mesh_sensor(_spp)
+        sensor['sampler'] = mi.load_dict(sensor['sampler']) # cloned per render, shared by all sensors
+        for surface_name, shape in zip(sensor_names, sensor_shapes):
+            if use_batch:
+                mi_scene[f'{surface_name}-sensor'] = sensor
+                shape[f'{surface_name}-shape-sensor-ref'] = {
+                    'type': 'ref',
+                    'id': f'{surface_name}-sensor',
+                }
+            elif not _use_multi:
+                shape['sensor'] = dict(sensor)
+            mi_scene[surface_name] = shape
 
-        for objk, surfaces in objects.items():
-            for surfk, data in surfaces.items():
-                surface_name = RendererMts3.encodeName(objk, surfk)
-                type_id = data['type']
-                func = primitive_map[type_id]
-                mi_scene[surface_name] = mi.load_dict(func(data))
+        if use_batch and sensor_count > 0:
+            # the position prefix keeps the sensor order (the names sort in file order, not necessarily in index order)
+            mi_scene['dbatchsensor'] = RendererMts3.get_batch_sensor(_spp, {
+                f'{i:08d}-{surface_name}-batch-sensor-ref': {'type': 'ref', 'id': f'{surface_name}-sensor'} for i, surface_name in enumerate(sensor_names)
+            })
 
+        if _use_multi and sensor_count > 0:
+            mi_scene['dmultisensor'] = multi_irradiancemeter.get_sensor(_spp, sensor_names)
 
-        if sensor_count < 1:
-            logging.warn('No sensors defined.')
-        else:
+        # statistics of the sensor sphere centers (see PrimitiveSceneBuilder.add_sensors)
+        minv = np.array([sys.float_info.max]*3)
+        avgv = np.array([0.0,0.0,0.0])
+        maxv = np.array([sys.float_info.min]*3)
+        if 'sphere' in columns:
+            centers = np.asarray(columns['sphere']['center'], dtype=np.float64)[np.asarray(columns['sphere']['is_sensor'], dtype=bool)]
+            if len(centers) > 0:
+                minv = np.minimum(minv, np.min(centers, axis=0))
+                maxv = np.maximum(maxv, np.max(centers, axis=0))
+                avgv = np.sum(centers, axis=0)
+
+        if sensor_count > 0:
             avgv /= sensor_count
 
         return mi_scene, (minv, avgv, maxv), sensor_count
@@ -709,4 +1436,181 @@ class RendererMts3():
     def get_sun_radius(distance):
         half_sun_disk_angle = 0.26095 * 0.5
         distance = 100.0
-        return np.tan(half_sun_disk_angle * np.pi / 180.0) * distance
\ No newline at end of file
+        return np.tan(half_sun_disk_angle * np.pi / 180.0) * distance
+
+
+class PrimitiveSceneBuilder():
+    '''
+    Converts the entities of a primitive scene (format 2/3) to Mitsuba scene objects one entity at a time,
+    so scene construction can start before the whole scene is decoded (see RendererMts3.load_stream).
+    '''
+
+    def __init__(self, _spp=128, _use_batch=False, _use_multi=False, _merge_obstacles=False, _instance_obstacles=False, _defer_shapes=False):
+
+        #(1 = disk, 2 = cylinder/stem, 4 = sphere/shoot, 8 = rectangle/leaf)
+        self.primitive_map = {
+            1: RendererMts3.disk,
+            2: RendererMts3.cylinder,
+            4: RendererMts3.sphere,
+            8: RendererMts3.rectangle,
+        }
+
+        self.spp = _spp
+        self.use_multi = _use_multi
+        self.use_batch = _use_batch and not _use_multi
+        self.merge_obstacles = _merge_obstacles
+        self.instance_obstacles = _instance_obstacles
+        self.defer_shapes = _defer_shapes # shapes are kept as dicts and instantiated by the (parallel) mi.load_dict of the scene
+
+        self.mi_scene = {}
+        self.batch_shapes = []
+        self.sensor_ids = []
+        self.obstacle_columns = {type_id: [] for type_id in self.primitive_map.keys()} # merged obstacles, surface data per primitive type
+        self.obstacle_entities = [] # instanced obstacles, [(objk, surfaces, frame, local surfaces)]
+        self.sensor_count = 0
+
+        self.minv = np.array([sys.float_info.max]*3)
+        self.avgv = np.array([0.0,0.0,0.0])
+        self.maxv = np.array([sys.float_info.min]*3)
+
+        # every sensor needs its own plugin (and film), it is bound to one shape, the sampler is cloned per render and can be shared
+        self.sensor = {
+            'type': 'irradiancemeter',
+            'sampler': mi.load_dict({
+                'type': 'independent',
+                'sample_count': _spp
+            }),
+            'film': {
+                'type': 'hdrfilm',
+                'width': 1,
+                'height': 1,
+                'rfilter': {
+                    'type': 'box',
+                },
+                'pixel_format': 'rgb',
+            },
+        }
+
+    def load(self, _shape):
+        return _shape if self.defer_shapes else mi.load_dict(_shape)
+
+    def add_sensors(self, objk, surfaces):
+        for surfk, data in surfaces.items():
+            surface_name = RendererMts3.encodeName(objk, surfk)
+
+            # process AABB
+            pos = None
+
+            if 'center' in data:
+                pos = data['center']
+
+            if pos is not None:
+                self.avgv += pos
+                self.minv = np.minimum(self.minv, pos)
+                self.maxv = np.maximum(self.maxv, pos)
+
+            primitive = self.primitive_map[data['type']](data)
+
+            if self.use_multi:
+                self.mi_scene[surface_name] = self.load(primitive)
+                self.sensor_ids.append(surface_name)
+            elif self.use_batch:
+                self.mi_scene[f'{surface_name}-sensor'] = self.sensor
+                primitive[f'{surface_name}-shape-sensor-ref'] = {
+                        'type': 'ref',
+                        'id': f'{surface_name}-sensor',
+                    }
+                self.batch_shapes.append((surface_name, primitive))
+            else:
+                primitive['sensor'] = dict(self.sensor)
+                self.mi_scene[surface_name] = self.load(primitive)
+            self.sensor_count += 1
+
+    def add_obstacles(self, objk, surfaces):
+        if self.instance_obstacles:
+            # entities are grouped by their geometry, the shapes are created in finish when the duplicates are known
+            frame = instancing.entity_frame(surfaces)
+            self.obstacle_entities.append((objk, surfaces, frame, instancing.local_surfaces(surfaces, frame)))
+            return
+        self.add_obstacle_shapes(objk, surfaces)
+
+    def add_obstacle_shapes(self, objk, surfaces):
+        if self.merge_obstacles:
+            for data in surfaces.values():
+                self.obstacle_columns[data['type']].append(data)
+            return
+
+        for surfk, data in surfaces.items():
+            surface_name = RendererMts3.encodeName(objk, surfk)
+            type_id = data['type']
+            func = self.primitive_map[type_id]
+            self.mi_scene[surface_name] = self.load(func(data))
+
+    def merge_obstacle_meshes(self):
+        '''
+        Tessellates the collected obstacles and merges them into one triangle mesh per primitive type.
+        '''
+        for type_id, surfaces in self.obstacle_columns.items():
+            if len(surfaces) == 0:
+                continue
+            column = {key: np.array([data[key] for data in surfaces], dtype=np.float32) for key in binary_loader.primitive_dtypes[type_id].names}
+            name, mesh = RendererMts3.create_merged_mesh(type_id, column)
+            self.mi_scene[name] = mesh
+
+    def add_obstacle_instances(self):
+        '''
+        One shapegroup per geometry shared by several entities (in the local frame of the first one) and an instance per entity,
+        entities with unique geometry are added as regular shapes.
+        '''
+        groups = instancing.group_entities([local for _, _, _, local in self.obstacle_entities])
+        group_count = 0; instance_count = 0
+        for indices in groups:
+            entities = [self.obstacle_entities[i] for i in indices]
+            if len(entities) < 2:
+                objk, surfaces, _, _ = entities[0]
+                self.add_obstacle_shapes(objk, surfaces)
+                continue
+
+            group_id = f'obstacle-group{str(group_count).zfill(5)}'
+            objk, _, _, local = entities[0]
+            group = {'type': 'shapegroup'}
+            for surfk, data in local.items():
+                group[RendererMts3.encodeName(objk, surfk)] = self.primitive_map[data['type']](data)
+            self.mi_scene[group_id] = group
+
+            for objk, _, frame, _ in entities:
+                self.mi_scene[f'{objk}-instance'] = {
+                    'type': 'instance',
+                    'shapegroup': {
+                        'type': 'ref',
+                        'id': group_id,
+                    },
+                    'to_world': T(instancing.to_world(frame)),
+                }
+            group_count += 1; instance_count += len(entities)
+
+        logging.info(f'Obstacle instancing: {group_count} shapegroups, {instance_count} instances, {len(groups) - group_count} unique entities')
+
+    def finish(self):
+        if self.instance_obstacles:
+            self.add_obstacle_instances()
+        if self.merge_obstacles:
+            self.merge_obstacle_meshes()
+
+        mi_scene = self.mi_scene
+
+        if self.use_batch:
+            for (surface_name, primitive) in self.batch_shapes:
+                mi_scene[surface_name] = primitive
+
+            mi_scene['dbatchsensor'] = RendererMts3.get_batch_sensor(self.spp, {
+                f'{surface_name}-batch-sensor-ref': {'type': 'ref', 'id': f'{surface_name}-sensor'} for (surface_name, _) in self.batch_shapes
+            })
+
+        if self.use_multi and self.sensor_count > 0:
+            mi_scene['dmultisensor'] = multi_irradiancemeter.get_sensor(self.spp, self.sensor_ids)
+
+        if self.sensor_count > 0:
+            self.avgv /= self.sensor_count
+
+        return mi_scene, (self.minv, self.avgv, self.maxv), self.sensor_count
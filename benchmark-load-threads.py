@@ -0,0 +1,55 @@
+import io, logging, os, time
+import scene_generator
+import tracing
+from RendererMts3 import RendererMts3
+
+# example CMD
+# python benchmark-load-threads.py --plants 500 --threads 1 2 4 8 16 32
+# python benchmark-load-threads.py --plants 500 --stream
+
+def measure(_func, *args):
+    t = time.perf_counter_ns()
+    result = _func(*args)
+    return result, (time.perf_counter_ns() - t) / 1e9
+
+
+def run(_binary_array, _threads, _rays, _stream=False, _batch=True):
+    '''
+    Load time of the scene with _threads mi.load_dict workers, returns (total, mi.load_dict) in seconds.
+    '''
+    renderer = RendererMts3(_use_batch_render=_batch, _load_threads=_threads)
+    tracing._events.clear()
+    if _stream:
+        _, dur_load = measure(renderer.load_stream, io.BytesIO(_binary_array), len(_binary_array), 48.21, 16.36, '2022-06-01T12:00:00+00:00', _rays)
+    else:
+        _, dur_load = measure(renderer.load_binary, _binary_array, 48.21, 16.36, '2022-06-01T12:00:00+00:00', _rays)
+    dur_load_dict = sum(e['dur'] for e in tracing._events if e['name'] == 'mi.load_dict') / 1e6
+    return dur_load, dur_load_dict
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Scene load time scaling with the number of mi.load_dict worker threads.')
+    parser.add_argument('--plants', type=int, default=500, help='Field size (plants with 100 primitives each).')
+    parser.add_argument('--threads', type=int, nargs='+', default=None, help='Worker counts (default: powers of two up to the number of cores).')
+    parser.add_argument('--sensor_ratio', type=float, default=0.1, help='Probability of a primitive to be a sensor.')
+    parser.add_argument('--rays', type=int, default=128, help='Number of rays per sensor.')
+    parser.add_argument('--stream', action='store_true', help='Load with RendererMts3.load_stream (entity dicts) instead of the columnar load_binary.')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    tracing.enable(os.devnull) # spans only, the trace is not written
+
+    threads = args.threads if args.threads is not None else [2**i for i in range(os.cpu_count().bit_length()) if 2**i <= os.cpu_count()]
+    binary_array = scene_generator.encode(scene_generator.create_field(_plants=args.plants, _leaves=80, _stems=15, _buds=5, _sensor_ratio=args.sensor_ratio), 3)
+
+    print(f'{args.plants*100} primitives, {os.cpu_count()} cores, {"load_stream" if args.stream else "load_binary"}')
+    print(f'{"threads":>7} | {"load":>9} | {"mi.load_dict":>12} | {"speedup":>7}')
+    serial = None
+    for n in threads:
+        dur_load, dur_load_dict = run(binary_array, n, args.rays, args.stream)
+        serial = serial if serial is not None else dur_load
+        print(f'{n:7} | {dur_load:7.2f} s | {dur_load_dict:10.2f} s | {serial / dur_load:6.2f}x')
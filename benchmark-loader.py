@@ -0,0 +1,130 @@
+import time
+import numpy as np
+import binary_loader
+import scene_generator
+
+# example CMD
+# python benchmark-loader.py --surfaces 20000 --triangles 8
+
+def create_mesh_scene(_surface_count, _triangle_count, _sensor_ratio=0.5, _seed=0):
+    '''
+    Format 1 payload with one entity per 100 surfaces, each surface a strip of _triangle_count triangles.
+    '''
+    rng = np.random.default_rng(_seed)
+
+    sensor_surfaces = int(_surface_count * _sensor_ratio)
+    obstacle_surfaces = _surface_count - sensor_surfaces
+    point_count = _surface_count * (_triangle_count + 2)
+
+    data = bytearray([1]) # version
+    first_point = 0
+    for surface_count in [obstacle_surfaces, sensor_surfaces]:
+        entity_sizes = [100] * (surface_count // 100) + ([surface_count % 100] if surface_count % 100 > 0 else [])
+        data += np.array([len(entity_sizes)], dtype=np.uint32).tobytes()
+        for size in entity_sizes:
+            data += np.array([size], dtype=np.uint32).tobytes()
+            for s in range(size):
+                strip = first_point + np.arange(_triangle_count, dtype=np.uint32)
+                data += np.array([_triangle_count], dtype=np.uint8).tobytes()
+                data += np.stack([strip, strip+1, strip+2], axis=1).astype(np.uint32).tobytes()
+                first_point += _triangle_count + 2
+
+    data += np.array([point_count], dtype=np.uint32).tobytes()
+    data += rng.uniform(-10.0, 10.0, (point_count, 3)).astype(np.float32).tobytes()
+
+    return bytes(data)
+
+
+def load_binary_primitives_columnar(binary_array, _verbose=False, _offset=0):
+    return binary_loader.load_binary_primitives_columnar(binary_array, _verbose, _offset, _interleaved=True)
+
+
+def load_binary_v4_columnar(binary_array, _verbose=False, _offset=0):
+    return binary_loader.load_binary_v4(binary_array, _verbose, _offset, _columnar=True)
+
+
+def measure(_func, _binary_array, _repeat):
+    durations = []
+    for _ in range(_repeat):
+        t = time.perf_counter_ns()
+        scene = _func(_binary_array, False, 1)
+        durations.append(time.perf_counter_ns() - t)
+    return scene, min(durations) / 1e9
+
+
+def compare_mesh_scenes(_a, _b):
+    assert np.allclose(np.asarray(_a['pointArray']), np.asarray(_b['pointArray']))
+    for group in ['obstacles', 'sensors']:
+        assert list(_a[group].keys()) == list(_b[group].keys())
+        for entity_key, surfaces in _a[group].items():
+            for surface_key, indices in surfaces.items():
+                assert np.array_equal(np.asarray(indices).reshape((-1, 3)), _b[group][entity_key][surface_key])
+
+
+def compare_primitive_scenes(_a, _b):
+    for group in ['obstacles', 'sensors']:
+        assert list(_a[group].keys()) == list(_b[group].keys())
+        for entity_key, surfaces in _a[group].items():
+            assert list(surfaces.keys()) == list(_b[group][entity_key].keys())
+            for surface_key, data in surfaces.items():
+                other = _b[group][entity_key][surface_key]
+                assert data['type'] == other['type']
+                for key in data.keys() - {'type'}:
+                    assert np.allclose(data[key], other[key])
+
+
+def print_result(_label, _size_mb, _dur):
+    print(f'{_label:36} | {_dur:8.3f} sec. | {_size_mb / _dur:9.2f} MB/s')
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Binary scene loader throughput benchmark.')
+    parser.add_argument('--surfaces', type=int, default=10000, help='Number of surfaces.')
+    parser.add_argument('--triangles', type=int, default=8, help='Number of triangles per surface (max. 255).')
+    parser.add_argument('--primitives', type=int, default=50000, help='Number of primitives (format 3).')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the fastest run is reported.')
+
+    args = parser.parse_args()
+
+    # empty primitive scenes (no entities) decode into empty columns
+    for empty in [bytes([2]) + bytes(8), bytes([3]) + bytes(4)]:
+        columnar = binary_loader.load_binary(empty, _columnar=True)
+        assert all(len(column['index']) == 0 for column in columnar['primitives'].values())
+        compare_primitive_scenes(binary_loader.load_binary(empty), binary_loader.expand_primitive_columns(columnar))
+
+    binary_array = create_mesh_scene(args.surfaces, args.triangles)
+    size_mb = len(binary_array) / 1e6
+    print(f'Format 1 | surfaces: {args.surfaces}, triangles per surface: {args.triangles}, size: {size_mb:.2f} MB')
+
+    reference, dur_ref = measure(binary_loader.load_binary_mesh, binary_array, args.repeat)
+    vectorized, dur_vec = measure(binary_loader.load_binary_mesh_vectorized, binary_array, args.repeat)
+    compare_mesh_scenes(reference, vectorized)
+
+    print_result('load_binary_mesh', size_mb, dur_ref)
+    print_result('load_binary_mesh_vectorized', size_mb, dur_vec)
+    print(f'speedup: {dur_ref / dur_vec:.1f}x')
+
+    binary_array = scene_generator.encode(scene_generator.create_field(_plants=max(1, args.primitives // 100), _leaves=80, _stems=15, _buds=5), 3)
+    size_mb = len(binary_array) / 1e6
+    print(f'Format 3 | primitives: {args.primitives}, size: {size_mb:.2f} MB')
+
+    reference, dur_ref = measure(binary_loader.load_binary_primitives_interleaved, binary_array, args.repeat)
+    columnar, dur_col = measure(load_binary_primitives_columnar, binary_array, args.repeat)
+    compare_primitive_scenes(reference, binary_loader.expand_primitive_columns(columnar))
+
+    print_result('load_binary_primitives_interleaved', size_mb, dur_ref)
+    print_result('load_binary_primitives_columnar', size_mb, dur_col)
+    print(f'speedup: {dur_ref / dur_col:.1f}x')
+
+    binary_array = binary_loader.encode_v4(reference)
+    size_mb = len(binary_array) / 1e6
+    print(f'Format 4 | primitives: {args.primitives}, size: {size_mb:.2f} MB')
+
+    columnar, dur_v4 = measure(load_binary_v4_columnar, binary_array, args.repeat)
+    compare_primitive_scenes(reference, binary_loader.expand_primitive_columns(columnar))
+
+    print_result('load_binary_v4 (columnar)', size_mb, dur_v4)
+    print(f'speedup: {dur_ref / dur_v4:.1f}x')
@@ -0,0 +1,50 @@
+import logging, time
+import numpy as np
+import scene_generator
+from RendererMts3 import RendererMts3
+
+# example CMD
+# python benchmark-obstacles.py --plants 100 200 --sensor_ratio 0.1
+# python benchmark-obstacles.py --plants 100 --variants 5
+
+def measure(_func, *args):
+    t = time.perf_counter_ns()
+    result = _func(*args)
+    return result, (time.perf_counter_ns() - t) / 1e9
+
+
+def run(_binary_array, _merge_obstacles, _rays, _batch=True, _instance_obstacles=False):
+    renderer = RendererMts3(_use_batch_render=_batch, _merge_obstacles=_merge_obstacles, _instance_obstacles=_instance_obstacles)
+    _, dur_load = measure(renderer.load_binary, _binary_array, 48.21, 16.36, '2022-06-01T12:00:00+00:00', _rays)
+    measurements, dur_render = measure(renderer.render, _rays)
+    return measurements, dur_load, dur_render
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Load and render time of analytic obstacle shapes vs. merged obstacle meshes (or instanced obstacles).')
+    parser.add_argument('--plants', type=int, nargs='+', default=[10, 100], help='Field sizes (plants with 100 primitives each).')
+    parser.add_argument('--sensor_ratio', type=float, default=0.1, help='Probability of a primitive to be a sensor.')
+    parser.add_argument('--rays', type=int, default=128, help='Number of rays per sensor.')
+    parser.add_argument('--variants', type=int, default=0, help='Fields of copies of this many plants, compares instanced instead of merged obstacles.')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    other = 'instanced' if args.variants > 0 else 'merged'
+    print(f'{"primitives":>10} | {"sensors":>8} | {"load analytic":>13} | {"load " + other:>14} | {"render analytic":>15} | {"render " + other:>16} | {"mean rel. diff":>14}')
+    for plants in args.plants:
+        scene = scene_generator.create_field(_plants=plants, _leaves=80, _stems=15, _buds=5, _sensor_ratio=args.sensor_ratio, _variants=args.variants)
+        binary_array = scene_generator.encode(scene, 3)
+
+        analytic, load_analytic, render_analytic = run(binary_array, False, args.rays)
+        if args.variants > 0:
+            result, load_other, render_other = run(binary_array, False, args.rays, _instance_obstacles=True)
+        else:
+            result, load_other, render_other = run(binary_array, True, args.rays)
+        rel_diff = abs(np.mean(result) - np.mean(analytic)) / max(np.mean(analytic), 1e-6)
+
+        print(f'{plants*100:10} | {len(analytic):8} | {load_analytic:11.3f} s | {load_other:12.3f} s | {render_analytic:13.3f} s | {render_other:14.3f} s | {rel_diff:14.3f}')
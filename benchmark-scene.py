@@ -0,0 +1,57 @@
+import logging, time
+import binary_loader
+import scene_generator
+from RendererMts3 import RendererMts3
+
+# example CMD
+# python benchmark-scene.py --format 3 --sizes 1000 10000 100000 1000000 --max_scene_primitives 100000
+# python benchmark-scene.py --format 1 --sizes 1000 10000 --mesh_ply
+
+def measure(_func, *args):
+    t = time.perf_counter_ns()
+    result = _func(*args)
+    return result, (time.perf_counter_ns() - t) / 1e9
+
+
+def create_scene(_primitive_count, _format, _sensor_ratio=0.5, _seed=0):
+    '''
+    Synthetic field with 100 primitives per plant (80 leaves, 15 stem segments, 5 buds).
+    '''
+    scene = scene_generator.create_field(_plants=max(1, _primitive_count // 100), _leaves=80, _stems=15, _buds=5, _sensor_ratio=_sensor_ratio, _seed=_seed)
+    return scene_generator.encode(scene, _format)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Scene loading throughput benchmark on synthetic scenes.')
+    parser.add_argument('--format', type=int, default=3, help='Binary format of the generated scenes (1, 2 or 3).')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000], help='Scene sizes (number of primitives).')
+    parser.add_argument('--max_scene_primitives', type=int, default=100000, help='Largest scene passed to RendererMts3.load_sim_scene.')
+    parser.add_argument('--sensor_ratio', type=float, default=0.5, help='Probability of a primitive to be a sensor.')
+    parser.add_argument('--batch', type=bool, default=True, help='Use batch rendering sensors.')
+    parser.add_argument('--mesh_ply', action='store_true', help='Format 1: also measure the previous mesh construction (PLY files written to and reloaded from tmp/).')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    print(f'{"primitives":>10} | {"MB":>8} | {"load_binary":>12} | {"columnar":>12} | {"load_sim_scene":>14}' + (f' | {"ply":>14}' if args.mesh_ply else ''))
+    for size in args.sizes:
+        binary_array = create_scene(size, args.format, args.sensor_ratio)
+        size_mb = len(binary_array) / 1e6
+
+        scene_dict, dur_load = measure(binary_loader.load_binary, binary_array)
+        _, dur_columnar = measure(binary_loader.load_binary, binary_array, False, True)
+
+        scene_label = '-'
+        ply_label = '-'
+        if size <= args.max_scene_primitives:
+            _, dur_scene = measure(RendererMts3.load_sim_scene, scene_dict, 128, args.batch)
+            scene_label = f'{size / dur_scene:9.0f} p/s'
+            if args.mesh_ply and args.format == 1:
+                _, dur_ply = measure(RendererMts3.load_sim_scene_meshes, scene_dict, 128, False)
+                ply_label = f'{size / dur_ply:9.0f} p/s'
+
+        print(f'{size:10} | {size_mb:8.2f} | {size_mb / dur_load:7.2f} MB/s | {size_mb / dur_columnar:7.2f} MB/s | {scene_label:>14}' + (f' | {ply_label:>14}' if args.mesh_ply else ''))
@@ -0,0 +1,57 @@
+import logging, time
+import numpy as np
+import scene_generator
+from RendererMts3 import RendererMts3
+
+# example CMD
+# python benchmark-sensor-order.py --plants 100 500 --rays 256
+# python benchmark-sensor-order.py --plants 500 --shuffle
+# python benchmark-sensor-order.py --plants 100 --multi
+
+def measure(_func, *args):
+    t = time.perf_counter_ns()
+    result = _func(*args)
+    return result, (time.perf_counter_ns() - t) / 1e9
+
+
+def run(_binary_array, _spatial_order, _rays, _multi=False, _repeat=3):
+    '''
+    Load time and best render time of _repeat renders of the batch (or multi) sensor with the sensors in file or in Morton order.
+    '''
+    renderer = RendererMts3(_use_batch_render=not _multi, _use_multi_sensor=_multi, _spatial_order=_spatial_order)
+    _, dur_load = measure(renderer.load_binary, _binary_array, 48.21, 16.36, '2022-06-01T12:00:00+00:00', _rays)
+    renders = [measure(renderer.render, _rays) for _ in range(_repeat)]
+    return renders[0][0], dur_load, min(dur for _, dur in renders)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Render time of the batch (or multi) sensor with the sensors in file order vs. Morton order of their centers.')
+    parser.add_argument('--plants', type=int, nargs='+', default=[100, 500], help='Field sizes (plants with 100 primitives each).')
+    parser.add_argument('--sensor_ratio', type=float, default=0.5, help='Probability of a primitive to be a sensor.')
+    parser.add_argument('--rays', type=int, default=128, help='Number of rays per sensor.')
+    parser.add_argument('--multi', action='store_true', help='Multi sensor (llvm variant) instead of the batch sensor.')
+    parser.add_argument('--shuffle', action='store_true', help='Plants in random file order (instead of grid rows).')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    print(f'{"primitives":>10} | {"sensors":>8} | {"load file":>9} | {"load morton":>11} | {"render file":>11} | {"render morton":>13} | {"speedup":>7} | {"mean rel. diff":>14}')
+    for plants in args.plants:
+        scene = scene_generator.create_field(_plants=plants, _leaves=80, _stems=15, _buds=5, _sensor_ratio=args.sensor_ratio)
+        if args.shuffle:
+            permutation = np.random.default_rng(0).permutation(plants).astype(np.uint32)
+            per_plant = sum(len(column['entity']) for column in scene['primitives'].values()) // plants
+            for column in scene['primitives'].values():
+                column['entity'] = permutation[column['entity']]
+                column['index'] = (column['entity'] * per_plant + column['surface']).astype(np.uint32)
+        binary_array = scene_generator.encode(scene, 3)
+
+        file_order, load_file, render_file = run(binary_array, False, args.rays, args.multi)
+        morton_order, load_morton, render_morton = run(binary_array, True, args.rays, args.multi)
+        rel_diff = abs(np.mean(morton_order) - np.mean(file_order)) / max(np.mean(file_order), 1e-6)
+
+        print(f'{plants*100:10} | {len(file_order):8} | {load_file:7.2f} s | {load_morton:9.2f} s | {render_file:9.2f} s | {render_morton:11.2f} s | {render_file / render_morton:6.2f}x | {rel_diff:14.4f}')
@@ -0,0 +1,57 @@
+import logging, os, sys, tempfile, time
+import numpy as np
+import scene_generator
+from RendererMts3 import RendererMts3
+
+# example CMD
+# python benchmark-snapshot.py --plants 10 50
+# python benchmark-snapshot.py --plants 50 --format 3 --merge_obstacles
+
+def measure(_func, *args):
+    t = time.perf_counter_ns()
+    result = _func(*args)
+    return result, (time.perf_counter_ns() - t) / 1e9
+
+
+def run(_path, _rays, _snapshot_dir=None, _merge_obstacles=False):
+    renderer = RendererMts3(_use_batch_render=True, _merge_obstacles=_merge_obstacles, _snapshot_dir=_snapshot_dir)
+    _, dur_load = measure(renderer.load_path, _path, 48.21, 16.36, '2022-06-01T12:00:00+00:00', _rays)
+    return renderer.render(_rays), dur_load
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Checks that a scene loaded through a snapshot (snapshot.py) measures the same as the scene file, and compares the load times.')
+    parser.add_argument('--plants', type=int, nargs='+', default=[10], help='Field sizes (plants with 100 primitives each).')
+    parser.add_argument('--format', type=int, default=1, help='Binary format of the generated scenes (1 or 3).')
+    parser.add_argument('--merge_obstacles', action='store_true', help='Merge the obstacle primitives (format 3).')
+    parser.add_argument('--sensor_ratio', type=float, default=0.5, help='Probability of a primitive to be a sensor.')
+    parser.add_argument('--rays', type=int, default=128, help='Number of rays per sensor.')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    failed = False
+    print(f'{"primitives":>10} | {"sensors":>8} | {"load file":>9} | {"write snapshot":>14} | {"load snapshot":>13} | {"max abs. diff":>13}')
+    with tempfile.TemporaryDirectory() as directory:
+        for plants in args.plants:
+            scene = scene_generator.create_field(_plants=plants, _leaves=80, _stems=15, _buds=5, _sensor_ratio=args.sensor_ratio)
+            path = os.path.join(directory, f'field-{plants}.bin')
+            with open(path, 'wb') as f:
+                f.write(scene_generator.encode(scene, args.format))
+
+            snapshot_dir = os.path.join(directory, 'snapshots')
+            direct, load_direct = run(path, args.rays, _merge_obstacles=args.merge_obstacles)
+            written, load_write = run(path, args.rays, snapshot_dir, args.merge_obstacles)
+            loaded, load_snapshot = run(path, args.rays, snapshot_dir, args.merge_obstacles)
+            diff = max(np.max(np.abs(written - direct)), np.max(np.abs(loaded - direct)))
+            failed = failed or diff > 0
+
+            print(f'{plants*100:10} | {len(direct):8} | {load_direct:7.3f} s | {load_write:12.3f} s | {load_snapshot:11.3f} s | {diff:13.6f}')
+
+    if failed:
+        print('The snapshot measurements differ from the scene file.')
+        sys.exit(1)
@@ -1,59 +1,65 @@
 import logging
+from functools import partial
+import mmap
 from pprint import pprint
 import struct
+import numpy as np
+import tracing
 
-def load_path(_path, _verbose=False, _return_binary=False):
-
-    binary_array = []
+def load_path(_path, _verbose=False, _return_binary=False, _columnar=False):
+    '''
+    Memory-maps the scene file and decodes it from a read-only memoryview of the mapping,
+    the file is never copied into a bytes object (NumPy results view the mapping as well).
+    '''
 
     try:
-        f = open(_path, 'rb')
-        while True:
-            binarycontent = f.read(-1)
-            if not binarycontent:
-                break
-            binary_array.append(binarycontent)
+        with open(_path, 'rb') as f:
+            binary_array = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
     except IOError:
         logging.error('Error While Opening the file!')
-
-    if len(binary_array) < 1:
+        raise
+    except ValueError: # an empty file cannot be mapped
         logging.error("Data array length < 1")
-    elif len(binary_array) > 1:
-        logging.warn("Data array length > 1")
+        raise
 
-    binary_array = binary_array[0]
-
-    logging.debug(f'{binary_array}')
     logging.debug(f'#bytes: {len(binary_array)}')
 
     if _return_binary:
         return binary_array
     else:
-        return load_binary(binary_array, _verbose)
+        return load_binary(binary_array, _verbose, _columnar)
 
 
-def load_binary(binary_array, _verbose=False):
+def load_binary(binary_array, _verbose=False, _columnar=False):
 
-    [format] = struct.unpack('B', binary_array[0:1]); # uint8
+    [format] = struct.unpack_from('B', binary_array, 0); # uint8
 
     logging.debug(f'binary file format: {format}')
 
     map = {
-        1: load_binary_mesh,
+        1: load_binary_mesh_vectorized,
         2: load_binary_primitives_clustered,
         3: load_binary_primitives_interleaved,
+        4: load_binary_v4,
     }
 
-    if format in map:
-        return map[format](binary_array, _verbose, 1) # offset 1 to skip format byte
-    else:
-        logging.warn(f"Invalid format: {format}, expected any of {list(map.keys())}, Falling back to format: 1")
-        return map[1](binary_array, _verbose, 0)
+    if _columnar:
+        # primitive formats decoded into per-type arrays, see load_binary_primitives_columnar
+        map[2] = partial(load_binary_primitives_columnar, _interleaved=False)
+        map[3] = partial(load_binary_primitives_columnar, _interleaved=True)
+        map[4] = partial(load_binary_v4, _columnar=True)
+
+    with tracing.span('decode', format=format, bytes=len(binary_array), columnar=_columnar):
+        if format in map:
+            return map[format](binary_array, _verbose, 1) # offset 1 to skip format byte
+        else:
+            logging.warn(f"Invalid format: {format}, expected any of {list(map.keys())}, Falling back to format: 1")
+            return map[1](binary_array, _verbose, 0)
 
 
 def unpack(_i, _bin_arr, _str, _bytePerType=4, _print_name=None):
     offset = len(_str) * _bytePerType
-    val = struct.unpack(_str, _bin_arr[_i:_i+offset])
+    val = struct.unpack_from(_str, _bin_arr, _i)
     if len(_str) == 1: # extract single value from tuple
         val = val[0]
     else:
@@ -65,20 +71,21 @@ def unpack(_i, _bin_arr, _str, _bytePerType=4, _print_name=None):
 
 def load_mesh_entities(binary_array, _prefix, i, _verbose=False):
     entities = {}
-    entitiesCount, i = unpack(i, binary_array, 'I', _print_name=f"{_prefix}-entitiesCount") # uint32
+    entitiesCount, i = unpack(i, binary_array, 'I', _print_name=f"{_prefix}-entitiesCount" if _verbose else None) # uint32
     for e in range(entitiesCount):
         entity_key = f"{_prefix}-entity{str(e).zfill(5)}"
-        surfacesCount, i = unpack(i, binary_array, 'I', _print_name=f"{entity_key}-surfacesCount") # uint32
+        surfacesCount, i = unpack(i, binary_array, 'I', _print_name=f"{entity_key}-surfacesCount" if _verbose else None) # uint32
         entities[entity_key] = {}
         for s in range(surfacesCount):
             surface_key = f"surface{str(s).zfill(5)}"
-            trianglesCount, i = unpack(i, binary_array, 'B', 1, _print_name=f"{surface_key}-trianglesCount") # uint8
+            trianglesCount, i = unpack(i, binary_array, 'B', 1, _print_name=f"{surface_key}-trianglesCount" if _verbose else None) # uint8
             triangle_indices = []
             for t in range(trianglesCount):
-                index_tripplet, i = unpack(i, binary_array, 'III', _print_name='index_tripplet')  # 3x uint32
+                index_tripplet, i = unpack(i, binary_array, 'III', _print_name='index_tripplet' if _verbose else None)  # 3x uint32
                 triangle_indices.append(index_tripplet)
-                [ind0, ind1, ind2] = index_tripplet
-                logging.debug(f'{surface_key}-triangle-index #{t}, | ({ind0}, {ind1}, {ind2}), | byte index: {i}')
+                if _verbose:
+                    [ind0, ind1, ind2] = index_tripplet
+                    logging.debug(f'{surface_key}-triangle-index #{t}, | ({ind0}, {ind1}, {ind2}), | byte index: {i}')
             entities[entity_key][surface_key] = triangle_indices
 
     return entities, i
@@ -119,13 +126,14 @@ def load_binary_mesh(binary_array, _verbose=False, _offset=0):
     i = _offset
     scene['obstacles'], i = load_mesh_entities(binary_array, 'obstacle', i, _verbose)
     scene['sensors'], i = load_mesh_entities(binary_array, 'sensor', i, _verbose)
-    pointsCount, i = unpack(i, binary_array, 'I', _print_name='pointsCount') # uint32
+    pointsCount, i = unpack(i, binary_array, 'I', _print_name='pointsCount' if _verbose else None) # uint32
     point_array = []
     for p in range(pointsCount):
         point, i = unpack(i, binary_array, 'fff') # 3x float32
         point_array.append(point)
-        [x, y, z] = point
-        logging.debug(f'point #{p} | ({x}, {y}, {z}) | byte index: {i}')
+        if _verbose:
+            [x, y, z] = point
+            logging.debug(f'point #{p} | ({x}, {y}, {z}) | byte index: {i}')
     scene['pointArray'] = point_array
 
     if logging.root.level <= logging.DEBUG:
@@ -134,6 +142,49 @@ def load_binary_mesh(binary_array, _verbose=False, _offset=0):
     return scene
 
 
+def load_mesh_entities_vectorized(binary_array, _prefix, i, _verbose=False):
+    '''
+    Same layout as load_mesh_entities, but every index block is read with a single np.frombuffer call.
+    The surfaces are (trianglesCount, 3) uint32 arrays viewing the input buffer.
+    '''
+    entities = {}
+    [entitiesCount] = struct.unpack_from('I', binary_array, i); i += 4 # uint32
+    if _verbose:
+        logging.debug(f"{_prefix}-entitiesCount: {entitiesCount} | index: {i}")
+    for e in range(entitiesCount):
+        entity_key = f"{_prefix}-entity{str(e).zfill(5)}"
+        [surfacesCount] = struct.unpack_from('I', binary_array, i); i += 4 # uint32
+        surfaces = {}
+        for s in range(surfacesCount):
+            [trianglesCount] = struct.unpack_from('B', binary_array, i); i += 1 # uint8
+            surfaces[f"surface{str(s).zfill(5)}"] = np.frombuffer(binary_array, dtype=np.uint32, count=trianglesCount*3, offset=i).reshape((trianglesCount, 3))
+            i += trianglesCount * 12 # 3x uint32
+        entities[entity_key] = surfaces
+
+    return entities, i
+
+
+def load_binary_mesh_vectorized(binary_array, _verbose=False, _offset=0):
+    '''
+    NumPy variant of load_binary_mesh (same format, see there).
+    Returns the same scene dict, but the surfaces are (trianglesCount, 3) uint32 arrays
+    and 'pointArray' is a (pointsCount, 3) float32 array, both without per-element unpacking.
+    '''
+
+    scene = {'format': 1}
+    i = _offset
+    scene['obstacles'], i = load_mesh_entities_vectorized(binary_array, 'obstacle', i, _verbose)
+    scene['sensors'], i = load_mesh_entities_vectorized(binary_array, 'sensor', i, _verbose)
+    [pointsCount] = struct.unpack_from('I', binary_array, i); i += 4 # uint32
+    logging.debug(f'pointsCount: {pointsCount} | index: {i}')
+    scene['pointArray'] = np.frombuffer(binary_array, dtype=np.float32, count=pointsCount*3, offset=i).reshape((pointsCount, 3))
+
+    if logging.root.level <= logging.DEBUG:
+        pprint(scene)
+
+    return scene
+
+
 def disk(_i, _bin_arr):
     '''
     uint8 primitiveType    (1 = disk, 2 = cylinder/stem, 4 = sphere/bud, 8 = rectangle/leaf)
@@ -214,11 +265,13 @@ def load_primitve_entities(binary_array, _prefix, i, _verbose=False):
     for e in range(entitiesCount):
         surfacesCount, i = unpack(i, binary_array, 'I', _print_name='surfacesCount' if _verbose else None)
         entity_key = f"{_prefix}-entity{str(e).zfill(5)}"
-        logging.debug(entity_key)
+        if _verbose:
+            logging.debug(entity_key)
         entities[entity_key] = {}
         for s in range(surfacesCount):
             surface_key = f"surface{str(s).zfill(5)}"
-            logging.debug(surface_key)
+            if _verbose:
+                logging.debug(surface_key)
             primitiveType, i = unpack(i, binary_array, 'B', 1, _print_name='primitiveType' if _verbose else None)
             data, i = primitive_map[primitiveType](i, binary_array)
             entities[entity_key][surface_key] = data
@@ -318,12 +371,14 @@ def load_binary_primitives_interleaved(binary_array, _verbose=False, _offset=0):
     for e in range(entitiesCount):
         surfacesCount, i = unpack(i, binary_array, 'I', _print_name='surfacesCount' if _verbose else None)
         entity_key = f"entity{str(e).zfill(5)}"
-        logging.debug(entity_key)
+        if _verbose:
+            logging.debug(entity_key)
         eObstacles = {}
         eSensors = {}
         for s in range(surfacesCount):
             surface_key = f"surface{str(s).zfill(5)}"
-            logging.debug(surface_key)
+            if _verbose:
+                logging.debug(surface_key)
             primitiveType, i = unpack(i, binary_array, 'B', 1, _print_name='primitiveType' if _verbose else None)
             data, i = primitive_map[primitiveType](i, binary_array)
             isSensor, i = unpack(i, binary_array, 'B', 1, _print_name='isSensor' if _verbose else None)
@@ -340,3 +395,476 @@ def load_binary_primitives_interleaved(binary_array, _verbose=False, _offset=0):
         pass#pprint(scene)
 
     return scene
+
+
+
+# payload layout of each primitive type (without the leading uint8 primitiveType), see disk, cylinder, sphere and rectangle
+primitive_dtypes = {
+    1: np.dtype([('matrix', np.float32, 12)]),
+    2: np.dtype([('length', np.float32), ('radius', np.float32), ('matrix', np.float32, 12)]),
+    4: np.dtype([('center', np.float32, 3), ('radius', np.float32)]),
+    8: np.dtype([('matrix', np.float32, 12)]),
+}
+
+primitive_names = {
+    1: 'disk',
+    2: 'cylinder',
+    4: 'sphere',
+    8: 'rectangle',
+}
+
+
+def scan_primitive_entities(binary_array, i, _interleaved, _is_sensor=False):
+    '''
+    First pass of the columnar decoder: walks the entity/surface structure (see load_primitve_entities)
+    reading only the primitiveType (and isSensor if _interleaved) bytes.
+    Returns the type, payload byte offset, entity index, surface index and sensor flag of every primitive.
+    '''
+    sizes = {t: dt.itemsize for t, dt in primitive_dtypes.items()}
+    types = []; offsets = []; entities = []; surfaces = []; sensors = []
+
+    [entitiesCount] = struct.unpack_from('I', binary_array, i); i += 4 # uint32
+    for e in range(entitiesCount):
+        [surfacesCount] = struct.unpack_from('I', binary_array, i); i += 4 # uint32
+        entities.extend([e] * surfacesCount)
+        surfaces.extend(range(surfacesCount))
+        for s in range(surfacesCount):
+            primitiveType = binary_array[i] # uint8
+            if primitiveType not in sizes:
+                raise ValueError(f'Invalid primitive type: {primitiveType} | byte index: {i}')
+            types.append(primitiveType)
+            offsets.append(i + 1)
+            i += 1 + sizes[primitiveType]
+            if _interleaved:
+                sensors.append(binary_array[i] > 0) # bool
+                i += 1
+
+    if not _interleaved:
+        sensors = [_is_sensor] * len(types)
+
+    return (types, offsets, entities, surfaces, sensors), i
+
+
+def gather_primitive_columns(binary_array, _scan):
+    '''
+    Second pass of the columnar decoder: copies the payloads of each primitive type into typed arrays.
+    '''
+    # explicit dtypes, the lists of an empty scene would become float64 arrays
+    types, offsets, entities, surfaces, sensors = [np.asarray(v, dtype=dtype) for v, dtype in zip(_scan, [np.uint8, np.int64, np.uint32, np.uint32, bool])]
+    raw = np.frombuffer(binary_array, dtype=np.uint8)
+
+    columns = {}
+    for type_id, dtype in primitive_dtypes.items():
+        select = np.flatnonzero(types == type_id)
+        byte_index = offsets[select, None] + np.arange(dtype.itemsize)
+        records = raw[byte_index].view(dtype).reshape(-1)
+        column = {name: np.ascontiguousarray(records[name]) for name in dtype.names}
+        column['entity'] = entities[select].astype(np.uint32)
+        column['surface'] = surfaces[select].astype(np.uint32)
+        column['is_sensor'] = sensors[select].astype(bool)
+        column['index'] = select.astype(np.uint32) # position in the file, defines the sensor order
+        columns[primitive_names[type_id]] = column
+
+    return columns
+
+
+def load_binary_primitives_columnar(binary_array, _verbose=False, _offset=0, _interleaved=True):
+    '''
+    Two-pass decoder for format 2 (_interleaved=False) and format 3 (_interleaved=True), see
+    load_binary_primitives_clustered and load_binary_primitives_interleaved for the layout.
+
+    Instead of nested dicts, returns one dict of arrays per primitive type:
+        disk:      matrix (N,12)
+        cylinder:  length (N), radius (N), matrix (N,12)
+        sphere:    center (N,3), radius (N)
+        rectangle: matrix (N,12)
+    each with entity (N), surface (N), is_sensor (N) and index (N, position of the primitive in the file).
+    For format 2 the entity index counts separately for obstacles and sensors.
+    '''
+
+    i = _offset
+    if _interleaved:
+        scan, i = scan_primitive_entities(binary_array, i, True)
+    else:
+        obstacles, i = scan_primitive_entities(binary_array, i, False, _is_sensor=False)
+        sensors, i = scan_primitive_entities(binary_array, i, False, _is_sensor=True)
+        scan = [o + s for o, s in zip(obstacles, sensors)]
+
+    if _verbose:
+        logging.debug(f'primitive count: {len(scan[0])} | index: {i}')
+
+    return {
+        'format': 3 if _interleaved else 2,
+        'columnar': True,
+        'primitives': gather_primitive_columns(binary_array, scan),
+    }
+
+
+def expand_primitive_columns(_scene):
+    '''
+    Converts the result of load_binary_primitives_columnar to the nested dicts returned by
+    load_binary_primitives_clustered/load_binary_primitives_interleaved.
+    '''
+    records = []
+    for type_id, name in primitive_names.items():
+        column = _scene['primitives'][name]
+        fields = {key: column[key].tolist() for key in primitive_dtypes[type_id].names}
+        for n, index in enumerate(column['index'].tolist()):
+            data = {'type': type_id}
+            data.update({key: values[n] for key, values in fields.items()})
+            records.append((index, bool(column['is_sensor'][n]), int(column['entity'][n]), int(column['surface'][n]), data))
+    records.sort(key=lambda r: r[0])
+
+    obstacles = {}
+    sensors = {}
+    for _, is_sensor, e, s, data in records:
+        if _scene['format'] == 2:
+            entity_key = f"{'sensor' if is_sensor else 'obstacle'}-entity{str(e).zfill(5)}"
+        else:
+            entity_key = f"entity{str(e).zfill(5)}"
+        (sensors if is_sensor else obstacles).setdefault(entity_key, {})[f"surface{str(s).zfill(5)}"] = data
+
+    return {'format': _scene['format'], 'obstacles': obstacles, 'sensors': sensors}
+
+
+# FORMAT 4: fixed-stride sections with an entity offset table, all values little endian
+"""
+uint8 version = 4
+uint8 sourceFormat          (layout of the decoded scene: 1 = meshes, 2 = clustered primitives, 3 = interleaved primitives)
+uint16 sectionCount
+uint32 reserved
+uint64 payloadSize          (bytes, incl. this header)
+foreach SECTION
+    uint32 sectionType      (see v4_section_dtypes)
+    uint32 recordCount
+    uint64 offset           (bytes from the version byte, 16 byte aligned)
+#SECTIONS, each an array of fixed-size records
+    ENTITIES (1):   uint32 firstSurface, uint32 surfacesCount, uint32 key (entity index of the source format), uint32 flags (bit 0: sensor entity in format 1/2)
+    SURFACES (2):   uint32 entity, uint32 surface, uint8 primitiveType (0 = triangle mesh), uint8 isSensor, uint16 reserved, uint32 first, uint32 count
+                    (first/count: range in TRIANGLES for meshes, record index in the section of the primitive type and 1 for primitives)
+    POINTS (3):     float32 x, y, z
+    TRIANGLES (4):  uint32 index0, index1, index2
+    DISKS (17), CYLINDERS (18), SPHERES (20), RECTANGLES (24): same as the primitive payloads of format 2/3 (see primitive_dtypes)
+"""
+
+v4_header = struct.Struct('<BBHIQ')
+v4_section = struct.Struct('<IIQ')
+v4_alignment = 16
+
+V4_ENTITIES = 1
+V4_SURFACES = 2
+V4_POINTS = 3
+V4_TRIANGLES = 4
+V4_PRIMITIVES = 16 # + primitiveType
+
+v4_section_dtypes = {
+    V4_ENTITIES: np.dtype([('first', '<u4'), ('count', '<u4'), ('key', '<u4'), ('flags', '<u4')]),
+    V4_SURFACES: np.dtype([('entity', '<u4'), ('surface', '<u4'), ('type', 'u1'), ('is_sensor', 'u1'), ('reserved', '<u2'), ('first', '<u4'), ('count', '<u4')]),
+    V4_POINTS: np.dtype(('<f4', 3)),
+    V4_TRIANGLES: np.dtype(('<u4', 3)),
+    **{V4_PRIMITIVES + t: dt.newbyteorder('<') for t, dt in primitive_dtypes.items()},
+}
+
+
+def map_v4_sections(binary_array, _start=0):
+    '''
+    Returns the header fields and every section of a format 4 payload as an array viewing binary_array (no copy).
+    '''
+    version, source_format, section_count, _, payload_size = v4_header.unpack_from(binary_array, _start)
+    if version != 4:
+        raise ValueError(f'Invalid format: {version}, expected 4')
+    if len(binary_array) - _start < payload_size:
+        raise ValueError(f'Incomplete scene data: {len(binary_array) - _start} of {payload_size} bytes')
+
+    sections = {}
+    for s in range(section_count):
+        section_type, count, offset = v4_section.unpack_from(binary_array, _start + v4_header.size + s * v4_section.size)
+        sections[section_type] = np.frombuffer(binary_array, dtype=v4_section_dtypes[section_type], count=count, offset=_start + offset)
+
+    for section_type in [V4_ENTITIES, V4_SURFACES]:
+        sections.setdefault(section_type, np.zeros(0, dtype=v4_section_dtypes[section_type]))
+
+    return source_format, sections
+
+
+def v4_entity_key(_source_format, _entity):
+    if _source_format == 3:
+        return f"entity{str(_entity['key']).zfill(5)}"
+    return f"{'sensor' if _entity['flags'] & 1 else 'obstacle'}-entity{str(_entity['key']).zfill(5)}"
+
+
+def load_v4_entity(_source_format, _sections, _e):
+    '''
+    Decodes entity _e of a mapped format 4 payload (see map_v4_sections) in the layout of its source format.
+    Returns the entity key and its obstacle and sensor surfaces.
+    '''
+    entity = _sections[V4_ENTITIES][_e]
+    surfaces = _sections[V4_SURFACES][entity['first']:entity['first'] + entity['count']]
+
+    obstacles = {}
+    sensors = {}
+    for surface in surfaces.tolist():
+        _, s, primitiveType, isSensor, _, first, count = surface
+        if primitiveType == 0:
+            data = _sections[V4_TRIANGLES][first:first + count]
+        else:
+            record = _sections[V4_PRIMITIVES + primitiveType][first]
+            data = {'type': primitiveType}
+            data.update({name: record[name].tolist() for name in record.dtype.names})
+        (sensors if isSensor > 0 else obstacles)[f"surface{str(s).zfill(5)}"] = data
+
+    return v4_entity_key(_source_format, entity), obstacles, sensors
+
+
+def load_binary_v4(binary_array, _verbose=False, _offset=1, _columnar=False):
+    '''
+    Decodes a format 4 payload (the version byte at _offset-1) into the scene dict of its source format.
+    Mesh indices and points are views of binary_array, with _columnar a primitive scene is returned
+    like load_binary_primitives_columnar and its columns view binary_array as well.
+    '''
+    source_format, sections = map_v4_sections(binary_array, _offset - 1)
+    entities = sections[V4_ENTITIES]
+    surfaces = sections[V4_SURFACES]
+
+    if _verbose:
+        logging.debug(f'format 4 | source format: {source_format}, entities: {len(entities)}, surfaces: {len(surfaces)}')
+
+    if _columnar and source_format >= 2:
+        columns = {}
+        for type_id, name in primitive_names.items():
+            records = sections.get(V4_PRIMITIVES + type_id, np.zeros(0, dtype=v4_section_dtypes[V4_PRIMITIVES + type_id]))
+            select = np.flatnonzero(surfaces['type'] == type_id)
+            select = select[np.argsort(surfaces['first'][select], kind='stable')]
+            column = {field: records[field] for field in records.dtype.names}
+            column['entity'] = entities['key'][surfaces['entity'][select]]
+            column['surface'] = surfaces['surface'][select]
+            column['is_sensor'] = surfaces['is_sensor'][select] > 0
+            column['index'] = select.astype(np.uint32)
+            columns[name] = column
+        return {'format': source_format, 'columnar': True, 'primitives': columns}
+
+    obstacles = {}
+    sensors = {}
+    for e in range(len(entities)):
+        entity_key, eObstacles, eSensors = load_v4_entity(source_format, sections, e)
+        if source_format == 3:
+            if len(eObstacles) > 0:
+                obstacles[entity_key] = eObstacles
+            if len(eSensors) > 0:
+                sensors[entity_key] = eSensors
+        elif entities['flags'][e] & 1:
+            sensors[entity_key] = eSensors
+        else:
+            obstacles[entity_key] = eObstacles
+
+    scene = {'format': source_format, 'obstacles': obstacles, 'sensors': sensors}
+    if source_format == 1:
+        scene['pointArray'] = sections.get(V4_POINTS, np.zeros((0, 3), dtype=np.float32))
+
+    return scene
+
+
+def encode_v4(_scene):
+    '''
+    Encodes a scene dict as returned by load_binary for the formats 1-3 (not columnar) into a format 4 payload.
+    '''
+    source_format = _scene['format']
+    index_of = lambda key: int(key.rsplit('entity' if 'entity' in key else 'surface', 1)[1])
+
+    # entity table entries: (key, flags, [(surface index, is sensor, data)])
+    if source_format == 3:
+        merged = {}
+        for group, is_sensor in [('obstacles', 0), ('sensors', 1)]:
+            for entity_key, surfaces in _scene[group].items():
+                merged.setdefault(index_of(entity_key), []).extend([(index_of(k), is_sensor, data) for k, data in surfaces.items()])
+        entity_list = [(key, 0, sorted(merged[key], key=lambda s: s[0])) for key in sorted(merged.keys())]
+    else:
+        entity_list = []
+        for group, is_sensor in [('obstacles', 0), ('sensors', 1)]:
+            for entity_key, surfaces in _scene[group].items():
+                entity_list.append((index_of(entity_key), is_sensor, [(index_of(k), is_sensor, data) for k, data in surfaces.items()]))
+
+    entities = np.zeros(len(entity_list), dtype=v4_section_dtypes[V4_ENTITIES])
+    surfaces = np.zeros(sum(len(e[2]) for e in entity_list), dtype=v4_section_dtypes[V4_SURFACES])
+    triangles = []; triangle_count = 0
+    primitives = {t: [] for t in primitive_dtypes}
+
+    s_index = 0
+    for e, (key, flags, entity_surfaces) in enumerate(entity_list):
+        entities[e] = (s_index, len(entity_surfaces), key, flags)
+        for surface, is_sensor, data in entity_surfaces:
+            if source_format == 1:
+                indices = np.asarray(data, dtype=np.uint32).reshape((-1, 3))
+                surfaces[s_index] = (e, surface, 0, is_sensor, 0, triangle_count, len(indices))
+                triangles.append(indices)
+                triangle_count += len(indices)
+            else:
+                type_id = data['type']
+                surfaces[s_index] = (e, surface, type_id, is_sensor, 0, len(primitives[type_id]), 1)
+                primitives[type_id].append(tuple(data[name] for name in primitive_dtypes[type_id].names))
+            s_index += 1
+
+    sections = {V4_ENTITIES: entities, V4_SURFACES: surfaces}
+    if source_format == 1:
+        sections[V4_TRIANGLES] = np.concatenate(triangles).astype('<u4') if triangles else np.zeros((0, 3), dtype='<u4')
+        sections[V4_POINTS] = np.asarray(_scene['pointArray'], dtype='<f4').reshape((-1, 3))
+    else:
+        for type_id, records in primitives.items():
+            if len(records) > 0:
+                sections[V4_PRIMITIVES + type_id] = np.array(records, dtype=v4_section_dtypes[V4_PRIMITIVES + type_id])
+
+    align = lambda n: (n + v4_alignment - 1) // v4_alignment * v4_alignment
+    directory = bytearray()
+    blocks = bytearray()
+    offset = align(v4_header.size + len(sections) * v4_section.size)
+    for section_type, records in sections.items():
+        directory += v4_section.pack(section_type, len(records), offset + len(blocks))
+        blocks += records.tobytes()
+        blocks += bytes(align(len(blocks)) - len(blocks))
+
+    payload = bytearray(v4_header.pack(4, source_format, len(sections), 0, offset + len(blocks)))
+    payload += directory
+    payload += bytes(offset - len(payload))
+    payload += blocks
+
+    return bytes(payload)
+
+class StreamDecoder():
+    '''
+    Resumable decoder for the formats 1-4, fed with chunks of the payload as they arrive (e.g. from an HTTP request body).
+
+    feed() returns the entities completed by the chunk as (group, entity_key, surfaces) tuples,
+    group is 'obstacles' or 'sensors' and surfaces the same dict load_binary would return for the entity.
+    finish() returns the full scene dict once the whole payload has been fed.
+
+    Note: in format 1 the points follow after all entities, finished mesh entities hold only the triangle indices.
+    '''
+
+    def __init__(self, _verbose=False):
+        self.verbose = _verbose
+        self.format = None
+        self.scene = None
+        self.events = []
+        self.buffer = bytearray()
+        self.position = 0
+        self.parser = self.parse()
+        self.request = next(self.parser) # number of bytes the parser waits for
+
+    def feed(self, _chunk):
+        self.buffer += _chunk
+        self.events = []
+        while self.scene is None and len(self.buffer) - self.position >= self.request:
+            data = bytes(self.buffer[self.position:self.position+self.request])
+            self.position += self.request
+            try:
+                self.request = self.parser.send(data)
+            except StopIteration as result:
+                self.scene = result.value
+        del self.buffer[:self.position]
+        self.position = 0
+        return self.events
+
+    def finish(self):
+        if self.scene is None:
+            raise ValueError(f'Incomplete scene data, decoder is waiting for {self.request - len(self.buffer)} more bytes.')
+        if len(self.buffer) > 0:
+            logging.warn(f'{len(self.buffer)} trailing bytes after the scene data')
+        return self.scene
+
+    def parse(self):
+        [format] = struct.unpack('B', (yield 1)) # uint8
+        logging.debug(f'binary file format: {format}')
+
+        if format not in [1, 2, 3, 4]:
+            logging.warn(f"Invalid format: {format}, expected any of {[1, 2, 3, 4]}, Falling back to format: 1")
+            self.position -= 1 # the byte is still buffered, parse it again as part of the first entitiesCount
+            format = 1
+        self.format = format
+
+        scene = {'format': format}
+        if format == 1:
+            scene['obstacles'] = yield from self.parse_mesh_entities('obstacle', 'obstacles')
+            scene['sensors'] = yield from self.parse_mesh_entities('sensor', 'sensors')
+            [pointsCount] = struct.unpack('I', (yield 4)) # uint32
+            scene['pointArray'] = np.frombuffer((yield pointsCount * 12), dtype=np.float32).reshape((pointsCount, 3)) if pointsCount > 0 else np.zeros((0, 3), dtype=np.float32)
+        elif format == 4:
+            scene = yield from self.parse_v4()
+        elif format == 2:
+            scene['obstacles'] = yield from self.parse_primitive_entities('obstacle-', 'obstacles')
+            scene['sensors'] = yield from self.parse_primitive_entities('sensor-', 'sensors')
+        else:
+            scene['obstacles'], scene['sensors'] = yield from self.parse_primitive_entities_interleaved()
+
+        return scene
+
+    def parse_v4(self):
+        # fixed-stride layout, wait for the whole payload (its size is in the header) and emit all entities at once
+        header = bytes([4]) + (yield v4_header.size - 1)
+        payload_size = v4_header.unpack(header)[-1]
+        binary_array = header + (yield payload_size - v4_header.size)
+
+        source_format, sections = map_v4_sections(binary_array)
+        for e in range(len(sections[V4_ENTITIES])):
+            entity_key, eObstacles, eSensors = load_v4_entity(source_format, sections, e)
+            for group, surfaces in [('obstacles', eObstacles), ('sensors', eSensors)]:
+                if len(surfaces) > 0:
+                    self.events.append((group, entity_key, surfaces))
+        self.format = source_format
+
+        return load_binary_v4(binary_array)
+
+    def parse_mesh_entities(self, _prefix, _group):
+        entities = {}
+        [entitiesCount] = struct.unpack('I', (yield 4)) # uint32
+        for e in range(entitiesCount):
+            entity_key = f"{_prefix}-entity{str(e).zfill(5)}"
+            [surfacesCount] = struct.unpack('I', (yield 4)) # uint32
+            surfaces = {}
+            for s in range(surfacesCount):
+                [trianglesCount] = struct.unpack('B', (yield 1)) # uint8
+                indices = (yield trianglesCount * 12) if trianglesCount > 0 else b'' # 3x uint32
+                surfaces[f"surface{str(s).zfill(5)}"] = np.frombuffer(indices, dtype=np.uint32).reshape((trianglesCount, 3))
+            entities[entity_key] = surfaces
+            self.events.append((_group, entity_key, surfaces))
+        return entities
+
+    def parse_primitive(self):
+        [primitiveType] = struct.unpack('B', (yield 1)) # uint8
+        if primitiveType not in primitive_dtypes:
+            raise ValueError(f'Invalid primitive type: {primitiveType}')
+        data, _ = primitive_map[primitiveType](0, (yield primitive_dtypes[primitiveType].itemsize))
+        return data
+
+    def parse_primitive_entities(self, _prefix, _group):
+        entities = {}
+        [entitiesCount] = struct.unpack('I', (yield 4)) # uint32
+        for e in range(entitiesCount):
+            entity_key = f"{_prefix}entity{str(e).zfill(5)}"
+            [surfacesCount] = struct.unpack('I', (yield 4)) # uint32
+            surfaces = {}
+            for s in range(surfacesCount):
+                surfaces[f"surface{str(s).zfill(5)}"] = yield from self.parse_primitive()
+            entities[entity_key] = surfaces
+            self.events.append((_group, entity_key, surfaces))
+        return entities
+
+    def parse_primitive_entities_interleaved(self):
+        obstacles = {}
+        sensors = {}
+        [entitiesCount] = struct.unpack('I', (yield 4)) # uint32
+        for e in range(entitiesCount):
+            entity_key = f"entity{str(e).zfill(5)}"
+            [surfacesCount] = struct.unpack('I', (yield 4)) # uint32
+            eObstacles = {}
+            eSensors = {}
+            for s in range(surfacesCount):
+                data = yield from self.parse_primitive()
+                [isSensor] = struct.unpack('B', (yield 1)) # bool
+                (eSensors if isSensor > 0 else eObstacles)[f"surface{str(s).zfill(5)}"] = data
+            if (len(eObstacles) > 0):
+                obstacles[entity_key] = eObstacles
+                self.events.append(('obstacles', entity_key, eObstacles))
+            if (len(eSensors) > 0):
+                sensors[entity_key] = eSensors
+                self.events.append(('sensors', entity_key, eSensors))
+        return obstacles, sensors
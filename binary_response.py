@@ -0,0 +1,107 @@
+import struct
+import numpy as np
+
+"""
+#RESPONSE, little endian
+char[4] magic = 'IRRB'
+uint8 version = 1
+uint8 dtype                 (1 = float32, 2 = float16, 3 = uint16 quantized), all values are stored as value / scale
+uint8 flags                 (bit 0: standard errors follow the values, bit 1: environment map follows)
+uint8 reserved
+uint32 count                (number of values, one per sensor in request order)
+uint32 spp                  (samples per sensor used for the values)
+float32 scale               (scale of the values, 1 for float32)
+float32 errorScale          (scale of the standard errors, 1 for float32)
+#VALUES
+count x dtype
+#STANDARD ERRORS (if flags bit 0)
+count x dtype
+#ENVIRONMENT MAP (if flags bit 1)
+uint32 size
+uint32 width
+size x float32
+"""
+
+response_header = struct.Struct('<4sBBBBIIff')
+response_magic = b'IRRB'
+
+FLAG_ERRORS = 1
+FLAG_ENVMAP = 2
+
+# request header value (see render-server.py) -> dtype id
+response_dtypes = {
+    'f32': 1,
+    'f16': 2,
+    'u16': 3,
+}
+
+response_numpy_dtypes = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<f2'),
+    3: np.dtype('<u2'),
+}
+
+
+def quantize(_values, _dtype_id):
+    values = np.asarray(_values, dtype=np.float64)
+    maxv = np.max(np.abs(values)) if values.size > 0 else 0.0
+    if _dtype_id == 1:
+        scale = 1.0
+    elif _dtype_id == 2:
+        # power of two scale keeps float16 below its range limit (65504) without losing precision
+        scale = 2.0 ** np.ceil(np.log2(maxv / 32768.0)) if maxv > 32768.0 else 1.0
+    else:
+        scale = maxv / 65535.0 if maxv > 0 else 1.0
+        values = np.round(np.clip(values, 0.0, None) / scale)
+        return values.astype(response_numpy_dtypes[3]), scale
+    return (values / scale).astype(response_numpy_dtypes[_dtype_id]), scale
+
+
+def encode_response(_values, _spp, _dtype='f32', _errors=None, _envmap=None):
+    '''
+    Encodes the measurements (and optionally their standard errors and the environment map) in the layout above.
+    '''
+    dtype_id = response_dtypes[_dtype]
+    values, scale = quantize(_values, dtype_id)
+    flags = 0
+    error_scale = 1.0
+    body = bytearray(values.tobytes())
+
+    if _errors is not None:
+        errors, error_scale = quantize(_errors, dtype_id)
+        body += errors.tobytes()
+        flags |= FLAG_ERRORS
+
+    if _envmap is not None:
+        envmap = np.asarray(_envmap, dtype='<f4')
+        body += struct.pack('<II', envmap.size, envmap.shape[1])
+        body += envmap.tobytes()
+        flags |= FLAG_ENVMAP
+
+    return response_header.pack(response_magic, 1, dtype_id, flags, 0, len(values), _spp, scale, error_scale) + bytes(body)
+
+
+def decode_response(_data):
+    '''
+    Inverse of encode_response, returns a dict with values, errors (or None), spp and envmap (or None) as float32 arrays.
+    '''
+    magic, version, dtype_id, flags, _, count, spp, scale, error_scale = response_header.unpack_from(_data, 0)
+    if magic != response_magic or version != 1:
+        raise ValueError(f'Invalid response header: {magic}, version: {version}')
+
+    dtype = response_numpy_dtypes[dtype_id]
+    i = response_header.size
+    response = {'spp': spp, 'errors': None, 'envmap': None}
+
+    response['values'] = np.frombuffer(_data, dtype=dtype, count=count, offset=i).astype(np.float32) * np.float32(scale)
+    i += count * dtype.itemsize
+
+    if flags & FLAG_ERRORS:
+        response['errors'] = np.frombuffer(_data, dtype=dtype, count=count, offset=i).astype(np.float32) * np.float32(error_scale)
+        i += count * dtype.itemsize
+
+    if flags & FLAG_ENVMAP:
+        size, width = struct.unpack_from('<II', _data, i); i += 8
+        response['envmap'] = np.frombuffer(_data, dtype='<f4', count=size, offset=i).reshape((-1, width))
+
+    return response
@@ -0,0 +1,36 @@
+import logging, time
+import binary_loader
+
+def main(_path, _out_path):
+    t = time.perf_counter_ns()
+    scene = binary_loader.load_path(_path)
+    payload = binary_loader.encode_v4(scene)
+    with open(_out_path, 'wb') as f:
+        f.write(payload)
+    logging.info(f'Converted {_path} (format {scene["format"]}) to {_out_path} (format 4, {len(payload)} bytes) ... dur.: {(time.perf_counter_ns()-t) / 1e9:.2f} sec.')
+
+if __name__ == "__main__":
+
+    """
+    Options:
+    -h,--help | Print this help message and exit
+    scene_path (string, required) | Path to the scene (format 1-3)
+    out_path (string, required) | Path of the converted scene (format 4)
+    --verbose (bool, default=False) | Be verbose.
+    """
+
+    import argparse
+
+    # example CMD
+    # python convert-scene.py data/t700.prim data/t700.v4
+
+    parser = argparse.ArgumentParser(description='Converts simulation scenes to the fixed-stride format 4.')
+    parser.add_argument('scene_path', type=str, help='Path of the simulation scene file.')
+    parser.add_argument('out_path', type=str, help='Path of the converted scene file.')
+    parser.add_argument('--verbose', type=bool, default=False, help='Be verbose.')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    main(args.scene_path, args.out_path)
@@ -0,0 +1,156 @@
+import logging
+import numpy as np
+import binary_loader
+import tracing
+
+"""
+Sensor-relevance culling of obstacle entities, between binary_loader and RendererMts3.load_sim_scene.
+
+The sensors of every entity are bounded by an axis aligned box (Y up). An obstacle entity (bounding box of its obstacle surfaces)
+is dropped if, for every sensor box,
+
+    its horizontal distance to the sensor box is larger than max_distance, or
+    its top is lower than the bottom of the sensor box plus the horizontal distance times tan(min_elevation),
+    i.e. it can only block directions below min_elevation above the horizon (min_elevation = 0: entirely below the sensors).
+
+Both tests are approximations: light reflected by the culled obstacles (or the ground they shade) is not accounted for.
+"""
+
+PAIRS_PER_CHUNK = 1 << 20 # obstacle x sensor box pairs tested at once
+
+
+def primitive_bounds(_type_id, _column):
+    '''
+    Axis aligned bounds (N,3), (N,3) of every primitive of a column, conventions of tessellation.py.
+    '''
+    if _type_id == 4: # sphere
+        center = np.asarray(_column['center'], dtype=np.float64)
+        radius = np.asarray(_column['radius'], dtype=np.float64)[:, None]
+        return center - radius, center + radius
+
+    matrix = np.asarray(_column['matrix'], dtype=np.float64).reshape((-1, 3, 4))
+    origin = matrix[:, :, 3]
+    if _type_id == 8: # rectangle <-1,1> in XY
+        extent = np.abs(matrix[:, :, 0]) + np.abs(matrix[:, :, 1])
+        return origin - extent, origin + extent
+
+    # disk and cylinder cross section: circle in local XZ, its bounds are the row norms of the XZ columns
+    extent = np.sqrt(matrix[:, :, 0]**2 + matrix[:, :, 2]**2)
+    if _type_id == 1: # unit disk
+        return origin - extent, origin + extent
+
+    # cylinder along +Y from 0 to length
+    extent = extent * np.asarray(_column['radius'], dtype=np.float64)[:, None]
+    top = origin + matrix[:, :, 1] * np.asarray(_column['length'], dtype=np.float64)[:, None]
+    return np.minimum(origin, top) - extent, np.maximum(origin, top) + extent
+
+
+def column_bounds(_columns, _select):
+    '''
+    Bounds of the selected primitives (_select(column) -> bool mask) of all columns with their entity ids.
+    '''
+    entity = []; lower = []; upper = []
+    for type_id, name in binary_loader.primitive_names.items():
+        column = _columns.get(name)
+        if column is None or len(column['entity']) == 0:
+            continue
+        rows = _select(column)
+        lo, hi = primitive_bounds(type_id, column)
+        entity.append(np.asarray(column['entity'])[rows]); lower.append(lo[rows]); upper.append(hi[rows])
+    if len(entity) == 0:
+        return np.zeros(0, dtype=np.uint32), np.zeros((0, 3)), np.zeros((0, 3))
+    return np.concatenate(entity), np.concatenate(lower), np.concatenate(upper)
+
+
+def entity_bounds(_entity, _lower, _upper):
+    '''
+    Bounds per entity: entity ids (E), lower (E,3), upper (E,3).
+    '''
+    entities, inverse = np.unique(_entity, return_inverse=True)
+    lower = np.full((len(entities), 3), np.inf); upper = np.full((len(entities), 3), -np.inf)
+    np.minimum.at(lower, inverse, _lower)
+    np.maximum.at(upper, inverse, _upper)
+    return entities, lower, upper
+
+
+def mesh_entity_bounds(_entities, _points):
+    '''
+    Bounds of the entities (objk -> surfk -> triangle indices) of a mesh scene (format 1), entities without triangles are skipped.
+    '''
+    keys = []; lower = []; upper = []
+    for objk, surfaces in _entities.items():
+        indices = np.concatenate([np.ravel(tindices) for tindices in surfaces.values()] + [np.zeros(0, dtype=np.uint32)])
+        if len(indices) == 0:
+            continue
+        points = _points[indices]
+        keys.append(objk); lower.append(np.min(points, axis=0)); upper.append(np.max(points, axis=0))
+    return keys, np.reshape(lower, (-1, 3)), np.reshape(upper, (-1, 3))
+
+
+def scene_bounds(_scene_data):
+    '''
+    Bounds (3), (3) of all surfaces of a scene (columnar primitives or format 1 meshes).
+    '''
+    if _scene_data.get('columnar', False):
+        _, lower, upper = column_bounds(_scene_data['primitives'], lambda column: np.ones(len(column['entity']), dtype=bool))
+    else:
+        _, lower, upper = mesh_entity_bounds({**_scene_data['obstacles'], **{('sensor', objk): surfaces for objk, surfaces in _scene_data['sensors'].items()}}, np.asarray(_scene_data['pointArray'], dtype=np.float64))
+    if len(lower) == 0:
+        return np.zeros(3), np.zeros(3)
+    return np.min(lower, axis=0), np.max(upper, axis=0)
+
+
+def relevant(_lower, _upper, _sensor_lower, _sensor_upper, _max_distance=None, _min_elevation=None):
+    '''
+    Mask of the boxes (N,3) that pass both tests against at least one of the sensor boxes (M,3).
+    '''
+    keep = np.zeros(len(_lower), dtype=bool)
+    step = max(1, PAIRS_PER_CHUNK // max(len(_sensor_lower), 1))
+    for start in range(0, len(_lower), step):
+        lower = _lower[start:start + step, None]; upper = _upper[start:start + step, None]
+        gap = np.maximum(0.0, np.maximum(lower - _sensor_upper[None], _sensor_lower[None] - upper))
+        distance = np.hypot(gap[:, :, 0], gap[:, :, 2])
+        passed = np.ones(distance.shape, dtype=bool)
+        if _max_distance is not None:
+            passed &= distance <= _max_distance
+        if _min_elevation is not None:
+            passed &= upper[:, :, 1] >= _sensor_lower[None, :, 1] + distance * np.tan(np.radians(_min_elevation))
+        keep[start:start + step] = np.any(passed, axis=1)
+    return keep
+
+
+def cull_obstacles(_scene_data, _max_distance=None, _min_elevation=None):
+    '''
+    Scene data (columnar primitives or format 1 meshes) without the obstacle entities that can not shade a sensor,
+    returns (scene data, number of culled entities). Scenes without sensors are returned unchanged.
+    '''
+    with tracing.span('culling'):
+        if _scene_data.get('columnar', False):
+            columns = _scene_data['primitives']
+            is_sensor = lambda column: np.asarray(column['is_sensor'], dtype=bool)
+            _, sensor_lower, sensor_upper = entity_bounds(*column_bounds(columns, is_sensor))
+            if len(sensor_lower) == 0:
+                return _scene_data, 0
+            entities, lower, upper = entity_bounds(*column_bounds(columns, lambda column: ~is_sensor(column)))
+            culled = entities[~relevant(lower, upper, sensor_lower, sensor_upper, _max_distance, _min_elevation)]
+
+            out = {}
+            for name, column in columns.items():
+                keep = is_sensor(column) | ~np.isin(column['entity'], culled)
+                out[name] = {key: np.asarray(values)[keep] for key, values in column.items()}
+            result = {**_scene_data, 'primitives': out}
+        elif _scene_data['format'] == 1:
+            points = np.asarray(_scene_data['pointArray'], dtype=np.float64)
+            _, sensor_lower, sensor_upper = mesh_entity_bounds(_scene_data['sensors'], points)
+            if len(sensor_lower) == 0:
+                return _scene_data, 0
+            keys, lower, upper = mesh_entity_bounds(_scene_data['obstacles'], points)
+            keep = relevant(lower, upper, sensor_lower, sensor_upper, _max_distance, _min_elevation)
+            culled = set(objk for objk, k in zip(keys, keep) if not k)
+            result = {**_scene_data, 'obstacles': {objk: surfaces for objk, surfaces in _scene_data['obstacles'].items() if objk not in culled}}
+        else:
+            logging.warn('Obstacle culling needs columnar primitive or mesh scene data, nothing culled.')
+            return _scene_data, 0
+
+    logging.info(f'Culled {len(culled)} of {len(lower)} obstacle entities.')
+    return result, len(culled)
@@ -0,0 +1,100 @@
+import bisect
+import numpy as np
+
+"""
+Detection of entities with identical geometry, for Mitsuba shapegroup/instance objects (see PrimitiveSceneBuilder).
+
+The surfaces of an entity are expressed relative to an entity frame (rotation and translation of its first transformed surface,
+or the center of its first sphere). Entities with the same surface types whose local parameters match within TOLERANCE share
+their geometry. The stored parameters are float32, so the local parameters of copies differ slightly and are compared with a
+tolerance instead of hashed: the candidates are found by sorting the entities along a random projection of their parameters.
+"""
+
+TOLERANCE = 1e-4 # max. absolute difference of the local parameters (m) of matching entities
+
+_PARAMETER_KEYS = ['matrix', 'center', 'length', 'radius']
+
+
+def entity_frame(_surfaces):
+    '''
+    Rigid transform (3x4 row major) of the entity: orthonormal part of the first surface matrix and its translation.
+    '''
+    for data in _surfaces.values():
+        if 'matrix' in data:
+            matrix = np.asarray(data['matrix'], dtype=np.float64).reshape((3, 4))
+            u, _, vt = np.linalg.svd(matrix[:, :3])
+            rotation = u @ vt
+            if np.linalg.det(rotation) < 0:
+                rotation = u @ np.diag([1.0, 1.0, -1.0]) @ vt
+            return np.concatenate([rotation, matrix[:, 3:]], axis=1)
+
+    frame = np.eye(3, 4)
+    for data in _surfaces.values():
+        frame[:, 3] = np.asarray(data['center'], dtype=np.float64)
+        break
+    return frame
+
+
+def local_surfaces(_surfaces, _frame):
+    '''
+    Surfaces (same keys and data layout) transformed by the inverse of the entity frame.
+    '''
+    rotation_t = _frame[:, :3].T
+    translation = _frame[:, 3]
+    local = {}
+    for surfk, data in _surfaces.items():
+        data_local = dict(data)
+        if 'matrix' in data:
+            matrix = np.asarray(data['matrix'], dtype=np.float64).reshape((3, 4))
+            matrix = np.concatenate([rotation_t @ matrix[:, :3], (rotation_t @ (matrix[:, 3] - translation))[:, None]], axis=1)
+            data_local['matrix'] = matrix.ravel().tolist()
+        if 'center' in data:
+            data_local['center'] = (rotation_t @ (np.asarray(data['center'], dtype=np.float64) - translation)).tolist()
+        local[surfk] = data_local
+    return local
+
+
+def structure_key(_local_surfaces):
+    return tuple(data['type'] for data in _local_surfaces.values())
+
+
+def parameters(_local_surfaces):
+    '''
+    All local parameters of an entity in surface order (entities with the same structure_key have the same length).
+    '''
+    values = [np.ravel(np.asarray(data[key], dtype=np.float64)) for data in _local_surfaces.values() for key in _PARAMETER_KEYS if key in data]
+    return np.concatenate(values) if len(values) > 0 else np.zeros(0)
+
+
+def group_entities(_local_surfaces_list, _tolerance=TOLERANCE, _seed=0):
+    '''
+    Returns lists of entity indices (into _local_surfaces_list) with matching geometry, every entity is in exactly one list.
+    '''
+    buckets = {}
+    for i, local in enumerate(_local_surfaces_list):
+        buckets.setdefault(structure_key(local), []).append(i)
+
+    rng = np.random.default_rng(_seed)
+    groups = []
+    for indices in buckets.values():
+        values = np.stack([parameters(_local_surfaces_list[i]) for i in indices])
+        direction = rng.normal(size=values.shape[1])
+        projection = values @ direction
+        window = _tolerance * np.sum(np.abs(direction)) # bound of the projection difference of matching entities
+
+        # sweep in projection order, only representatives within the window can match
+        rep_projections = []; rep_rows = []; rep_groups = []
+        for row in np.argsort(projection, kind='stable'):
+            first = bisect.bisect_left(rep_projections, projection[row] - window)
+            for k in range(first, len(rep_rows)):
+                if np.max(np.abs(values[rep_rows[k]] - values[row]), initial=0.0) <= _tolerance:
+                    rep_groups[k].append(indices[row])
+                    break
+            else:
+                rep_projections.append(projection[row]); rep_rows.append(row); rep_groups.append([indices[row]])
+        groups.extend(sorted(group) for group in rep_groups)
+    return groups
+
+
+def to_world(_frame):
+    return np.concatenate([_frame, [[0, 0, 0, 1]]], axis=0)
@@ -0,0 +1,99 @@
+import numpy as np
+import mitsuba as mi
+import drjit as dr
+
+"""
+Irradiance meter for many surfaces in one sensor, all surfaces are measured by a single mi.render call.
+
+    'dmultisensor': {
+        'type': 'multi_irradiancemeter',
+        'shape_ids': 'leaf0,leaf1,...', # ids of the measured shapes (comma separated), shape i is accumulated in film pixel i
+        'film': { 'type': 'hdrfilm', 'width': <number of shapes>, 'height': 1, ... },
+        ...
+    }
+
+Every film pixel selects its shape, samples a position on it (area weighted, see Shape.sample_position) and a cosine weighted
+direction around the surface normal, so the film pixels accumulate the same estimate as one irradiancemeter per shape.
+The shapes are looked up after the scene is loaded, call resolve_shapes(scene) before rendering (Mitsuba does not forward
+set_scene to Python sensors).
+
+The sensor is written in Python, it needs a JIT variant (llvm_ad_rgb or cuda_ad_rgb), there sample_ray is traced once for the
+whole wavefront. In the scalar variants it would be called for every sample.
+"""
+
+PLUGIN_NAME = 'multi_irradiancemeter'
+
+# offset of the ray origins along the ray direction, avoids intersections with the sampled surface
+RAY_OFFSET = 1e-4
+
+
+def register():
+    '''
+    Registers the sensor plugin for the current Mitsuba variant.
+    '''
+
+    class MultiIrradianceMeter(mi.Sensor):
+
+        def __init__(self, props):
+            super().__init__(props)
+            self.shape_ids = props['shape_ids'].split(',') if props.has_property('shape_ids') else []
+            self.shapes = None
+            self.m_needs_sample_3 = True # position sample on the shape
+
+        def resolve_shapes(self, _scene):
+            shapes = _scene.shapes()
+            index_map = {shape.id(): i for i, shape in enumerate(shapes)}
+            indices = np.array([index_map[shape_id] for shape_id in self.shape_ids], dtype=np.uint32)
+
+            # the area distribution of meshes is only built on demand, it has to exist before sample_position is traced,
+            # the traced virtual call covers all shapes of the scene (not just the measured ones)
+            for shape in shapes:
+                if shape.is_mesh():
+                    shape.surface_area()
+
+            self.shapes = dr.gather(mi.ShapePtr, _scene.shapes_dr(), mi.UInt32(indices))
+
+        def sample_ray(self, time, wavelength_sample, position_sample, aperture_sample, active=True):
+            count = len(self.shape_ids)
+            x = position_sample.x * count
+            pixel = mi.UInt32(dr.clamp(mi.Int32(dr.floor(x)), 0, count - 1))
+
+            shape = dr.gather(mi.ShapePtr, self.shapes, pixel, active)
+            ps = shape.sample_position(time, aperture_sample, active)
+
+            # the position within the pixel is uniform as well and used for the direction
+            local = mi.warp.square_to_cosine_hemisphere(mi.Point2f(x - dr.floor(x), position_sample.y))
+            direction = mi.Frame3f(ps.n).to_world(local)
+
+            wavelengths, weight = self.sample_wavelengths(dr.zeros(mi.SurfaceInteraction3f), wavelength_sample, active)
+            ray = mi.Ray3f(ps.p + direction * RAY_OFFSET, direction, time, wavelengths)
+            return ray, weight * dr.pi
+
+        def sample_ray_differential(self, time, wavelength_sample, position_sample, aperture_sample, active=True):
+            ray, weight = self.sample_ray(time, wavelength_sample, position_sample, aperture_sample, active)
+            return mi.RayDifferential3f(ray), weight
+
+        def to_string(self):
+            return f'MultiIrradianceMeter[shapes={len(self.shape_ids)}]'
+
+    mi.register_sensor(PLUGIN_NAME, lambda props: MultiIrradianceMeter(props))
+
+
+def get_sensor(_spp, _shape_ids):
+    return {
+        'type': PLUGIN_NAME,
+        'shape_ids': ','.join(_shape_ids),
+        'sampler': {
+            'type': 'independent',
+            'sample_count': _spp,
+        },
+        'film': {
+            'type': 'hdrfilm',
+            'width': len(_shape_ids),
+            'height': 1,
+            'rfilter': {
+                'type': 'box',
+            },
+            'pixel_format': 'rgb',
+        },
+    }
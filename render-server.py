@@ -1,12 +1,19 @@
+import io
 import logging
 from RendererMts3 import RendererMts3
+import binary_response
+import tracing
 from http.server import BaseHTTPRequestHandler, HTTPServer
 import numpy as np
 import os.path
+import signal
 import sys
 import struct
 
 DEBUG_WRITE_IMG = False
+TRACE_WRITE_INTERVAL = 100 # requests between writes of the trace, it is written on exit as well
+
+request_count = 0
 
 class RenderServer(BaseHTTPRequestHandler):
     def do_GET(self):
@@ -14,30 +21,72 @@ class RenderServer(BaseHTTPRequestHandler):
         self.end_headers()
 
     def do_POST(self):
+        global request_count
+        with tracing.span('request', length=self.headers['Content-Length']):
+            if self.path.rstrip('/') == '/static':
+                self.handle_static()
+            else:
+                self.handle_post()
+        # write() dumps all recorded spans, so the trace is only written every TRACE_WRITE_INTERVAL requests
+        request_count += 1
+        if tracing.ENABLED and request_count % TRACE_WRITE_INTERVAL == 0:
+            tracing.write()
+
+    def handle_static(self):
+        '''
+        Registers the body (any scene format) as the static obstacle scene of the following requests, an empty body removes it.
+        '''
+        length = int(self.headers['Content-Length'])
+        renderer.load_static_binary(self.rfile.read(length))
+        self.send_response(200)
+        self.end_headers()
+
+    def handle_post(self):
         global args
         global renderer
 
         length = int(self.headers['Content-Length'])
         latitude, longitude, starttime, endtime, rays, reqEnv = float(self.headers['La']), float(self.headers['Lo']), self.headers['Ti'], self.headers['TiE'], self.headers['Ra'], self.headers['Env']
         camera = self.headers["Cam"]
-        
-        rawData = self.rfile.read(length)
+        respFormat, errorPasses = self.headers['Rf'], self.headers['Se']
+        errors = None
+
+        # invalid response headers are rejected before the scene is loaded, the status can not change once the body is written
+        if respFormat is not None and respFormat not in binary_response.response_dtypes:
+            return self.reject(length, f"Invalid response format (Rf): {respFormat}, expected any of {list(binary_response.response_dtypes.keys())}")
+        if errorPasses is not None:
+            if not errorPasses.strip().isdigit() or int(errorPasses) < 2:
+                return self.reject(length, f"Invalid number of error passes (Se): {errorPasses}, expected an integer >= 2")
+            errorPasses = int(errorPasses)
+
+        # the scene is decoded while the body arrives, keep a copy only if it is loaded a second time
+        body = self.rfile if not DEBUG_WRITE_IMG else io.BytesIO(self.rfile.read(length))
+
+        # or the whole body is decoded into arrays per primitive type and the scene is built from those (RendererMts3.load_sim_scene_columns)
+        load_scene = renderer.load_stream if not (args.columnar or args.persistent_scene or args.shape_cache > 0 or args.cull_distance is not None or args.cull_elevation is not None or args.tiles > 0 or args.spatial_order) else lambda _body, _length, *params: renderer.load_binary(_body.read(_length), *params)
 
         if rays == None or int(rays) <= 0:
             rays = 128 if args.rays == None else int(args.rays)
         else:
             rays = int(rays)
+        spp = rays # samples per sensor of the measurements (response header)
 
         defaultEPW = os.path.join("epw", "AUT_Vienna.Schwechat.110360_IWEC", "AUT_Vienna.Schwechat.110360_IWEC.epw")
 
         if args.dummy:
             print("DUMMY MODE")
             count = int(self.headers['C'])
+            body.read(length)
             measurements = renderer.render_dummy(count)
         else:
             if camera is None:
-                envmap, hoy_count = renderer.load_binary(rawData, latitude, longitude, starttime, rays, defaultEPW, endtime)
-                measurements = renderer.render(rays) # irradaince W/m2
+                envmap, hoy_count = load_scene(body, length, latitude, longitude, starttime, rays, defaultEPW, endtime)
+                if respFormat is not None and errorPasses is not None:
+                    measurements, errors = renderer.render_with_error(rays, errorPasses) # irradaince W/m2
+                    spp = errorPasses * RendererMts3.error_pass_spp(rays, errorPasses)
+                    errors *= hoy_count * 3600.0
+                else:
+                    measurements = renderer.render(rays) # irradaince W/m2
                 # convert to Jouls/m2
                 measurements *= hoy_count * 3600.0 # multiply by timespan in hours * seconds per hour
             else:
@@ -49,7 +98,7 @@ class RenderServer(BaseHTTPRequestHandler):
                 cam['width'] = np.int32(allCameraParams[7])
                 cam['height'] = np.int32(allCameraParams[8])
 
-                envmap = renderer.load_binary(rawData, latitude, longitude, starttime, rays, defaultEPW, endtime, cam)
+                envmap = load_scene(body, length, latitude, longitude, starttime, rays, defaultEPW, endtime, cam)
                 measurements = renderer.render_for_cam(rays)
 
             if DEBUG_WRITE_IMG:
@@ -59,19 +108,31 @@ class RenderServer(BaseHTTPRequestHandler):
                 cam['fov'] = 70.0
                 cam['width'] = 512
                 cam['height'] = 512   
-                envmap = renderer.load_binary(rawData, latitude, longitude, starttime, rays, defaultEPW, endtime, cam)
+                envmap = renderer.load_binary(body.getvalue(), latitude, longitude, starttime, rays, defaultEPW, endtime, cam)
                 _ = renderer.render_for_cam(rays)
 
-        self.send_response(200)
-        self.send_header("Content-type", "application/octet-stream")
-        self.end_headers()
-        if reqEnv is not None:
-            order = '<H' if sys.byteorder == 'little' else '>H'
-            envmap = envmap[:,:,0]
-            self.wfile.write(struct.pack(order, envmap.size))
-            self.wfile.write(struct.pack(order, envmap.shape[1]))
-            self.wfile.write(envmap.tobytes())
-        self.wfile.write(measurements.tobytes())
+        with tracing.span('serialization'):
+            self.send_response(200)
+            self.send_header("Content-type", "application/octet-stream")
+            self.end_headers()
+            if respFormat is not None:
+                self.wfile.write(binary_response.encode_response(measurements, spp, respFormat, errors, envmap[:,:,0] if reqEnv is not None else None))
+                return
+            if reqEnv is not None:
+                order = '<H' if sys.byteorder == 'little' else '>H'
+                envmap = envmap[:,:,0]
+                self.wfile.write(struct.pack(order, envmap.size))
+                self.wfile.write(struct.pack(order, envmap.shape[1]))
+                self.wfile.write(envmap.tobytes())
+            self.wfile.write(measurements.tobytes())
+
+    def reject(self, _length, _message):
+        '''
+        Discards the request body and replies 400 with _message.
+        '''
+        self.rfile.read(_length)
+        logging.error(_message)
+        self.send_error(400, _message)
 
     def log_message(self, format, *args):
         return
@@ -85,6 +146,21 @@ if __name__ == "__main__":
     --rays (unsigned int, default=128) | Number of rays to cast from each triangle in the mesh
     --verbose | Be verbose.
     --dummy | Dummy mode that returns only ones. The count needs to be specified in a header `C`.
+    --trace (string) | Write Chrome trace (Perfetto) spans of every request to this path.
+    --multi_sensor | Measure all sensors with one multi_irradiancemeter (JIT variant, see multi_irradiancemeter.py).
+    --merge_obstacles | Tessellate the obstacle primitives and merge them into one mesh per primitive type.
+    --instance_obstacles | Share the geometry of obstacle entities with identical shape (Mitsuba shapegroup/instance).
+    --load_threads (int, default=0) | Worker threads of the scene loading (0 = all cores, 1 = serial).
+    --defer_shapes | Streaming: create the shapes in parallel after the whole body arrived, instead of while it arrives.
+    --columnar | Receive the whole scene, then build it from arrays per primitive type (faster for primitive scenes, no streaming).
+    --persistent_scene | Keep the loaded scene and write the primitives of the next request into it if its structure is unchanged (implies --columnar).
+    --cull_distance (float) | Drop obstacle entities farther (m, horizontally) from the sensors (see culling.py, implies --columnar).
+    --cull_elevation (float) | Drop obstacle entities that can only shade the sensors below this elevation (deg, 0 = below all sensors, implies --columnar).
+    --tiles (int, default=0) | Surround the plot by this many rings of instanced copies of its geometry (obstacles only), see README, implies --columnar.
+    --tile_period (float float) | Tile offsets in X and Z (m), the planting pitch of the plot (required with --tiles, > 0).
+    --static_scene (string) | Static obstacle scene (any format) added to every request, can be replaced by a POST to /static.
+    --shape_cache (int, default=0) | Memory bound (MiB) of the cache of obstacle shapes of unchanged entities across requests, 0 = off (implies --columnar).
+    --spatial_order | Measure the sensors of primitive scenes in Morton order (see spatial_order.py), the results stay in file order (implies --columnar).
     """
 
     import argparse
@@ -94,9 +170,27 @@ if __name__ == "__main__":
     parser.add_argument('--rays', type=int, default=1024, help='Number of rays per element.')
     parser.add_argument('--verbose', type=bool, default=False, help='Verbose output to the console.')
     parser.add_argument('--dummy', type=bool, default=False, help='Dummy mode that returns only ones.')
+    parser.add_argument('--trace', type=str, default=None, help='Chrome trace (JSON) output path.')
+    parser.add_argument('--multi_sensor', action='store_true', help='Measure all sensors with one multi_irradiancemeter (JIT variant).')
+    parser.add_argument('--merge_obstacles', action='store_true', help='Merge the obstacle primitives into one mesh per primitive type.')
+    parser.add_argument('--instance_obstacles', action='store_true', help='Instance obstacle entities with identical geometry.')
+    parser.add_argument('--load_threads', type=int, default=0, help='Worker threads of the scene loading (0 = all cores, 1 = serial).')
+    parser.add_argument('--defer_shapes', action='store_true', help='Streaming: create the shapes after the body arrived (parallel), not while it arrives.')
+    parser.add_argument('--columnar', action='store_true', help='Build primitive scenes from arrays per primitive type instead of streaming.')
+    parser.add_argument('--cull_distance', type=float, default=None, help='Drop obstacle entities farther (m) from the sensors.')
+    parser.add_argument('--cull_elevation', type=float, default=None, help='Drop obstacle entities that only shade the sensors below this elevation (deg).')
+    parser.add_argument('--tiles', type=int, default=0, help='Rings of instanced copies of the plot around it (obstacles only).')
+    parser.add_argument('--tile_period', type=float, nargs=2, default=None, help='Tile offsets in X and Z (m), the plot pitch (required with --tiles).')
+    parser.add_argument('--static_scene', type=str, default=None, help='Static obstacle scene added to every request (replace with a POST to /static).')
+    parser.add_argument('--shape_cache', type=int, default=0, help='Memory bound (MiB) of the obstacle shape cache across requests, 0 = off (implies --columnar).')
+    parser.add_argument('--persistent_scene', action='store_true', help='Update the loaded scene if the next one has the same structure (implies --columnar).')
+    parser.add_argument('--spatial_order', action='store_true', help='Measure the sensors of primitive scenes in Morton order (implies --columnar).')
 
     args = parser.parse_args()
 
+    if args.tiles > 0 and (args.tile_period is None or min(args.tile_period) <= 0):
+        parser.error('--tiles needs a positive --tile_period X Z (the planting pitch of the plot)')
+
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
         #logging.basicConfig(level=logging.DEBUG)
@@ -104,7 +198,14 @@ if __name__ == "__main__":
         logging.basicConfig(level=logging.ERROR)
 
     logging.debug('Args: %s', args)
-    renderer = RendererMts3(args.verbose, _use_batch_render=True)
+
+    if args.trace is not None:
+        tracing.enable(args.trace)
+        # the trace is written on exit (atexit), also when the server is terminated
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    renderer = RendererMts3(args.verbose, _use_batch_render=True, _use_multi_sensor=args.multi_sensor, _merge_obstacles=args.merge_obstacles, _instance_obstacles=args.instance_obstacles, _load_threads=args.load_threads, _persistent_scene=args.persistent_scene, _shape_cache_bytes=args.shape_cache * 2**20, _cull_distance=args.cull_distance, _cull_elevation=args.cull_elevation, _tile_count=args.tiles, _tile_period=args.tile_period, _defer_stream_shapes=args.defer_shapes, _spatial_order=args.spatial_order)
+    if args.static_scene is not None:
+        renderer.load_static_path(args.static_scene)
 
     print("Starting rendering server ...")
     with HTTPServer(('', args.port), RenderServer) as server:
@@ -1,6 +1,7 @@
 import os, logging, time
 import matplotlib.pyplot as plt
 from RendererMts3 import RendererMts3
+import tracing
 
 def show_render(img):
     plt.figure()
@@ -9,11 +10,11 @@ def show_render(img):
     plt.savefig('result.png', format='png')
     plt.show()
 
-def main(_path, _lat, _long, _datetime_str, _ray_count=128, _epw_path=None, _end_datetime_str=None, _verbose=False, _use_batch_rendering=False, _show_render=False, _save_path=''):
+def main(_path, _lat, _long, _datetime_str, _ray_count=128, _epw_path=None, _end_datetime_str=None, _verbose=False, _use_batch_rendering=False, _show_render=False, _save_path='', _use_multi_sensor=False, _merge_obstacles=False, _instance_obstacles=False, _load_threads=0, _cull_distance=None, _cull_elevation=None, _tile_count=0, _tile_period=None, _snapshot_dir=None, _spatial_order=False):
 
     t_total = time.perf_counter_ns()
     
-    renderer = RendererMts3(_verbose, _use_batch_rendering)
+    renderer = RendererMts3(_verbose, _use_batch_rendering, _use_multi_sensor, _merge_obstacles, _instance_obstacles, _load_threads, _camera_image=_show_render or len(_save_path) > 0, _cull_distance=_cull_distance, _cull_elevation=_cull_elevation, _tile_count=_tile_count, _tile_period=_tile_period, _snapshot_dir=_snapshot_dir, _spatial_order=_spatial_order)
     logging.info(f'Renderer initialization dur.: {(time.perf_counter_ns()-t_total) /1e9:.2f} sec.')
     
     t = time.perf_counter_ns()    
@@ -57,12 +58,23 @@ if __name__ == "__main__":
     datetime_str (string, required) | Time of day - should be in %Y-%m-%dT%H:%M:%S%z format
     --ray_count (int, default=128) | Number of rays to cast from each sensor
     --verbose (bool, default=False) | Be verbose.
+    --multi_sensor | Measure all sensors with one multi_irradiancemeter (JIT variant, see multi_irradiancemeter.py).
+    --merge_obstacles | Tessellate the obstacle primitives and merge them into one mesh per primitive type.
+    --instance_obstacles | Share the geometry of obstacle entities with identical shape (Mitsuba shapegroup/instance).
+    --load_threads (int, default=0) | Worker threads of the scene loading (0 = all cores, 1 = serial).
+    --cull_distance (float) | Drop obstacle entities farther (m, horizontally) from the sensors (see culling.py).
+    --cull_elevation (float) | Drop obstacle entities that can only shade the sensors below this elevation (deg, 0 = below all sensors).
+    --tiles (int, default=0) | Surround the plot by this many rings of instanced copies of its geometry (obstacles only), see README.
+    --tile_period (float float) | Tile offsets in X and Z (m), the planting pitch of the plot (required with --tiles, > 0).
+    --snapshot_dir (string) | Cache the processed scene in this directory, repeated runs on the same scene file load it (see snapshot.py).
+    --spatial_order | Batch and multi sensor: measure the sensors of primitive scenes in Morton order (see spatial_order.py), the results stay in file order.
     """
 
     import argparse
 
     # example CMD
     # python render.py data/t700.mesh 48.21 16.36 2022-08-23T10:34:48+00:00
+    # python render.py data/t700.mesh 48.21 16.36 2022-08-23T10:34:48+00:00 --snapshot_dir tmp/snapshots
 
     parser = argparse.ArgumentParser(description='Irradaince measurment tool based on Mitsuba 3.')
     parser.add_argument('scene_path', type=str, help='Path of the simulation scene file.')
@@ -73,9 +85,23 @@ if __name__ == "__main__":
     parser.add_argument('--epw_path', type=str, default=None, help='EnergyPlus Weather File (EPW) path')    
     parser.add_argument('--end_datetime_str', type=str, default=None, help='End Date and time - should be in %Y-%m-%dT%H:%M:%S%z format')
     parser.add_argument('--verbose', type=bool, default=False, help='Number of rays per element.')
+    parser.add_argument('--trace', type=str, default=None, help='Chrome trace (JSON) output path.')
+    parser.add_argument('--multi_sensor', action='store_true', help='Measure all sensors with one multi_irradiancemeter (JIT variant).')
+    parser.add_argument('--merge_obstacles', action='store_true', help='Merge the obstacle primitives into one mesh per primitive type.')
+    parser.add_argument('--instance_obstacles', action='store_true', help='Instance obstacle entities with identical geometry.')
+    parser.add_argument('--load_threads', type=int, default=0, help='Worker threads of the scene loading (0 = all cores, 1 = serial).')
+    parser.add_argument('--cull_distance', type=float, default=None, help='Drop obstacle entities farther (m) from the sensors.')
+    parser.add_argument('--cull_elevation', type=float, default=None, help='Drop obstacle entities that only shade the sensors below this elevation (deg).')
+    parser.add_argument('--tiles', type=int, default=0, help='Rings of instanced copies of the plot around it (obstacles only).')
+    parser.add_argument('--tile_period', type=float, nargs=2, default=None, help='Tile offsets in X and Z (m), the plot pitch (required with --tiles).')
+    parser.add_argument('--snapshot_dir', type=str, default=None, help='Directory of the processed scene snapshots.')
+    parser.add_argument('--spatial_order', action='store_true', help='Measure the sensors of primitive scenes in Morton order (batch and multi sensor).')
 
     args = parser.parse_args()
 
+    if args.tiles > 0 and (args.tile_period is None or min(args.tile_period) <= 0):
+        parser.error('--tiles needs a positive --tile_period X Z (the planting pitch of the plot)')
+
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
         #logging.basicConfig(level=logging.DEBUG)
@@ -83,4 +109,8 @@ if __name__ == "__main__":
         logging.basicConfig(level=logging.ERROR)
 
     logging.debug(f'Args: {args}')
-    main(args.scene_path, args.lat, args.long, args.datetime_str, args.ray_count, args.epw_path, args.end_datetime_str, _show_render=False)
\ No newline at end of file
+
+    if args.trace is not None:
+        tracing.enable(args.trace)
+
+    main(args.scene_path, args.lat, args.long, args.datetime_str, args.ray_count, args.epw_path, args.end_datetime_str, _show_render=False, _use_multi_sensor=args.multi_sensor, _merge_obstacles=args.merge_obstacles, _instance_obstacles=args.instance_obstacles, _load_threads=args.load_threads, _cull_distance=args.cull_distance, _cull_elevation=args.cull_elevation, _tile_count=args.tiles, _tile_period=args.tile_period, _snapshot_dir=args.snapshot_dir, _spatial_order=args.spatial_order)
\ No newline at end of file
@@ -0,0 +1,311 @@
+import logging
+import numpy as np
+import binary_loader
+import tessellation
+
+"""
+Deterministic synthetic simulation scenes for benchmarks and tests.
+
+A field of plants on a jittered grid, every plant (entity) has stems (stacked cylinders), leaves (rectangles)
+attached along the stem and buds (spheres) at the top. The scene is kept in the columnar layout of
+binary_loader.load_binary_primitives_columnar and can be encoded in the formats 1, 2 and 3.
+"""
+
+
+def random_rotations(_rng, _count):
+    '''
+    Uniformly distributed rotation matrices (N,3,3) from random unit quaternions.
+    '''
+    q = _rng.normal(size=(_count, 4))
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    w, x, y, z = q.T
+    return np.stack([
+        1-2*(y*y+z*z), 2*(x*y-z*w), 2*(x*z+y*w),
+        2*(x*y+z*w), 1-2*(x*x+z*z), 2*(y*z-x*w),
+        2*(x*z-y*w), 2*(y*z+x*w), 1-2*(x*x+y*y),
+    ], axis=1).reshape((_count, 3, 3))
+
+
+def tilt_rotations(_rng, _count, _sigma=0.1):
+    '''
+    Rotations (N,3,3) by a small random angle (radians, normal distributed) around a random horizontal axis.
+    '''
+    phi = _rng.uniform(0.0, 2.0*np.pi, _count)
+    angle = _rng.normal(0.0, _sigma, _count)
+    x, z = np.cos(phi), np.sin(phi) # axis (x, 0, z)
+    K = np.zeros((_count, 3, 3)) # cross product matrix of the axis
+    K[:, 0, 1] = -z; K[:, 1, 0] = z
+    K[:, 1, 2] = -x; K[:, 2, 1] = x
+    return np.eye(3) + np.sin(angle)[:, None, None] * K + (1.0 - np.cos(angle))[:, None, None] * (K @ K)
+
+
+def to_matrix(_linear, _translation):
+    '''
+    Row major 4x3 matrices (N,12) as used by the binary formats: [ x.X, y.X, z.X, t.X, x.Y, y.Y, z.Y, t.Y, x.Z, y.Z, z.Z, t.Z ]
+    '''
+    return np.concatenate([_linear, _translation[:, :, None]], axis=2).reshape((-1, 12)).astype(np.float32)
+
+
+def create_field(_plants=100, _leaves=20, _stems=4, _buds=1, _sensor_ratio=0.5, _seed=0, _spacing=0.5, _variants=0):
+    '''
+    Returns the columnar scene (see binary_loader.load_binary_primitives_columnar, format 3) of _plants plants
+    with _leaves rectangles, _stems cylinders and _buds spheres each. Every primitive is a sensor with probability _sensor_ratio.
+    With _variants > 0 the plants are copies of _variants different plants (incl. the sensor flags), rotated around +Y.
+    '''
+    rng = np.random.default_rng(_seed)
+
+    side = int(np.ceil(np.sqrt(_plants)))
+    grid = np.stack(np.unravel_index(np.arange(_plants), (side, side)), axis=1) * _spacing
+    roots = np.zeros((_plants, 3))
+    roots[:, [0, 2]] = grid + rng.uniform(-0.2, 0.2, (_plants, 2)) * _spacing
+
+    if _variants > 0:
+        templates = create_field(_variants, _leaves, _stems, _buds, _sensor_ratio, _seed + 1, _spacing=0.0)
+        angles = rng.uniform(0.0, 2.0*np.pi, _plants)
+        rotations = np.zeros((_plants, 3, 3))
+        rotations[:, 0, 0] = np.cos(angles); rotations[:, 0, 2] = np.sin(angles); rotations[:, 1, 1] = 1.0
+        rotations[:, 2, 0] = -np.sin(angles); rotations[:, 2, 2] = np.cos(angles)
+        return replicate(templates, _variants, roots, rotations)
+
+    heights = rng.uniform(0.3, 1.5, _plants)
+
+    plant = lambda count: np.repeat(np.arange(_plants), count)
+    along = lambda count: (np.tile(np.arange(count), _plants) + rng.uniform(0.0, 1.0, _plants * count)) / max(count, 1)
+
+    # stems: stacked segments along +Y with a small random tilt
+    stem_plant = plant(_stems)
+    segment_length = heights[stem_plant] / max(_stems, 1)
+    tilt = tilt_rotations(rng, len(stem_plant))
+    stem_base = roots[stem_plant] + np.outer(np.tile(np.arange(_stems), _plants) * segment_length, [0, 1, 0])
+    stems = {
+        'length': segment_length.astype(np.float32),
+        'radius': rng.uniform(0.003, 0.01, len(stem_plant)).astype(np.float32),
+        'matrix': to_matrix(tilt, stem_base),
+    }
+
+    # leaves: randomly oriented rectangles along the stem
+    leaf_plant = plant(_leaves)
+    leaf_size = rng.uniform(0.02, 0.08, (len(leaf_plant), 1, 1))
+    leaf_center = roots[leaf_plant] + np.outer(along(_leaves) * heights[leaf_plant], [0, 1, 0]) + rng.normal(0.0, 0.05, (len(leaf_plant), 3))
+    leaves = {
+        'matrix': to_matrix(random_rotations(rng, len(leaf_plant)) * leaf_size, leaf_center),
+    }
+
+    # buds: spheres at the top of the stem
+    bud_plant = plant(_buds)
+    buds = {
+        'center': (roots[bud_plant] + np.outer(heights[bud_plant], [0, 1, 0]) + rng.normal(0.0, 0.02, (len(bud_plant), 3))).astype(np.float32),
+        'radius': rng.uniform(0.005, 0.02, len(bud_plant)).astype(np.float32),
+    }
+
+    # per plant order: stems, leaves, buds
+    per_plant = _stems + _leaves + _buds
+    columns = {'disk': {'matrix': np.zeros((0, 12), dtype=np.float32)}}
+    for name, column, count, first in [('cylinder', stems, _stems, 0), ('rectangle', leaves, _leaves, _stems), ('sphere', buds, _buds, _stems + _leaves)]:
+        surface = np.tile(np.arange(count), _plants) + first
+        column['entity'] = plant(count).astype(np.uint32)
+        column['surface'] = surface.astype(np.uint32)
+        column['index'] = (column['entity'] * per_plant + surface).astype(np.uint32)
+        column['is_sensor'] = rng.random(len(surface)) < _sensor_ratio
+        columns[name] = column
+    for key in ['entity', 'surface', 'index']:
+        columns['disk'][key] = np.zeros(0, dtype=np.uint32)
+    columns['disk']['is_sensor'] = np.zeros(0, dtype=bool)
+
+    return {'format': 3, 'columnar': True, 'primitives': columns, 'entity_count': _plants}
+
+
+def replicate(_templates, _variants, _roots, _rotations):
+    '''
+    Field of plants copied from the plants of _templates (plant i from template i % _variants), rotated and moved to the roots.
+    '''
+    plants = len(_roots)
+    template = np.arange(plants) % _variants
+    columns = {}
+    for name, column in _templates['primitives'].items():
+        count = len(column['entity']) // _variants
+        rows = (template[:, None] * count + np.arange(count)).ravel()
+        plant = np.repeat(np.arange(plants), count)
+        out = {key: column[key][rows] for key in column.keys()}
+        if 'matrix' in column:
+            matrix = out['matrix'].reshape((-1, 3, 4)).astype(np.float64)
+            out['matrix'] = to_matrix(_rotations[plant] @ matrix[:, :, :3], np.einsum('nij,nj->ni', _rotations[plant], matrix[:, :, 3]) + _roots[plant])
+        if 'center' in column:
+            out['center'] = (np.einsum('nij,nj->ni', _rotations[plant], out['center'].astype(np.float64)) + _roots[plant]).astype(np.float32)
+        out['entity'] = plant.astype(np.uint32)
+        columns[name] = out
+
+    # file order index: plants are stored one after the other with the same number of primitives
+    per_plant = sum(len(column['entity']) for column in _templates['primitives'].values()) // _variants
+    for column in columns.values():
+        column['index'] = (column['entity'] * per_plant + column['surface']).astype(np.uint32)
+
+    return {'format': 3, 'columnar': True, 'primitives': columns, 'entity_count': plants}
+
+
+def scatter(_buffer, _positions, _values):
+    '''
+    Writes the bytes of _values (one record per position) to _buffer at _positions.
+    '''
+    if len(_positions) == 0:
+        return
+    values = np.ascontiguousarray(_values)
+    record_bytes = values.view(np.uint8).reshape((len(_positions), -1))
+    _buffer[_positions[:, None] + np.arange(record_bytes.shape[1])] = record_bytes
+
+
+def flatten_columns(_scene):
+    '''
+    Primitive type, row in the type's record array, entity and sensor flag of all primitives in file order,
+    and the payload records (see binary_loader.primitive_dtypes) of every type.
+    '''
+    types = []; rows = []; entity = []; is_sensor = []; index = []
+    records = {}
+    for type_id, name in binary_loader.primitive_names.items():
+        column = _scene['primitives'][name]
+        dtype = binary_loader.primitive_dtypes[type_id]
+        records[type_id] = np.zeros(len(column['index']), dtype=dtype)
+        for field in dtype.names:
+            records[type_id][field] = column[field]
+        types.append(np.full(len(column['index']), type_id, dtype=np.uint8))
+        rows.append(np.arange(len(column['index'])))
+        entity.append(column['entity']); is_sensor.append(column['is_sensor']); index.append(column['index'])
+
+    order = np.argsort(np.concatenate(index), kind='stable')
+    flat = [np.concatenate(v)[order] for v in [types, rows, entity, is_sensor]]
+    return flat, records
+
+
+def encode_sections(_sections, _entity_count, _record_size, _write_record, _header=b''):
+    '''
+    Encodes entity sections (uint32 entitiesCount, per entity uint32 surfacesCount followed by the records).
+    _sections is a list of (entity array, record ids) with records sorted by entity.
+    '''
+    sizes = []
+    for entity, records in _sections:
+        sizes.append(4 + 4 * _entity_count + int(np.sum(_record_size[records])))
+    buffer = np.zeros(len(_header) + sum(sizes), dtype=np.uint8)
+    buffer[:len(_header)] = np.frombuffer(_header, dtype=np.uint8)
+
+    start = len(_header)
+    for (entity, records), size in zip(_sections, sizes):
+        counts = np.bincount(entity, minlength=_entity_count).astype('<u4')
+        record_size = _record_size[records]
+        # byte position of each record: entity headers up to and incl. its own + all previous records
+        position = start + 4 + 4 * (entity.astype(np.int64) + 1) + np.concatenate([[0], np.cumsum(record_size)[:-1]]).astype(np.int64)
+        entity_position = start + 4 + 4 * np.arange(_entity_count) + np.concatenate([[0], np.cumsum(np.bincount(entity, weights=record_size, minlength=_entity_count))[:-1]]).astype(np.int64)
+        scatter(buffer, np.array([start]), np.array([_entity_count], dtype='<u4'))
+        scatter(buffer, entity_position, counts)
+        _write_record(buffer, position, records)
+        start += size
+
+    return buffer.tobytes()
+
+
+def encode_primitives(_scene, _format=3):
+    '''
+    Encodes a columnar primitive scene as format 2 or 3.
+    '''
+    (types, rows, entity, is_sensor), records = flatten_columns(_scene)
+    item_size = np.zeros(256, dtype=np.int64)
+    for type_id, dtype in binary_loader.primitive_dtypes.items():
+        item_size[type_id] = dtype.itemsize
+    record_size = 1 + item_size[types] + (1 if _format == 3 else 0)
+
+    def write_record(buffer, position, select):
+        buffer[position] = types[select]
+        for type_id in binary_loader.primitive_dtypes:
+            of_type = types[select] == type_id
+            scatter(buffer, position[of_type] + 1, records[type_id][rows[select][of_type]])
+        if _format == 3:
+            buffer[position + 1 + item_size[types[select]]] = is_sensor[select]
+
+    all_records = np.arange(len(types))
+    if _format == 3:
+        sections = [(entity, all_records)]
+    else:
+        sections = [(entity[~is_sensor], all_records[~is_sensor]), (entity[is_sensor], all_records[is_sensor])]
+
+    return encode_sections(sections, _scene['entity_count'], record_size, write_record, bytes([_format]))
+
+
+def encode_meshes(_scene):
+    '''
+    Encodes a columnar primitive scene as triangle meshes (format 1), every primitive becomes one surface.
+    '''
+    (types, rows, entity, is_sensor), _ = flatten_columns(_scene)
+
+    meshes = {type_id: tessellation.tessellate(type_id, _scene['primitives'][name]) for type_id, name in binary_loader.primitive_names.items()}
+    point_count = np.zeros(256, dtype=np.int64)
+    triangle_count = np.zeros(256, dtype=np.int64)
+    for type_id, (points, triangles) in meshes.items():
+        point_count[type_id] = points.shape[1]
+        triangle_count[type_id] = len(triangles)
+
+    # points of every primitive in file order
+    point_offsets = np.concatenate([[0], np.cumsum(point_count[types])]).astype(np.int64)
+    points = np.zeros((point_offsets[-1], 3), dtype='<f4')
+    for type_id, (type_points, _) in meshes.items():
+        of_type = np.flatnonzero(types == type_id)
+        points[point_offsets[of_type][:, None] + np.arange(point_count[type_id])] = type_points[rows[of_type]]
+
+    record_size = 1 + 12 * triangle_count[types]
+
+    def write_record(buffer, position, select):
+        buffer[position] = triangle_count[types[select]]
+        for type_id, (_, triangles) in meshes.items():
+            of_type = types[select] == type_id
+            indices = triangles[None].astype('<u4') + point_offsets[select][of_type, None, None].astype('<u4')
+            scatter(buffer, position[of_type] + 1, indices.reshape((-1, triangles.size)))
+
+    all_records = np.arange(len(types))
+    sections = [(entity[~is_sensor], all_records[~is_sensor]), (entity[is_sensor], all_records[is_sensor])]
+    payload = encode_sections(sections, _scene['entity_count'], record_size, write_record, bytes([1]))
+
+    return payload + np.array([len(points)], dtype='<u4').tobytes() + points.tobytes()
+
+
+def encode(_scene, _format=3):
+    if _format == 1:
+        return encode_meshes(_scene)
+    return encode_primitives(_scene, _format)
+
+
+if __name__ == "__main__":
+
+    """
+    Options:
+    -h,--help | Print this help message and exit
+    out_path (string, required) | Path of the generated scene
+    --format (int, default=3) | Binary format (1 = meshes, 2 = clustered primitives, 3 = interleaved primitives)
+    --plants, --leaves, --stems, --buds (int) | Field size and primitives per plant
+    --sensor_ratio (float, default=0.5) | Probability of a primitive to be a sensor
+    --seed (int, default=0) | Random seed
+    --variants (int, default=0) | Plants are rotated copies of this many different plants (0 = all plants differ)
+    """
+
+    import argparse
+
+    # example CMD
+    # python scene_generator.py data/field.prim --plants 1000 --leaves 50
+
+    parser = argparse.ArgumentParser(description='Generates synthetic simulation scenes.')
+    parser.add_argument('out_path', type=str, help='Path of the generated scene file.')
+    parser.add_argument('--format', type=int, default=3, help='Binary format (1, 2 or 3).')
+    parser.add_argument('--plants', type=int, default=100, help='Number of plants (entities).')
+    parser.add_argument('--leaves', type=int, default=20, help='Number of leaves (rectangles) per plant.')
+    parser.add_argument('--stems', type=int, default=4, help='Number of stem segments (cylinders) per plant.')
+    parser.add_argument('--buds', type=int, default=1, help='Number of buds (spheres) per plant.')
+    parser.add_argument('--sensor_ratio', type=float, default=0.5, help='Probability of a primitive to be a sensor.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--variants', type=int, default=0, help='Number of different plants (0 = all plants differ).')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    scene = create_field(args.plants, args.leaves, args.stems, args.buds, args.sensor_ratio, args.seed, _variants=args.variants)
+    payload = encode(scene, args.format)
+    with open(args.out_path, 'wb') as f:
+        f.write(payload)
+    logging.info(f'Scene (format {args.format}, {args.plants * (args.leaves + args.stems + args.buds)} primitives, {len(payload)} bytes) saved to: {args.out_path}')
@@ -0,0 +1,117 @@
+import collections, hashlib, logging
+import numpy as np
+
+"""
+LRU cache of the instantiated Mitsuba obstacle shapes of every entity, across the scenes of consecutive requests
+(see RendererMts3.load_sim_scene_columns).
+
+An entity is keyed by a hash of its decoded primitive data (format, entity id, primitive types, surface ids and parameters),
+so a new or changed entity misses and its shapes are built by the mi.load_dict of the scene, an unchanged entity reuses its shapes.
+The shapes of the missed entities are taken from the loaded scene (add_loaded). The cache is bounded by an estimate of the memory
+held by the shapes, the least recently used entities are evicted. Shapes changed in place by a persistent scene update
+(see RendererMts3.update_primitives) no longer match their key and are discarded.
+"""
+
+SHAPE_BYTES = 1024 # estimated memory of an analytic Mitsuba shape (object, transforms, bounding box)
+
+_PARAMETER_KEYS = ['matrix', 'center', 'length', 'radius']
+
+
+def entity_keys(_format, _columns):
+    '''
+    Hash of the primitive data of every entity in the columns (type id -> dict of arrays), returns {entity id: key}.
+    '''
+    hashes = {}
+    for type_id, column in _columns.items():
+        if len(column['entity']) == 0:
+            continue
+        entity = np.asarray(column['entity'])
+        fields = [np.full((len(entity), 1), type_id, dtype=np.uint32).view(np.uint8), np.asarray(column['surface'], dtype=np.uint32)[:, None].view(np.uint8)]
+        fields += [np.asarray(column[key], dtype=np.float32).reshape((len(entity), -1)).view(np.uint8) for key in _PARAMETER_KEYS if key in column]
+        records = np.ascontiguousarray(np.concatenate(fields, axis=1))
+
+        order = np.argsort(entity, kind='stable')
+        entities, starts = np.unique(entity[order], return_index=True)
+        for objk, block in zip(entities.tolist(), np.split(records[order], starts[1:])):
+            if objk not in hashes:
+                hashes[objk] = hashlib.sha1(bytes([_format]) + objk.to_bytes(4, 'little'))
+            hashes[objk].update(block.tobytes())
+    return {objk: h.hexdigest() for objk, h in hashes.items()}
+
+
+class ShapeCache():
+
+    def __init__(self, _max_bytes):
+        self.max_bytes = _max_bytes
+        self.entries = collections.OrderedDict() # key -> ({shape name: mi.Shape}, bytes), least recently used first
+        self.pending = {} # key -> shape names, built by the next scene load
+        self.keys = {} # shape name -> key of the cached entity
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, _key):
+        '''
+        Shapes of an entity ({name: mi.Shape}) or None, the entity becomes the most recently used.
+        '''
+        entry = self.entries.get(_key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(_key)
+        return entry[0]
+
+    def expect(self, _key, _names):
+        '''
+        The shapes _names of a missed entity are added to the scene as dicts and cached by add_loaded.
+        '''
+        self.pending[_key] = _names
+
+    def add_loaded(self, _scene):
+        '''
+        Caches the shapes of the pending entities from the loaded scene and evicts the least recently used entities.
+        '''
+        if len(self.pending) > 0:
+            shapes = {shape.id(): shape for shape in _scene.shapes()}
+            for key, names in self.pending.items():
+                self.put(key, {name: shapes[name] for name in names})
+            self.pending = {}
+        self.evict()
+        logging.info(f'Shape cache: {self.hits} hits, {self.misses} misses (hit rate {self.hit_rate():.2f}), {len(self.entries)} entities, {self.bytes / 2**20:.1f} MiB')
+
+    def put(self, _key, _shapes):
+        self.remove(_key)
+        size = len(_shapes) * SHAPE_BYTES
+        self.entries[_key] = (_shapes, size)
+        self.keys.update({name: _key for name in _shapes})
+        self.bytes += size
+
+    def remove(self, _key):
+        entry = self.entries.pop(_key, None)
+        if entry is None:
+            return
+        for name in entry[0]:
+            if self.keys.get(name) == _key:
+                del self.keys[name]
+        self.bytes -= entry[1]
+
+    def discard(self, _names):
+        '''
+        Removes the entities of the shapes _names (e.g. moved by an in-place update), their shapes do not match the cached data.
+        '''
+        for key in set(self.keys[name] for name in _names if name in self.keys):
+            self.remove(key)
+
+    def evict(self):
+        while self.bytes > self.max_bytes and len(self.entries) > 0:
+            self.remove(next(iter(self.entries)))
+
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def clear(self):
+        self.entries.clear()
+        self.pending = {}
+        self.keys = {}
+        self.bytes = 0
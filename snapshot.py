@@ -0,0 +1,97 @@
+import hashlib, json, logging, os, shutil
+import numpy as np
+import binary_loader
+
+"""
+On-disk snapshots of processed scenes, for repeated offline runs on the same scene file (see RendererMts3.load_snapshot_path).
+
+A snapshot is a directory named by the hash of the scene file and the options that change the processed geometry:
+
+    snapshot.json   version, scene file name and the obstacle meshes [{name, file, twosided}]
+    scene.v4        the remaining scene data of a mesh scene (format 1, the sensors) as format 4 payload (see binary_loader.encode_v4)
+    scene.npz       or the remaining columns of a primitive scene (columnar, '<type>.<field>' arrays)
+    *.ply           the merged obstacle meshes (binary PLY without normals, Mitsuba's ply plugin computes them as for the in-memory meshes)
+
+The sun, sky, camera and sensors are not part of it, so the time, spp and EPW window can change between the runs.
+Snapshots are written to a temporary directory that is renamed when complete and are never evicted.
+"""
+
+SNAPSHOT_VERSION = 2 # part of the key, increase when the snapshot contents change
+
+
+def scene_key(_path, _options, _chunk_size=1<<20):
+    '''
+    Hash of the scene file contents and the options (JSON serializable).
+    '''
+    h = hashlib.sha1(json.dumps({'version': SNAPSHOT_VERSION, **_options}, sort_keys=True).encode())
+    with open(_path, 'rb') as f:
+        while True:
+            chunk = f.read(_chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def snapshot_path(_directory, _key):
+    return os.path.join(_directory, _key)
+
+
+def load(_directory, _key):
+    '''
+    Scene data and obstacle meshes [(name, PLY path, twosided)] of the snapshot, None if there is none.
+    '''
+    path = snapshot_path(_directory, _key)
+    try:
+        with open(os.path.join(path, 'snapshot.json'), 'r') as f:
+            info = json.load(f)
+    except FileNotFoundError:
+        return None
+    if info.get('version') != SNAPSHOT_VERSION:
+        return None
+
+    if info['columnar']:
+        columns = {}
+        with np.load(os.path.join(path, 'scene.npz')) as arrays:
+            for key in arrays.files:
+                name, field = key.split('.', 1)
+                columns.setdefault(name, {})[field] = arrays[key]
+        scene_data = {'format': info['format'], 'columnar': True, 'primitives': columns}
+    else:
+        scene_data = binary_loader.load_path(os.path.join(path, 'scene.v4'), _columnar=True)
+
+    meshes = [(mesh['name'], os.path.join(path, mesh['file']), mesh['twosided']) for mesh in info['meshes']]
+    logging.info(f"Scene snapshot loaded: {path} ({info['scene']})")
+    return scene_data, meshes
+
+
+def save(_directory, _key, _scene_path, _scene_data, _meshes):
+    '''
+    Writes a snapshot of the scene data (columnar or format 1) and the obstacle meshes {name: (mi.Mesh, twosided)},
+    returns the same as load. An existing snapshot of the key (written concurrently) is kept.
+    '''
+    path = snapshot_path(_directory, _key)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    os.makedirs(tmp_path, exist_ok=True)
+
+    columnar = _scene_data.get('columnar', False)
+    if columnar:
+        arrays = {f'{name}.{field}': np.asarray(values) for name, column in _scene_data['primitives'].items() for field, values in column.items()}
+        np.savez(os.path.join(tmp_path, 'scene.npz'), **arrays)
+    else:
+        with open(os.path.join(tmp_path, 'scene.v4'), 'wb') as f:
+            f.write(binary_loader.encode_v4(_scene_data))
+
+    info = {'version': SNAPSHOT_VERSION, 'scene': os.path.basename(_scene_path), 'format': _scene_data['format'], 'columnar': columnar, 'meshes': []}
+    for name, (mesh, twosided) in _meshes.items():
+        mesh.write_ply(os.path.join(tmp_path, f'{name}.ply'))
+        info['meshes'].append({'name': name, 'file': f'{name}.ply', 'twosided': twosided})
+    with open(os.path.join(tmp_path, 'snapshot.json'), 'w') as f:
+        json.dump(info, f, indent=1)
+
+    try:
+        os.rename(tmp_path, path)
+        logging.info(f'Scene snapshot written: {path}')
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return load(_directory, _key)
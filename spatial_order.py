@@ -0,0 +1,81 @@
+import numpy as np
+import binary_loader
+import culling
+
+"""
+Spatially coherent order of the sensors in the batch (or multi) sensor film.
+
+The sensors are measured in the order of their 'index' (position in the file, see RendererMts3.load_sim_scene_columns),
+neighbouring film pixels can be surfaces on opposite sides of the field. reorder_sensors renumbers the sensors of a columnar
+scene by the Morton key of their bounding box centers, so the rays of neighbouring pixels (traced by the same render block)
+start close to each other and traverse the same acceleration structure nodes. The returned permutation restores the file order
+of the measurements (unpermute).
+"""
+
+MORTON_BITS = 10 # per axis, 30 bit keys
+
+
+def spread_bits(_values):
+    '''
+    Inserts two zero bits between the lower MORTON_BITS bits of every value.
+    '''
+    x = _values.astype(np.uint64) & 0x3ff
+    x = (x | (x << 16)) & 0x030000ff
+    x = (x | (x << 8)) & 0x0300f00f
+    x = (x | (x << 4)) & 0x030c30c3
+    x = (x | (x << 2)) & 0x09249249
+    return x
+
+
+def morton_keys(_points):
+    '''
+    Morton (Z-order) keys of (N,3) points, quantized within their bounding box.
+    '''
+    lower = np.min(_points, axis=0)
+    extent = np.maximum(np.max(_points, axis=0) - lower, 1e-9)
+    cells = np.clip((_points - lower) / extent * (1 << MORTON_BITS), 0, (1 << MORTON_BITS) - 1).astype(np.uint64)
+    return (spread_bits(cells[:, 0]) << 2) | (spread_bits(cells[:, 1]) << 1) | spread_bits(cells[:, 2])
+
+
+def reorder_sensors(_scene_data):
+    '''
+    Columnar scene data with the sensor index renumbered in Morton order of the sensor centers and the permutation
+    (film position -> file order rank of the sensor), see unpermute.
+    '''
+    columns = _scene_data['primitives']
+    index = []; centers = []; rows = []
+    for type_id, name in binary_loader.primitive_names.items():
+        column = columns.get(name)
+        if column is None or len(column['index']) == 0:
+            continue
+        sensor_rows = np.flatnonzero(np.asarray(column['is_sensor'], dtype=bool))
+        lower, upper = culling.primitive_bounds(type_id, {key: np.asarray(values)[sensor_rows] for key, values in column.items()})
+        index.append(np.asarray(column['index'])[sensor_rows]); centers.append(0.5 * (lower + upper)); rows.append((name, sensor_rows))
+    if len(index) == 0 or sum(len(i) for i in index) == 0:
+        return _scene_data, None
+
+    index = np.concatenate(index)
+    rank = np.empty(len(index), dtype=np.int64)
+    rank[np.argsort(index, kind='stable')] = np.arange(len(index)) # file order rank of every sensor
+    order = np.argsort(morton_keys(np.concatenate(centers)), kind='stable')
+    new_index = np.empty(len(index), dtype=np.int64)
+    new_index[order] = np.arange(len(index))
+
+    out = dict(columns)
+    start = 0
+    for name, sensor_rows in rows:
+        column_index = np.array(columns[name]['index'], dtype=np.int64)
+        # only the order of the sensors depends on the index, the obstacles keep theirs
+        column_index[sensor_rows] = new_index[start:start + len(sensor_rows)]
+        out[name] = {**columns[name], 'index': column_index}
+        start += len(sensor_rows)
+    return {**_scene_data, 'primitives': out}, rank[order]
+
+
+def unpermute(_measurements, _permutation):
+    '''
+    Measurements (film order) in the file order of the sensors.
+    '''
+    out = np.empty_like(_measurements)
+    out[_permutation] = _measurements
+    return out
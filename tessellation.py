@@ -0,0 +1,106 @@
+import numpy as np
+
+"""
+Vectorized triangulation of the scene primitives, following the conventions of RendererMts3.disk/cylinder/sphere/rectangle:
+
+    disk        unit disk in XZ (Mitsuba disk rotated by 90 deg around X), transformed by matrix
+    cylinder    open tube of radius along +Y from 0 to length, transformed by matrix
+    sphere      center, radius
+    rectangle   <-1,1> in XY, transformed by matrix
+
+The columns are dicts of arrays with one row per primitive (see binary_loader.primitive_dtypes), matrices are 4x3 row major.
+The polygons are scaled to the area (disk, sphere) or perimeter (cylinder) of the analytic shapes, so they occlude about as much.
+"""
+
+
+def ring(_segments, _radius=1.0):
+    angles = np.linspace(0.0, 2.0*np.pi, _segments, endpoint=False)
+    return np.stack([np.cos(angles), np.zeros(_segments), np.sin(angles)], axis=1) * _radius
+
+
+def area(_points, _triangles):
+    a, b, c = _points[_triangles[:, 0]], _points[_triangles[:, 1]], _points[_triangles[:, 2]]
+    return 0.5 * np.sum(np.linalg.norm(np.cross(b - a, c - a), axis=1))
+
+
+def unit_sphere(_segments):
+    '''
+    UV sphere with _segments longitudes and _segments/2 latitude bands, triangles wound outwards.
+    '''
+    bands = max(2, _segments // 2)
+    theta = np.linspace(0.0, np.pi, bands + 1)[1:-1]
+    phi = np.linspace(0.0, 2.0*np.pi, _segments, endpoint=False)
+    rings = np.stack([
+        np.sin(theta)[:, None] * np.cos(phi)[None],
+        np.broadcast_to(np.cos(theta)[:, None], (len(theta), _segments)),
+        np.sin(theta)[:, None] * np.sin(phi)[None],
+    ], axis=2).reshape((-1, 3))
+    points = np.concatenate([[[0, 1, 0]], rings, [[0, -1, 0]]])
+
+    i = np.arange(_segments); j = (i + 1) % _segments
+    bottom = len(points) - 1
+    triangles = [np.stack([np.zeros(_segments, dtype=np.int64), j + 1, i + 1], axis=1)]
+    for b in range(bands - 2):
+        upper = 1 + b * _segments; lower = upper + _segments
+        triangles.append(np.stack([upper + i, upper + j, lower + j], axis=1))
+        triangles.append(np.stack([upper + i, lower + j, lower + i], axis=1))
+    last = 1 + (bands - 2) * _segments
+    triangles.append(np.stack([np.full(_segments, bottom), last + i, last + j], axis=1))
+    triangles = np.concatenate(triangles)
+    return points * np.sqrt(4.0*np.pi / area(points, triangles)), triangles
+
+
+def tessellate(_type_id, _column, _segments=8):
+    '''
+    Returns the triangle mesh of every primitive in a column: points (N,V,3) float32 and local triangle indices (T,3).
+    Closed shapes (sphere, cylinder) are wound outwards in their local frame.
+    '''
+    if _type_id == 4: # sphere
+        local, triangles = unit_sphere(_segments)
+        points = _column['center'][:, None, :] + local[None] * _column['radius'][:, None, None]
+        return points.astype(np.float32), triangles
+
+    i = np.arange(_segments); j = (i + 1) % _segments
+    if _type_id == 8: # rectangle
+        local = np.array([[-1,-1,0], [1,-1,0], [1,1,0], [-1,1,0]], dtype=np.float64)
+        triangles = np.array([[0,1,2], [0,2,3]])
+    elif _type_id == 1: # disk
+        local = np.concatenate([[[0,0,0]], ring(_segments, np.sqrt(2.0*np.pi / (_segments * np.sin(2.0*np.pi / _segments))))])
+        triangles = np.stack([np.zeros(_segments, dtype=np.int64), i + 1, j + 1], axis=1)
+    else: # cylinder
+        tube = ring(_segments, np.pi / (_segments * np.sin(np.pi / _segments)))
+        local = np.concatenate([tube, tube], axis=0)
+        triangles = np.concatenate([np.stack([i, j + _segments, j], axis=1), np.stack([i, i + _segments, j + _segments], axis=1)])
+
+    count = len(_column['matrix'])
+    if _type_id == 2:
+        local = np.broadcast_to(local, (count,) + local.shape).copy()
+        local[:, :, [0, 2]] *= _column['radius'][:, None, None]
+        local[:, _segments:, 1] = _column['length'][:, None]
+    else:
+        local = np.broadcast_to(local, (count,) + local.shape)
+
+    matrix = np.asarray(_column['matrix'], dtype=np.float64).reshape((-1, 3, 4))
+    points = np.einsum('nij,nvj->nvi', matrix[:, :, :3], local) + matrix[:, None, :, 3]
+    return points.astype(np.float32), triangles
+
+
+def merge(_points, _triangles, _mirrored=None):
+    '''
+    Merges the per primitive meshes of tessellate into one vertex (N*V,3) and face (N*T,3) uint32 array.
+    The faces of mirrored primitives (negative determinant) are flipped to keep them wound outwards.
+    '''
+    count, vertex_count = _points.shape[:2]
+    offsets = (np.arange(count, dtype=np.int64) * vertex_count)[:, None, None]
+    faces = np.broadcast_to(_triangles[None], (count,) + _triangles.shape) + offsets
+    if _mirrored is not None and np.any(_mirrored):
+        faces = faces.copy()
+        faces[_mirrored] = faces[_mirrored][:, :, [0, 2, 1]]
+    return _points.reshape((-1, 3)), faces.reshape((-1, 3)).astype(np.uint32)
+
+
+def mirrored(_column):
+    if 'matrix' not in _column:
+        return None
+    matrix = np.asarray(_column['matrix'], dtype=np.float64).reshape((-1, 3, 4))
+    return np.linalg.det(matrix[:, :, :3]) < 0
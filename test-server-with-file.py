@@ -10,6 +10,16 @@ PLOT_ENV_DIFF_IMG = True
 TAMASHII_PATH = None #'F:/projects/agroeco-tamashii' #
 TEST_FILE = "./data/01174.prim"   
 
+if not os.path.exists(TEST_FILE):
+    # synthetic stand-in for the simulator dump, written to its own path so it is never taken for the dump
+    import scene_generator
+    TEST_FILE = "./data/synthetic.prim"
+    print(f'./data/01174.prim not found, using the synthetic scene {TEST_FILE}')
+    if not os.path.exists(TEST_FILE):
+        os.makedirs(os.path.dirname(TEST_FILE), exist_ok=True)
+        with open(TEST_FILE, 'wb') as f:
+            f.write(scene_generator.encode(scene_generator.create_field(_plants=100, _leaves=20), 3))
+
 #args = sys.argv[1:]
 #print('Args: ', args)
 #port = f"{int(args[0])}"
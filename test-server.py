@@ -64,6 +64,8 @@ try:
     headers = {"La": "0.0", "Lo": "0.0", "Ti": "2022-09-21T14:53:57+02:00", "TiE": "2022-09-22T14:53:57+02:00", "Ra": "128", 'Content-Type': 'application/octet-stream'}
     #optional header "Env": "true" returns the environment map
     #optional header "Cam": "camera matrix" returns the rendering as seen from position and rotation specified in the value
+    #optional header "Rf": "f32", "f16" or "u16" returns the versioned response format (see binary_response.py)
+    #optional header "Se": "4" adds the per-sensor standard error estimated from 4 independent passes (requires "Rf")
 
     data = bytearray()
     exampleV3(data)
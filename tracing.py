@@ -0,0 +1,74 @@
+import atexit, json, logging, os, threading, time
+from collections import deque
+from contextlib import nullcontext
+
+"""
+Structured timing spans written as Chrome trace events (open in chrome://tracing or https://ui.perfetto.dev).
+
+    with tracing.span('decode', bytes=len(data)):
+        ...
+
+Disabled by default, span() then returns a shared no-op context manager and records nothing.
+Enable with tracing.enable(path) or by setting the environment variable MTS3_TRACE=path, the trace is written on exit (or by calling write()).
+"""
+
+ENABLED = False
+
+_NULL_SPAN = nullcontext()
+_events = deque(maxlen=1000000) # oldest spans are dropped in long running processes
+_trace_path = None
+
+
+class Span():
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, _name, _args):
+        self.name = _name
+        self.args = _args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _events.append({
+            'name': self.name,
+            'ph': 'X', # complete event
+            'ts': self.start / 1e3, # microseconds
+            'dur': (end - self.start) / 1e3,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': self.args,
+        })
+        return False
+
+
+def span(_name, **_args):
+    if not ENABLED:
+        return _NULL_SPAN
+    return Span(_name, _args)
+
+
+def enable(_path):
+    global ENABLED, _trace_path
+    if not ENABLED:
+        atexit.register(write)
+    ENABLED = True
+    _trace_path = _path
+
+
+def write(_out_path=None):
+    '''
+    Writes all recorded spans (Chrome trace JSON), by default to the path given to enable().
+    '''
+    out_path = _out_path if _out_path is not None else _trace_path
+    if out_path is None or len(_events) == 0:
+        return
+    with open(out_path, 'w') as f:
+        json.dump({'traceEvents': list(_events), 'displayTimeUnit': 'ms'}, f)
+    logging.info(f'Trace ({len(_events)} spans) saved to: {out_path}')
+
+
+if os.environ.get('MTS3_TRACE'):
+    enable(os.environ['MTS3_TRACE'])